@@ -0,0 +1,860 @@
+"""
+Data structures for accumulating shots during a measurement
+"""
+############
+# Standard #
+############
+import time
+import logging
+import numbers
+import warnings
+import threading
+from collections import namedtuple, deque
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+
+logger = logging.getLogger(__name__)
+
+#Stream of the Events that hold every shot of a measurement
+SHOT_STREAM = 'shots'
+
+#Summary statistics of a single numeric field
+ShotStats = namedtuple('ShotStats', ['mean', 'median', 'std', 'min', 'max',
+                                     'sem', 'count'])
+
+
+def is_shot_stream(name):
+    """
+    Whether an event stream holds the pages of shots of a measurement
+
+    Plans interleaved by :func:`.merge_plans` suffix the stream with their
+    label, e.g ``shots_branch0``
+
+    Parameters
+    ----------
+    name : str
+        Name of the event stream
+
+    Returns
+    -------
+    shots : bool
+    """
+    return bool(name) and (name == SHOT_STREAM
+                           or name.startswith(SHOT_STREAM + '_'))
+
+
+def is_numeric(value):
+    """
+    Whether a value can be stored in a numeric column of a :class:`.ShotBuffer`
+
+    Parameters
+    ----------
+    value : object
+        Value reported in the event stream
+
+    Returns
+    -------
+    numeric : bool
+        True for real scalars, False for strings, arrays and everything else
+    """
+    return (isinstance(value, (numbers.Real, np.number, np.bool_))
+            and np.ndim(value) == 0)
+
+
+class ShotBuffer:
+    """
+    Preallocated, columnar storage for a series of shots
+
+    Each numeric field is given a row in a single two-dimensional array so that
+    the statistics of every field can be computed in one vectorized pass.
+    Fields that can not be stored as a float, e.g strings or arrays, only have
+    their most recent value kept.
+
+    Parameters
+    ----------
+    capacity : int, optional
+        Number of shots to preallocate space for. The buffer grows if more
+        shots are added
+
+    Example
+    -------
+    .. code::
+
+        buf = ShotBuffer(capacity=10)
+        buf.append({'centroid' : 250.0, 'name' : 'yag'})
+        buf.stats()['centroid'].mean
+    """
+    def __init__(self, capacity=1):
+        self.capacity = max(int(capacity), 1)
+        self.fields   = dict()
+        self.last     = dict()
+        self._data    = np.full((0, self.capacity), np.nan)
+        self._count   = 0
+
+
+    def __len__(self):
+        return self._count
+
+
+    @property
+    def numeric_fields(self):
+        """
+        Names of all the fields stored as numeric columns
+        """
+        return list(self.fields.keys())
+
+
+    def column(self, key):
+        """
+        View of the stored shots for a single numeric field
+
+        Parameters
+        ----------
+        key : str
+            Field name
+
+        Returns
+        -------
+        column : np.ndarray
+            Values of the field for each shot, missing values are NaN
+        """
+        return self._data[self.fields[key], :self._count]
+
+
+    def _add_field(self, key):
+        """
+        Allocate a new numeric row, backfilling previous shots with NaN
+        """
+        self.fields[key] = len(self.fields)
+        self._data = np.vstack([self._data,
+                                np.full((1, self.capacity), np.nan)])
+
+
+    def _grow(self):
+        """
+        Double the capacity of the buffer
+        """
+        logger.debug("Growing shot buffer from %s shots", self.capacity)
+        extra = np.full((self._data.shape[0], self.capacity), np.nan)
+        self._data = np.hstack([self._data, extra])
+        self.capacity *= 2
+
+
+    def append(self, shot):
+        """
+        Add a shot to the buffer
+
+        Parameters
+        ----------
+        shot : dict
+            Field name and value pairs for a single shot
+        """
+        if self._count >= self.capacity:
+            self._grow()
+        self._store(shot, self._count)
+        self._count += 1
+
+
+    def _store(self, shot, column):
+        """
+        Write a shot into a column of the buffer
+        """
+        self._data[:, column] = np.nan
+        for key, value in shot.items():
+            self.last[key] = value
+            if key not in self.fields:
+                if not is_numeric(value):
+                    continue
+                self._add_field(key)
+            #Previously numeric fields that report garbage are NaN
+            try:
+                self._data[self.fields[key], column] = value
+            except (TypeError, ValueError):
+                self._data[self.fields[key], column] = np.nan
+
+
+    def clear(self):
+        """
+        Empty the buffer, keeping the allocated memory
+        """
+        self._data[:] = np.nan
+        self.last.clear()
+        self._count = 0
+
+
+    def stats(self):
+        """
+        Compute the statistics of every field
+
+        Returns
+        -------
+        stats : dict
+            Numeric fields map to a :class:`.ShotStats`, all other fields map to
+            the last value reported
+        """
+        stats = dict((key, value) for key, value in self.last.items()
+                     if key not in self.fields)
+        if not self._count or not self.fields:
+            return stats
+        data = self._data[:, :self._count]
+        #Empty or all-NaN rows return NaN instead of warning
+        with warnings.catch_warnings(), np.errstate(all='ignore'):
+            warnings.simplefilter('ignore', RuntimeWarning)
+            count  = np.sum(~np.isnan(data), axis=1)
+            mean   = np.nanmean(data, axis=1)
+            median = np.nanmedian(data, axis=1)
+            std    = np.nanstd(data, axis=1, ddof=1)
+            low    = np.nanmin(data, axis=1)
+            high   = np.nanmax(data, axis=1)
+            sem    = std / np.sqrt(count)
+        for key, row in self.fields.items():
+            stats[key] = ShotStats(mean=mean[row], median=median[row],
+                                   std=std[row], min=low[row],
+                                   max=high[row], sem=sem[row],
+                                   count=int(count[row]))
+        return stats
+
+
+    def mean(self):
+        """
+        Average of every numeric field, the last value of all others
+
+        Returns
+        -------
+        average : dict
+            Field name and averaged value pairs
+        """
+        return dict((key, value.mean if isinstance(value, ShotStats) else value)
+                    for key, value in self.stats().items())
+
+
+class RingBuffer(ShotBuffer):
+    """
+    Fixed size :class:`.ShotBuffer` that keeps only the most recent shots
+
+    Once full, each new shot overwrites the oldest one. The timestamp of each
+    shot is stored alongside the data. All methods are safe to call from the
+    threads that deliver subscription callbacks.
+
+    Parameters
+    ----------
+    capacity : int
+        Number of shots to keep
+    """
+    def __init__(self, capacity):
+        super().__init__(capacity=capacity)
+        self.lock        = threading.RLock()
+        self._timestamps = np.full(self.capacity, np.nan)
+        self.total       = 0
+
+
+    @property
+    def full(self):
+        """
+        Whether the buffer holds ``capacity`` shots
+        """
+        return self._count == self.capacity
+
+
+    @property
+    def timestamps(self):
+        """
+        Timestamps of the stored shots, oldest first
+        """
+        with self.lock:
+            return np.roll(self._timestamps,
+                           -(self.total % self.capacity))[-self._count:]
+
+
+    def append(self, shot, timestamp=None):
+        """
+        Add a shot to the buffer, overwriting the oldest if full
+
+        Parameters
+        ----------
+        shot : dict
+            Field name and value pairs for a single shot
+
+        timestamp : float, optional
+            Time of the shot, the current time by default
+        """
+        with self.lock:
+            column = self.total % self.capacity
+            self._store(shot, column)
+            self._timestamps[column] = (timestamp if timestamp is not None
+                                        else time.time())
+            self.total  += 1
+            self._count  = min(self.total, self.capacity)
+
+
+    def clear(self):
+        """
+        Empty the buffer
+        """
+        with self.lock:
+            super().clear()
+            self._timestamps[:] = np.nan
+            self.total = 0
+
+
+    def stats(self):
+        with self.lock:
+            return super().stats()
+
+
+class RunningStats:
+    """
+    Streaming mean and variance of a single value using Welford's algorithm
+
+    Example
+    -------
+    .. code::
+
+        rs = RunningStats()
+        for value in (1, 2, 3):
+            rs.update(value)
+        rs.mean, rs.sem
+    """
+    def __init__(self):
+        self.clear()
+
+
+    def clear(self):
+        """
+        Reset the accumulators
+        """
+        self.count = 0
+        self.mean  = np.nan
+        self._m2   = 0.
+
+
+    def update(self, value):
+        """
+        Add a single value to the accumulators, NaN is ignored
+
+        Parameters
+        ----------
+        value : float
+        """
+        if np.isnan(value):
+            return
+        self.count += 1
+        if self.count == 1:
+            self.mean = float(value)
+            return
+        delta      = value - self.mean
+        self.mean += delta / self.count
+        self._m2  += delta * (value - self.mean)
+
+
+    @property
+    def var(self):
+        """
+        Sample variance of the accumulated values
+        """
+        if self.count < 2:
+            return np.nan
+        return self._m2 / (self.count - 1)
+
+
+    @property
+    def std(self):
+        """
+        Sample standard deviation of the accumulated values
+        """
+        return np.sqrt(self.var)
+
+
+    @property
+    def sem(self):
+        """
+        Standard error of the mean
+        """
+        if self.count < 2:
+            return np.nan
+        return self.std / np.sqrt(self.count)
+
+
+class PrecisionStop:
+    """
+    Stopping condition for a measurement that has reached a desired precision
+
+    A :class:`.RunningStats` accumulator is kept for a single field. Once at
+    least ``min_num`` shots have been seen the measurement is considered
+    settled if either the standard error has reached ``target_sem`` or the
+    distance of the mean from ``goal`` is known to be inside or outside of
+    ``tolerance`` with ``confidence`` standard errors of margin.
+
+    Parameters
+    ----------
+    field : str
+        Event key to accumulate
+
+    min_num : int, optional
+        Minimum number of shots before the measurement may stop
+
+    target_sem : float, optional
+        Standard error of the mean considered precise enough
+
+    goal : float, optional
+        Value to compare the mean against
+
+    tolerance : float, optional
+        Allowed distance from the goal. Must be given alongside ``goal``
+
+    confidence : float, optional
+        Number of standard errors the mean must be from the tolerance boundary
+        before a decision is made
+    """
+    def __init__(self, field, min_num=2, target_sem=None, goal=None,
+                 tolerance=None, confidence=3.):
+        if target_sem is None and (goal is None or tolerance is None):
+            raise ValueError("Either target_sem or both goal and tolerance "
+                             "must be specified")
+        self.field      = field
+        self.min_num    = max(int(min_num), 2)
+        self.target_sem = target_sem
+        self.goal       = goal
+        self.tolerance  = tolerance
+        self.confidence = confidence
+        self.stats      = RunningStats()
+
+
+    def clear(self):
+        """
+        Reset the accumulated statistics
+        """
+        self.stats.clear()
+
+
+    @property
+    def settled(self):
+        """
+        Whether the accumulated shots are precise enough to stop
+        """
+        if self.stats.count < self.min_num:
+            return False
+        sem = self.stats.sem
+        if self.target_sem is not None and sem <= self.target_sem:
+            return True
+        if self.goal is not None and self.tolerance is not None:
+            dist   = abs(self.stats.mean - self.goal)
+            margin = self.confidence * sem
+            return dist - margin > self.tolerance or dist + margin < self.tolerance
+        return False
+
+
+    def update(self, shot):
+        """
+        Add a shot to the accumulators
+
+        Parameters
+        ----------
+        shot : dict
+            Field name and value pairs for a single shot
+
+        Returns
+        -------
+        settled : bool
+            Whether the measurement may stop
+        """
+        try:
+            self.stats.update(shot[self.field])
+        except (KeyError, TypeError):
+            pass
+        return self.settled
+
+
+class AveragingSchedule:
+    """
+    Number of shots to average at each step of a walk
+
+    Far from the target a handful of shots locates the beam well enough to
+    take the next step, while close to the edge of the tolerance many shots
+    are needed to tell whether the walk has converged. The shot noise of the
+    target field is pooled over every measurement, and each step is given
+    enough shots that the standard error of the mean is ``confidence`` times
+    smaller than the distance between the last measurement and the edge of
+    the tolerance.
+
+    Parameters
+    ----------
+    min_average : int, optional
+        Fewest shots to take at a step. At least two are needed to estimate
+        the noise
+
+    max_average : int, optional
+        Most shots to take at a step
+
+    confidence : float, optional
+        Number of standard errors of margin required
+
+    Example
+    -------
+    .. code::
+
+        schedule = AveragingSchedule(min_average=5, max_average=120)
+        schedule.update(std=2.0, count=5)
+        schedule.num(distance=300, tolerance=10)
+    """
+    def __init__(self, min_average=5, max_average=120, confidence=2.):
+        self.min_average = max(int(min_average), 2)
+        self.max_average = max(int(max_average), self.min_average)
+        self.confidence  = confidence
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget the measured noise
+        """
+        self._ss  = 0.
+        self._dof = 0
+
+
+    def update(self, std, count):
+        """
+        Add the spread of a measurement to the pooled noise estimate
+
+        Parameters
+        ----------
+        std : float
+            Sample standard deviation of the shots
+
+        count : int
+            Number of shots
+        """
+        if count < 2 or not np.isfinite(std):
+            return
+        self._ss  += (count - 1) * std**2
+        self._dof += count - 1
+
+
+    @property
+    def noise(self):
+        """
+        Pooled standard deviation of a single shot, NaN until measured
+        """
+        if not self._dof:
+            return np.nan
+        return np.sqrt(self._ss / self._dof)
+
+
+    def num(self, distance=None, tolerance=None):
+        """
+        Number of shots for the next measurement
+
+        Parameters
+        ----------
+        distance : float, optional
+            Distance of the last measurement from the target. If not given,
+            the minimum is used to probe the noise
+
+        tolerance : float, optional
+            Allowed distance from the target
+
+        Returns
+        -------
+        num : int
+        """
+        if distance is None or tolerance is None:
+            return self.min_average
+        if not np.isfinite(self.noise):
+            return self.max_average
+        margin = abs(abs(distance) - tolerance)
+        if margin == 0:
+            return self.max_average
+        num = int(np.ceil((self.confidence * self.noise / margin)**2))
+        return int(np.clip(num, self.min_average, self.max_average))
+
+
+class BufferReading:
+    """
+    Readable view of a :class:`.ShotBuffer` used to emit a single Event
+
+    By default the Event holds the average of each numeric field over all of
+    the shots in the buffer, with the same keys a single shot would have.
+    This lets callbacks that expect one reading per Event, e.g
+    :class:`.LiveBuild`, consume the summary of a measurement unchanged. As a
+    page, each numeric field instead holds an array with the value of every
+    shot.
+
+    Parameters
+    ----------
+    buffer : :class:`.ShotBuffer`
+        Shots to summarize
+
+    name : str, optional
+        Name reported as the source of the readings
+
+    page : bool, optional
+        Report the columns of the buffer rather than the averages
+
+    Notes
+    -----
+    Readings compare equal by name, page, keys and, for a page, number of
+    shots rather than by buffer. The RunEngine requires every Event of a
+    stream to be read from the same objects and describes each object once,
+    so this lets each measurement of a run emit a new reading into the
+    stream of the last as long as it has the same description. Readings
+    that differ belong in separate streams, see :attr:`.stream_suffix`
+    """
+    def __init__(self, buffer, name='measure', page=False):
+        self.buffer = buffer
+        self.name   = name
+        self.page   = page
+        self.parent = None
+        self.keys   = tuple(sorted(set(buffer.fields) | set(buffer.last)))
+        self.shape  = [len(buffer)] if page else []
+
+    @property
+    def _identity(self):
+        return (self.name, self.page, self.keys, tuple(self.shape))
+
+    def __eq__(self, other):
+        return (isinstance(other, BufferReading)
+                and self._identity == other._identity)
+
+    def __hash__(self):
+        return hash((type(self), self._identity))
+
+
+    @property
+    def stream_suffix(self):
+        """
+        Suffix that keeps the stream of a page apart from pages with a
+        different number of shots, e.g ``_120``. Empty for a summary
+        """
+        return '_{}'.format(self.shape[0]) if self.page else ''
+
+
+    def read(self):
+        """
+        Summary of the buffer in the format of ``ophyd.Device.read``
+        """
+        ts = time.time()
+        if self.page:
+            values = dict((key, value) for key, value
+                          in self.buffer.last.items()
+                          if key not in self.buffer.fields)
+            values.update((key, self.buffer.column(key).copy())
+                          for key in self.buffer.numeric_fields)
+        else:
+            values = self.buffer.mean()
+        return dict((key, {'value' : value, 'timestamp' : ts})
+                    for key, value in values.items())
+
+
+    def describe(self):
+        """
+        Description of the summary in the format of ``ophyd.Device.describe``
+        """
+        desc = dict()
+        for key, reading in self.read().items():
+            value = reading['value']
+            if isinstance(value, str):
+                dtype, shape = 'string', []
+            elif np.ndim(value):
+                dtype, shape = 'array', list(np.shape(value))
+            else:
+                dtype, shape = 'number', []
+            desc[key] = {'source' : 'SIM:{}'.format(self.name),
+                         'dtype' : dtype, 'shape' : shape}
+        return desc
+
+
+    def read_configuration(self):
+        return dict()
+
+
+    def describe_configuration(self):
+        return dict()
+
+
+class RunningRegression:
+    """
+    Least-squares line through a stream of points from running sums
+
+    The sums of the weights, coordinates, squares and cross products are all
+    that is needed for an exact ordinary least-squares fit, so each new point
+    updates the fit in constant time. The sums are taken relative to the
+    first point to avoid the loss of precision of large offsets. Old points
+    can either be discarded once they leave a sliding ``window``, or
+    exponentially down-weighted by a ``forgetting`` factor.
+
+    Parameters
+    ----------
+    window : int, optional
+        Number of the most recent points to fit
+
+    forgetting : float, optional
+        Factor between 0 and 1 that the weight of every previous point is
+        multiplied by when a new point arrives
+
+    Example
+    -------
+    .. code::
+
+        reg = RunningRegression(window=10)
+        for x, y in ((0, 1), (1, 3), (2, 5)):
+            reg.update(x, y)
+        reg.slope, reg.intercept, reg.slope_err
+    """
+    def __init__(self, window=None, forgetting=None):
+        if window is not None and forgetting is not None:
+            raise ValueError("Can not use both a window and forgetting factor")
+        if forgetting is not None and not 0 < forgetting <= 1:
+            raise ValueError("Forgetting factor must be between 0 and 1")
+        if window is not None and window < 2:
+            raise ValueError("Window must hold at least two points")
+        self.window     = window
+        self.forgetting = forgetting
+        self._points    = deque(maxlen=window) if window else None
+        self.clear()
+
+
+    def clear(self):
+        """
+        Forget every point
+        """
+        self.count   = 0
+        self._origin = None
+        self._sums   = np.zeros(6)
+        if self._points is not None:
+            self._points.clear()
+
+
+    def _terms(self, dx, dy):
+        return np.array([1., dx, dy, dx*dx, dx*dy, dy*dy])
+
+
+    def update(self, x, y):
+        """
+        Add a point to the fit, NaN is ignored
+
+        Parameters
+        ----------
+        x : float
+
+        y : float
+        """
+        if np.isnan(x) or np.isnan(y):
+            return
+        if self._origin is None:
+            self._origin = (float(x), float(y))
+        dx, dy = x - self._origin[0], y - self._origin[1]
+        if self.forgetting is not None:
+            self._sums *= self.forgetting
+        elif self.window and len(self._points) == self.window:
+            self._sums -= self._terms(*self._points[0])
+            self.count -= 1
+        if self._points is not None:
+            self._points.append((dx, dy))
+        self._sums  += self._terms(dx, dy)
+        self.count  += 1
+
+
+    @property
+    def weight(self):
+        """
+        Total weight of the points in the fit, the number of points unless a
+        forgetting factor is used
+        """
+        return self._sums[0]
+
+
+    def _centered(self):
+        w, sx, sy, sxx, sxy, syy = self._sums
+        return (sxx - sx*sx/w, sxy - sx*sy/w, syy - sy*sy/w)
+
+
+    @property
+    def solvable(self):
+        """
+        Whether the points determine a unique line
+        """
+        return self.count >= 2 and self._centered()[0] > 0
+
+
+    @property
+    def slope(self):
+        """
+        Slope of the fitted line
+        """
+        if not self.solvable:
+            return np.nan
+        cxx, cxy, _ = self._centered()
+        return cxy / cxx
+
+
+    @property
+    def intercept(self):
+        """
+        Intercept of the fitted line
+        """
+        if not self.solvable:
+            return np.nan
+        w, sx, sy = self._sums[:3]
+        x0, y0 = self._origin
+        slope  = self.slope
+        return y0 + (sy - slope*sx)/w - slope*x0
+
+
+    @property
+    def residual(self):
+        """
+        Weighted sum of the squared residuals of the fit
+        """
+        if not self.solvable:
+            return np.nan
+        cxx, cxy, cyy = self._centered()
+        return max(cyy - cxy*cxy/cxx, 0.)
+
+
+    def _variance(self):
+        #Scatter of the points about the line
+        dof = self.weight - 2
+        if dof <= 0:
+            return np.nan
+        return self.residual / dof
+
+
+    @property
+    def slope_err(self):
+        """
+        Standard error of the slope
+        """
+        if not self.solvable:
+            return np.nan
+        return np.sqrt(self._variance() / self._centered()[0])
+
+
+    @property
+    def intercept_err(self):
+        """
+        Standard error of the intercept
+        """
+        if not self.solvable:
+            return np.nan
+        w, sx = self._sums[:2]
+        xbar  = self._origin[0] + sx/w
+        return np.sqrt(self._variance() * (1./w + xbar**2/self._centered()[0]))
+
+
+    @property
+    def covariance(self):
+        """
+        Covariance of the slope and intercept
+        """
+        if not self.solvable:
+            return np.nan
+        w, sx = self._sums[:2]
+        xbar  = self._origin[0] + sx/w
+        return -xbar * self._variance() / self._centered()[0]
@@ -4,9 +4,13 @@ Specialized Callbacks for Skywalker
 ############
 # Standard #
 ############
+import math
+import inspect
+import numbers
 import logging
 import simplejson as sjson
 from pathlib import Path
+from collections import namedtuple
 
 ###############
 # Third Party #
@@ -20,10 +24,202 @@ from bluesky.callbacks import (LiveFit, LiveFitPlot, CallbackBase, LivePlot)
 ##########
 # Module #
 ##########
-from .utils.argutils import isiterable
+from .buffers import RunningRegression, is_shot_stream
 
 logger = logging.getLogger(__name__)
 
+class FilterSet:
+    """
+    Compiled set of event filters
+
+    The filters dictionary is turned into a single predicate. Each key is
+    checked once for missing, NaN or Inf data before the filter itself is
+    evaluated, and evaluation stops at the first filter that rejects the
+    event. Rejections are counted per filter key so that the reason events
+    were dropped can be reported.
+
+    Parameters
+    ----------
+    filters : dict, optional
+        Filters are provided in a dictionary of key / callable pairs that take
+        a single input from the data stream and return a boolean value.
+
+    drop_missing : bool, optional
+        Only include documents who have associated data for each filter key.
+        This includes events missing the key entirely, reporting NaN or
+    	reporting Inf.
+
+    Example
+    -------
+    ..code::
+
+        fs = FilterSet({'a' : lambda x : x > 0})
+        fs({'a' : 4})
+        fs.batch({'a' : np.array([-1, 4, np.nan])})
+    """
+    def __init__(self, filters=None, drop_missing=True):
+        self.filters      = dict(filters or dict())
+        self.drop_missing = drop_missing
+        self.rejections   = dict.fromkeys(self.filters, 0)
+
+
+    def update(self, filters):
+        """
+        Add filters to the set
+
+        Parameters
+        ----------
+        filters : dict
+            Key / callable pairs to add
+        """
+        self.filters.update(filters)
+        for key in filters:
+            self.rejections.setdefault(key, 0)
+
+
+    def reset(self):
+        """
+        Clear the rejection counters
+        """
+        self.rejections = dict.fromkeys(self.filters, 0)
+
+
+    @staticmethod
+    def is_valid(value):
+        """
+        Whether a value is free of NaN and Inf
+
+        Parameters
+        ----------
+        value : object
+            Value from the event stream
+
+        Returns
+        -------
+        valid : bool
+        """
+        #Check scalars first, they are by far the most common
+        if isinstance(value, numbers.Real):
+            return math.isfinite(value)
+        #Check string entries for nan and inf
+        elif isinstance(value, str):
+            return value.lower() not in ('inf', 'nan')
+        #Check iterables for nan and inf
+        try:
+            return bool(np.all(np.isfinite(np.asarray(value))))
+        #Values that can not be checked are passed to the filter
+        except TypeError:
+            return True
+
+
+    def _evaluate(self, key, func, value):
+        """
+        Evaluate a single filter, reporting improper filters
+        """
+        try:
+            return bool(func(value))
+        except Exception as e:
+            logger.critical('Filter associated with event_key {}'\
+                            'reported exception "{}"'\
+                            ''.format(key, e))
+            return True
+
+
+    def __call__(self, doc):
+        """
+        Filter a single event
+
+        Parameters
+        ----------
+        doc : dict
+            Data from a single event
+
+        Returns
+        -------
+        resp : bool
+            Whether the event passes all filters
+        """
+        for key, func in self.filters.items():
+            try:
+                value = doc[key]
+            #Handle missing information
+            except KeyError:
+                ok = not self.drop_missing
+            else:
+                if self.is_valid(value):
+                    ok = self._evaluate(key, func, value)
+                else:
+                    ok = not self.drop_missing
+            #Short-circuit on rejection
+            if not ok:
+                self.rejections[key] += 1
+                return False
+        return True
+
+
+    def batch(self, columns, length=None):
+        """
+        Filter a batch of events
+
+        Parameters
+        ----------
+        columns : dict
+            Map of event keys to arrays with one entry per event
+
+        length : int, optional
+            Number of events in the batch. Only needed if none of the filter
+            keys are present in ``columns``
+
+        Returns
+        -------
+        mask : np.ndarray
+            Boolean array, True for each event that passes all filters
+        """
+        if length is None:
+            length = max([len(col) for col in columns.values()] or [0])
+        mask = np.ones(length, dtype=bool)
+        for key, func in self.filters.items():
+            #Only evaluate events that are still passing
+            idx = np.flatnonzero(mask)
+            if not len(idx):
+                break
+            try:
+                col = np.asarray(columns[key])[idx]
+            #Handle missing information
+            except KeyError:
+                ok = np.full(len(idx), not self.drop_missing)
+            else:
+                #Vectorized NaN and Inf check for numeric columns
+                if col.dtype.kind in 'biuf':
+                    valid = np.isfinite(col)
+                else:
+                    valid = np.fromiter((self.is_valid(v) for v in col),
+                                        dtype=bool, count=len(col))
+                ok = np.full(len(idx), not self.drop_missing)
+                ok[valid] = self._batch_evaluate(key, func, col[valid])
+            self.rejections[key] += int(np.sum(~ok))
+            mask[idx[~ok]] = False
+        return mask
+
+
+    def _batch_evaluate(self, key, func, col):
+        """
+        Evaluate a filter on an array, falling back to one value at a time if
+        the filter does not broadcast
+        """
+        if not len(col):
+            return np.ones(0, dtype=bool)
+        try:
+            if col.dtype.kind in 'biuf':
+                resp = np.asarray(func(col), dtype=bool)
+                if resp.shape == col.shape:
+                    return resp
+        except Exception:
+            pass
+        return np.fromiter((self._evaluate(key, func, v) for v in col),
+                           dtype=bool, count=len(col))
+
+
 def apply_filters(doc, filters=None, drop_missing=True):
     """
     Filter an event document
@@ -33,14 +229,14 @@ def apply_filters(doc, filters=None, drop_missing=True):
     doc : dict
         Bluesky Document to filter
 
-    filters : dict
+    filters : dict or :class:`.FilterSet`
         Filters are provided in a dictionary of key / callable pairs that take
         a single input from the data stream and return a boolean value.
 
     drop_missing : bool, optional
         Only include documents who have associated data for each filter key.
         This includes events missing the key entirely, reporting NaN or
-    	reporting Inf.
+    	reporting Inf. Ignored if ``filters`` is already a :class:`.FilterSet`
 
     Returns
     -------
@@ -54,44 +250,362 @@ def apply_filters(doc, filters=None, drop_missing=True):
         apply_filters(doc, filters = {'a' : lambda x : x > 0,
                                       'c' : lambda x : 4 < x < 6})
     """
-    resp    = []
-    filters = filters or dict()
-    #Iterate through filters
-    for key, func in filters.items(): 
-        try:
-            
-            #Check iterables for nan and inf
-            if isiterable(doc[key]):
-                if any(np.isnan(doc[key])) or any(np.isinf(doc[key])):
-                    resp.append(not drop_missing)
-                    continue
-
-            #Check string entries for nan and inf
-            elif isinstance(doc[key], str):
-                if "inf" == doc[key].lower() or "nan" == doc[key].lower():
-                    resp.append(not drop_missing)
-                    continue
-
-            #Handle all other types
-            else:
-                if np.isnan(doc[key]) or np.isinf(doc[key]):
-                    resp.append(not drop_missing)
-                    continue
-
-            #Evaluate filter
-            resp.append(bool(func(doc[key])))
-            
-        #Handle missing information
-        except KeyError:
-            resp.append(not drop_missing)
-
-        #Handle improper filter
-        except Exception as e:
-            logger.critical('Filter associated with event_key {}'\
-                            'reported exception "{}"'\
-                            ''.format(key, e))
-    #Summarize
-    return all(resp)
+    if not isinstance(filters, FilterSet):
+        filters = FilterSet(filters, drop_missing=drop_missing)
+    return filters(doc)
+
+
+class BeamPresence:
+    """
+    Decide from a handful of shots whether the beam is still on a detector
+
+    Three independent checks are made on every shot. The beam is considered
+    lost if ``max_missing`` consecutive shots report a centroid that is zero,
+    negative or not finite, or an intensity below ``threshold``. Once
+    ``min_shots`` have been taken, the fraction of shots passing the filters
+    is used to project how many more would be dropped before the measurement
+    is complete. If that exceeds the remaining ``max_dropped`` budget of
+    :func:`.measure` the beam is declared lost immediately rather than after
+    the budget has been spent.
+
+    Parameters
+    ----------
+    centroid : str, optional
+        Key of the beam centroid
+
+    intensity : str, optional
+        Key of the image intensity, e.g the ``stats2_mean_value``
+
+    threshold : float, optional
+        Intensity below which there is no beam on the detector. Must be given
+        alongside ``intensity``
+
+    max_missing : int, optional
+        Number of consecutive shots without beam before it is declared lost
+
+    min_shots : int, optional
+        Number of shots to take before projecting the pass rate. If None, the
+        pass rate is not considered
+
+    Example
+    -------
+    .. code::
+
+        beam = BeamPresence(centroid='yag_detector_stats2_centroid_x',
+                            intensity='yag_detector_stats2_mean_value',
+                            threshold=5.)
+        RE(measure([yag], num=10, filters=filters, beam=beam))
+    """
+    def __init__(self, centroid=None, intensity=None, threshold=None,
+                 max_missing=5, min_shots=10):
+        if intensity is not None and threshold is None:
+            raise ValueError("An intensity threshold must be provided")
+        self.centroid    = centroid
+        self.intensity   = intensity
+        self.threshold   = threshold
+        self.max_missing = max_missing
+        self.min_shots   = min_shots
+        self.reset()
+
+
+    def reset(self):
+        """
+        Clear the counters before a new measurement
+        """
+        self.shots   = 0
+        self.passed  = 0
+        self.missing = 0
+
+
+    def has_beam(self, shot):
+        """
+        Whether a single shot shows beam on the detector
+
+        Parameters
+        ----------
+        shot : dict
+            Field name and value pairs for a single shot
+
+        Returns
+        -------
+        beam : bool
+            False if the centroid or intensity indicate no beam. Keys missing
+            from the shot are ignored. Array values, e.g the centroids of
+            several regions, show beam if any element does
+        """
+        if self.centroid is not None and self.centroid in shot:
+            value = shot[self.centroid]
+            if not (FilterSet.is_valid(value)
+                    and np.any(np.asarray(value) > 0)):
+                return False
+        if self.intensity is not None and self.intensity in shot:
+            value = shot[self.intensity]
+            if not (FilterSet.is_valid(value)
+                    and np.any(np.asarray(value) >= self.threshold)):
+                return False
+        return True
+
+
+    def update(self, shot, passed, remaining=None, budget=None):
+        """
+        Add a shot to the counters
+
+        Parameters
+        ----------
+        shot : dict
+            Field name and value pairs for a single shot
+
+        passed : bool
+            Whether the shot passed the filters of the measurement
+
+        remaining : int, optional
+            Number of passing shots still required
+
+        budget : int, optional
+            Number of shots that may still be dropped
+
+        Returns
+        -------
+        reason : str or None
+            Description of why the beam is considered lost, None if the beam
+            may still be present
+        """
+        self.shots  += 1
+        self.passed += int(bool(passed))
+        #Consecutive shots without beam
+        if self.has_beam(shot):
+            self.missing = 0
+        else:
+            self.missing += 1
+            if self.missing >= self.max_missing:
+                return "No beam in {} consecutive shots".format(self.missing)
+        #Project the drops needed to finish the measurement
+        if (self.min_shots is not None and self.shots >= self.min_shots
+                and remaining is not None and budget is not None):
+            rate = self.passed / self.shots
+            if not rate:
+                return "No shots passed in {}".format(self.shots)
+            projected = remaining * (1. - rate) / rate
+            if projected > budget:
+                return ("Pass rate of {:.0%} would drop {:.0f} more shots, "
+                        "only {} remain".format(rate, projected, budget))
+        return None
+
+
+#Prediction of a single model used to rank it
+Ranking = namedtuple('Ranking', ['model', 'estimate', 'residual',
+                                 'uncertainty'])
+
+
+def fit_errors(result):
+    """
+    Standard errors of the parameters of a fit result
+
+    Parameters
+    ----------
+    result : lmfit.model.ModelResult or :class:`.LinearResult`
+
+    Returns
+    -------
+    errors : dict
+        Parameter name and standard error pairs, None if not determined
+    """
+    errors = getattr(result, 'errors', None)
+    if errors is not None:
+        return dict(errors)
+    params = getattr(result, 'params', None) or dict()
+    return dict((key, param.stderr) for key, param in params.items())
+
+
+def fit_covariance(result, first, second):
+    """
+    Covariance of two parameters of a fit result
+
+    Parameters
+    ----------
+    result : lmfit.model.ModelResult or :class:`.LinearResult`
+
+    first : str
+        Name of the first parameter
+
+    second : str
+        Name of the second parameter
+
+    Returns
+    -------
+    covariance : float or None
+        None if the covariance matrix was not determined
+    """
+    covar = getattr(result, 'covar', None)
+    names = list(getattr(result, 'var_names', None) or list())
+    if covar is None or first not in names or second not in names:
+        return None
+    return covar[names.index(first), names.index(second)]
+
+
+def _freeze(value):
+    """
+    Hashable, comparable version of a model input
+    """
+    if np.ndim(value) == 0:
+        return value
+    return tuple(np.ravel(value).tolist())
+
+
+class ModelRanker:
+    """
+    Rank models by the accuracy of their predictions
+
+    The prediction of each model is cached along with the fit result and the
+    inputs it was made with, so a model is only evaluated again once its fit
+    has been updated or it is asked about a different configuration. Models
+    that fit a straight line, e.g :class:`.LinearFit`, are evaluated together
+    in a single vectorized operation, including an estimate of the
+    uncertainty of each prediction from the standard errors of the fit and
+    the covariance of the slope and intercept. A fit without a covariance
+    matrix is treated as having uncorrelated parameters.
+
+    Parameters
+    ----------
+    models : list
+        Models to rank
+
+    Example
+    -------
+    .. code::
+
+        ranker = ModelRanker([fit1, fit2])
+        best = ranker.rank(target=22, motor=4)[0]
+        best.model, best.residual, best.uncertainty
+    """
+    def __init__(self, models):
+        self.models = list(models)
+        self.clear()
+
+
+    def clear(self):
+        """
+        Forget all cached predictions
+        """
+        self._cache = dict()
+        self.hits   = 0
+        self.misses = 0
+
+
+    @staticmethod
+    def _inputs(model, kwargs):
+        """
+        Values of the independent variables given by name or event key
+        """
+        return tuple(_freeze(kwargs[var] if kwargs.get(var) is not None
+                             else kwargs.get(key))
+                     for var, key in model.independent_vars.items())
+
+
+    @staticmethod
+    def _is_linear(model):
+        return (isinstance(model, LinearFit)
+                and 'slope' in model.result.values
+                and 'intercept' in model.result.values)
+
+
+    def predict(self, **kwargs):
+        """
+        Predict the dependent variable with every model
+
+        Parameters
+        ----------
+        kwargs :
+            All of the keys the models will need to evaluate
+
+        Returns
+        -------
+        predictions : dict
+            Map of model to a tuple of estimate and uncertainty. Models that
+            can not make a prediction are omitted
+        """
+        predictions = dict()
+        linear      = list()
+        for model in self.models:
+            if not model.result:
+                logger.debug("Unable to yield estimate from model {}, no "
+                             "saved fit".format(model.name))
+                continue
+            inputs = self._inputs(model, kwargs)
+            cached = self._cache.get(id(model))
+            if (cached is not None and cached[0] is model.result
+                    and cached[1] == inputs):
+                self.hits += 1
+                predictions[model] = cached[2]
+                continue
+            self.misses += 1
+            if (self._is_linear(model) and inputs[0] is not None
+                    and np.ndim(inputs[0]) == 0):
+                linear.append((model, inputs))
+                continue
+            try:
+                estimate = model.eval(**kwargs)
+            except RuntimeError as e:
+                logger.debug("Unable to yield estimate from model {}"
+                             "".format(model.name))
+                logger.debug(e)
+                continue
+            predictions[model] = (estimate, np.nan)
+            self._cache[id(model)] = (model.result, inputs, predictions[model])
+
+        #Evaluate every line at once
+        if linear:
+            x = np.array([inputs[0] for (model, inputs) in linear],
+                         dtype=float)
+            values = np.array([[model.result.values['slope'],
+                                model.result.values['intercept']]
+                               for (model, inputs) in linear], dtype=float)
+            errors = np.array([[fit_errors(model.result).get(key)
+                                for key in ('slope', 'intercept')]
+                               for (model, inputs) in linear], dtype=float)
+            covar  = np.array([fit_covariance(model.result,
+                                              'slope', 'intercept')
+                               for (model, inputs) in linear], dtype=float)
+            covar[np.isnan(covar)] = 0.
+            estimates = values[:, 0]*x + values[:, 1]
+            #Variance of slope*x + intercept
+            variance = ((errors[:, 0]*x)**2 + errors[:, 1]**2
+                        + 2*x*covar)
+            uncertainties = np.sqrt(np.maximum(variance, 0.))
+            for (model, inputs), est, unc in zip(linear, estimates,
+                                                 uncertainties):
+                predictions[model] = (est, unc)
+                self._cache[id(model)] = (model.result, inputs, (est, unc))
+        return predictions
+
+
+    def rank(self, target, **kwargs):
+        """
+        Rank the models by the accuracy of their prediction
+
+        Parameters
+        ----------
+        target : float
+            Actual value of target
+
+        kwargs :
+            All of the keys the models will need to evaluate
+
+        Returns
+        -------
+        ranking : list
+            :class:`.Ranking` of each model that made a prediction, the most
+            accurate first
+        """
+        ranking = list()
+        for model, (estimate, unc) in self.predict(**kwargs).items():
+            logger.debug("Model {} predicted a value of {}"
+                         "".format(model.name, estimate))
+            ranking.append(Ranking(model, estimate, estimate - target, unc))
+        #Order of the models is kept for equal residuals
+        order = dict((id(model), i) for i, model in enumerate(self.models))
+        ranking.sort(key=lambda r: (np.abs(r.residual), order[id(r.model)]))
+        return ranking
 
 
 def rank_models(models, target, **kwargs):
@@ -113,33 +627,48 @@ def rank_models(models, target, **kwargs):
     -------
     model_ranking : list
         List of models sorted by accuracy of predictions
+
+    See Also
+    --------
+    :class:`.ModelRanker`
     """
-    #Initialize values
-    model_ranking = np.asarray(models)
-    diffs         = list()
-    bad_models    = list()
+    return [r.model for r in ModelRanker(models).rank(target, **kwargs)]
 
-    #Calculate error of each model
-    for model in models:
-        try:
-            estimate = model.eval(**kwargs)
-            diffs.append(np.abs(estimate-target))
-            logger.debug("Model {} predicted a value of {}"
-                         "".format(model.name, estimate))
-        except RuntimeError as e:
-            bad_models.append(model)
-            diffs.append(np.inf)
-            logger.debug("Unable to yield estimate from model {}"
-                         "".format(model.name))
-            logger.debug(e)
-    #Rank performances
-    model_ranking = model_ranking[np.argsort(diffs)]
-    #Remove models who failed to make an estimate
-    return [model for model in model_ranking
-            if model not in bad_models]
+
+class ShotPageFilter:
+    """
+    Mixin for callbacks that ignore the pages of shots emitted by
+    :func:`.measure`
+
+    Each field of an Event in the :data:`.SHOT_STREAM` holds an array of every
+    shot in a measurement, rather than a single reading. The averaged Event of
+    the same measurement is still delivered in the ``primary`` stream
+    """
+    def __init__(self, *args, **kwargs):
+        self._shot_pages = set()
+        super().__init__(*args, **kwargs)
+
+
+    def start(self, doc):
+        #Descriptors of a previous run are never seen again
+        self._shot_pages.clear()
+        super().start(doc)
+
+
+    def descriptor(self, doc):
+        if is_shot_stream(doc.get('name')):
+            self._shot_pages.add(doc['uid'])
+        super().descriptor(doc)
 
 
-class LiveBuild(LiveFit):
+    def is_shot_page(self, doc):
+        """
+        Whether an Event belongs to the :data:`.SHOT_STREAM`
+        """
+        return doc.get('descriptor') in self._shot_pages
+
+
+class LiveBuild(ShotPageFilter, LiveFit):
     """
     Base class for live model building in Skywalker
 
@@ -160,17 +689,26 @@ class LiveBuild(LiveFit):
         Update rate of the model. If set to None, the model will only be
         computed at the end of the run. By default, this is set to 1 i.e
         update on every new event
+
+    average : int or None, optional
+        Number of events to average into each point of the fit. If None,
+        events are averaged whenever :meth:`.flush` is called
+
+    timer : :class:`.PhaseTimer`, optional
+        Record the time taken to update the fit with each point as ``fit``
     """
     def __init__(self, model, y, independent_vars, init_guess=None,
                  update_every=1, filters=None, drop_missing=True,
-                 average=1):
+                 average=1, timer=None):
         super().__init__(model, y, independent_vars,
                          init_guess=init_guess,
                          update_every=update_every)
         #Add additional keys
         self.average      = average
+        self.timer        = timer
         self.filters      = filters or {}
         self.drop_missing = drop_missing
+        self._filter      = FilterSet(self.filters, drop_missing=drop_missing)
         self._avg_cache   = list()
 
 
@@ -203,29 +741,56 @@ class LiveBuild(LiveFit):
             value.
         """
         self.filters.update(filters)
+        self._filter.update(filters)
 
 
     def event(self, doc):
+        #Pages of shots are summarized in the primary stream
+        if self.is_shot_page(doc):
+            return
+
+        #Events of other plans sharing the run, e.g with merge_plans
+        if any(key not in doc['data'] for key in self.field_names):
+            return
+
         #Run event through filters
-        if not apply_filters(doc['data']):
+        if not self._filter(doc['data']):
             return
 
         #Add doc to average cache
         self._avg_cache.append(doc)
 
         #Check we have the right number of shots to average
-        if len(self._avg_cache) >= self.average:
-            #Overwrite event number
-            #This can be removed with an update to Bluesky Issue #684
-            doc['seq_num'] = len(self.ydata) +1 
-            #Rewrite document with averages
-            for key in self.field_names:
-                doc['data'][key] = np.mean([d['data'][key]
-                                            for d in self._avg_cache])
-            #Send to callback
+        if self.average and len(self._avg_cache) >= self.average:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Fit the average of every cached event as a single point
+
+        Called automatically once ``average`` events have been cached. If
+        ``average`` is None, events are cached until this is called, which
+        lets a plan average however many shots were taken at each step
+        """
+        if not self._avg_cache:
+            return
+        doc = self._avg_cache[-1]
+        #Overwrite event number
+        #This can be removed with an update to Bluesky Issue #684
+        doc['seq_num'] = len(self.ydata) +1 
+        #Rewrite document with averages
+        for key in self.field_names:
+            doc['data'][key] = np.mean([d['data'][key]
+                                        for d in self._avg_cache])
+        #Clear cache
+        self._avg_cache.clear()
+        #Send to callback
+        if self.timer is None:
             super().event(doc)
-            #Clear cache
-            self._avg_cache.clear()
+        else:
+            with self.timer.phase('fit'):
+                super().event(doc)
 
 
     def eval(self, *args, **kwargs):
@@ -369,6 +934,200 @@ class LinearFit(LiveBuild):
         return {'x' : (target-b)/m}
 
 
+class LinearResult:
+    """
+    Result of a closed-form linear fit
+
+    Provides the parts of ``lmfit.model.ModelResult`` used during a walk, so
+    that the fit can be updated without running a minimization
+
+    Attributes
+    ----------
+    values : dict
+        Best fit ``slope`` and ``intercept``
+
+    errors : dict
+        Standard error of each value
+
+    model : lmfit.Model
+        Model the values belong to
+
+    ndata : int
+        Number of points in the fit
+
+    covar : np.ndarray
+        Covariance matrix of the values in the order of :attr:`.var_names`,
+        None if not determined
+
+    var_names : list
+        Names of the values
+    """
+    def __init__(self, model, values, errors, ndata, covar=None):
+        self.model     = model
+        self.values    = values
+        self.errors    = errors
+        self.ndata     = ndata
+        self.covar     = covar
+        self.var_names = list(values)
+
+
+    def eval(self, **kwargs):
+        """
+        Evaluate the model with the best fit values
+        """
+        params = dict(self.values)
+        params.update(kwargs)
+        return self.model.eval(**params)
+
+
+class ClosedFormFit:
+    """
+    Mixin for :class:`.LiveBuild` models solved directly from running sums
+
+    The sums already hold every event, so :meth:`update_fit` replaces the
+    lmfit minimization with a call to :meth:`solve`, and only if events
+    arrived since the last update. Subclasses clear :attr:`.stale` once they
+    have solved for the sums
+    """
+    stale = False
+
+    def update_caches(self, y, independent_vars):
+        super().update_caches(y, independent_vars)
+        self.stale = True
+
+
+    def update_fit(self):
+        """
+        Solve for the sums if events arrived since the last update
+        """
+        if self.stale:
+            self.solve()
+
+
+    def solve(self):
+        raise NotImplementedError
+
+
+class IncrementalLinearFit(ClosedFormFit, LinearFit):
+    """
+    :class:`.LinearFit` that is updated in constant time with every event
+
+    Instead of a full lmfit minimization over all of the accumulated data,
+    the exact least-squares line and the uncertainties of its parameters are
+    computed from the running sums of a :class:`.RunningRegression`. The
+    :attr:`.result` is a lightweight :class:`.LinearResult`. A complete lmfit
+    result is only built when requested with :meth:`.lmfit_result`
+
+    Parameters
+    ----------
+    y : str
+        Keyword in the event document that reports the dependent variable
+
+    x: str
+        Keyword in the event document that reports the independent variable
+
+    window : int, optional
+        Only fit the most recent number of points
+
+    forgetting : float, optional
+        Factor between 0 and 1 that down-weights previous points each time a
+        new one arrives
+
+    kwargs :
+        All other arguments are passed to :class:`.LinearFit`
+    """
+    def __init__(self, y, x, window=None, forgetting=None, **kwargs):
+        #The regression is cleared when LiveFit resets
+        self.regression = RunningRegression(window=window,
+                                            forgetting=forgetting)
+        super().__init__(y, x, **kwargs)
+
+
+    def _reset(self):
+        super()._reset()
+        self.regression.clear()
+
+
+    def update_caches(self, y, independent_vars):
+        super().update_caches(y, independent_vars)
+        self.regression.update(independent_vars['x'], y)
+
+
+    def solve(self):
+        """
+        Recompute the line from the running sums
+        """
+        reg = self.regression
+        if not reg.solvable:
+            logger.debug("Model %s can not fit a line to %s points that "
+                         "share the same x", self.name, reg.count)
+            return
+        cov   = reg.covariance
+        covar = np.array([[reg.slope_err**2, cov],
+                          [cov, reg.intercept_err**2]])
+        self.result = LinearResult(self.model,
+                                   {'slope' : reg.slope,
+                                    'intercept' : reg.intercept},
+                                   {'slope' : reg.slope_err,
+                                    'intercept' : reg.intercept_err},
+                                   ndata=reg.count, covar=covar)
+        self.stale = False
+
+
+    def eval(self, **kwargs):
+        """
+        Evaluate the predicted outcome of the most recent fit
+
+        Parameters
+        ----------
+        x : float or int, optional
+            Independent variable to evaluate linear model
+
+        kwargs :
+            The value for the indepenedent variable can also be given as the
+            field name in the event document
+
+        Returns
+        -------
+        estimate : float
+            Y value as determined by current linear fit
+        """
+        #Check result
+        LiveBuild.eval(self, **kwargs)
+        if 'x' in kwargs:
+            x = kwargs['x']
+        elif self.independent_vars['x'] in kwargs:
+            x = kwargs[self.independent_vars['x']]
+        else:
+            raise ValueError("Must supply keyword `x` or use fieldname {}"
+                             "".format(self.independent_vars['x']))
+        values = self.result.values
+        return values['slope'] * np.asarray(x) + values['intercept']
+
+
+    def lmfit_result(self):
+        """
+        Fit the same points with lmfit
+
+        Returns
+        -------
+        result : lmfit.model.ModelResult
+            Full result of the fit, seeded with the closed-form values
+        """
+        if not self.result:
+            raise RuntimeError("Can not refit without a saved fit, "
+                               "use .update_fit()")
+        y = np.asarray(self.ydata, dtype=float)
+        x = np.asarray(self.independent_vars_data['x'], dtype=float)
+        weights = None
+        if self.regression.window:
+            y, x = y[-self.regression.window:], x[-self.regression.window:]
+        elif self.regression.forgetting is not None:
+            weights = np.sqrt(self.regression.forgetting
+                              ** np.arange(len(y) - 1, -1, -1))
+        return self.model.fit(y, x=x, weights=weights, **self.result.values)
+
+
 class MultiPitchFit(LiveBuild):
     """
     Model to fit centroid position of two mirror system
@@ -495,7 +1254,281 @@ class MultiPitchFit(LiveBuild):
                     'a1' : a1}
 
 
-class LivePlotWithGoal(LivePlot):
+class LinearResponseFit(ClosedFormFit, LiveBuild):
+    """
+    Linear response of a centroid to any number of mirror pitches
+
+    Generalizes :class:`.MultiPitchFit` to ``y = x0 + x1*a0 + x2*a1 + ...``
+    for N inputs. Rather than an lmfit minimization, the normal equations of
+    the least-squares problem are accumulated as each event arrives and
+    solved directly, so updating the fit costs the same regardless of how
+    many events have been seen. Batches of candidate configurations can be
+    evaluated in a single call, and :meth:`.backsolve` handles any subset of
+    fixed inputs.
+
+    Parameters
+    ----------
+    y : str
+        Keyword in the event document that reports the centroid position
+
+    inputs : list of str
+        Keywords of the mirror pitches. These are referred to as ``a0``,
+        ``a1``, etc. in the model
+
+    init_guess : dict, optional
+        Unused by the solver, kept for compatibility with
+        :class:`.LiveBuild`
+
+    name : str, optional
+        Name for the contained model
+
+    forgetting : float, optional
+        Factor between 0 and 1 that down-weights previous events each time a
+        new one arrives, tracking a slowly drifting response
+
+    Example
+    -------
+    .. code::
+
+        fit = LinearResponseFit('yag_detector_stats2_centroid_x',
+                                ['m1h_pitch', 'm2h_pitch', 'xrtm2_pitch'])
+        fit.eval_batch(np.array([[0, 0, 0], [10, 0, -5]]))
+        fit.backsolve(250, m1h_pitch=0)
+    """
+    def __init__(self, y, inputs, init_guess=None, update_every=1,
+                 name=None, average=1, forgetting=None):
+        if forgetting is not None and not 0 < forgetting <= 1:
+            raise ValueError("Forgetting factor must be between 0 and 1")
+        self.inputs     = list(inputs)
+        self.forgetting = forgetting
+        self.var_names  = ['a{}'.format(i) for i in range(len(self.inputs))]
+        self.par_names  = ['x{}'.format(i)
+                           for i in range(len(self.inputs) + 1)]
+        #The normal equations are cleared when LiveFit resets
+        self._clear_sums()
+
+        #Model with one gain per input. lmfit only finds the variables and
+        #parameters of positional arguments in the signature
+        def response(**kwargs):
+            return kwargs['x0'] + sum(kwargs[x] * kwargs[a] for (a, x)
+                                      in zip(self.var_names,
+                                             self.par_names[1:]))
+
+        response.__signature__ = inspect.Signature(
+                [inspect.Parameter(arg,
+                                   inspect.Parameter.POSITIONAL_OR_KEYWORD)
+                 for arg in self.var_names + self.par_names])
+        model = lmfit.Model(response, independent_vars=self.var_names,
+                            missing='drop', name=name)
+
+        #Initialize parameters
+        init = dict.fromkeys(self.par_names, 0)
+        if init_guess:
+            init.update(init_guess)
+
+        super().__init__(model, y,
+                         independent_vars=dict(zip(self.var_names,
+                                                   self.inputs)),
+                         init_guess=init, update_every=update_every,
+                         average=average)
+
+
+    def _clear_sums(self):
+        size         = len(self.inputs) + 1
+        self.count   = 0
+        self._origin = None
+        self._A      = np.zeros((size, size))
+        self._b      = np.zeros(size)
+        self._yy     = 0.
+
+
+    def _reset(self):
+        super()._reset()
+        self._clear_sums()
+
+
+    def update_caches(self, y, independent_vars):
+        super().update_caches(y, independent_vars)
+        point = np.array([independent_vars[a] for a in self.var_names]
+                         + [y], dtype=float)
+        if not np.all(np.isfinite(point)):
+            return
+        #Accumulate relative to the first event for numerical stability
+        if self._origin is None:
+            self._origin = point
+        rel = point - self._origin
+        row = np.concatenate([[1.], rel[:-1]])
+        if self.forgetting is not None:
+            self._A  *= self.forgetting
+            self._b  *= self.forgetting
+            self._yy *= self.forgetting
+        self._A  += np.outer(row, row)
+        self._b  += row * rel[-1]
+        self._yy += rel[-1]**2
+        self.count += 1
+
+
+    def solve(self):
+        """
+        Solve the accumulated normal equations
+
+        If the inputs have not been varied independently the system is rank
+        deficient and the minimum-norm solution is used
+        """
+        size = len(self.par_names)
+        if self.count < size:
+            logger.debug("Model %s needs %s events to fit, has %s",
+                         self.name, size, self.count)
+            return
+        theta, _, rank, _ = np.linalg.lstsq(self._A, self._b, rcond=None)
+        if rank < size:
+            logger.debug("Model %s is underdetermined, rank %s of %s",
+                         self.name, rank, size)
+        gains  = theta[1:]
+        origin = self._origin[:-1]
+        offset = self._origin[-1] + theta[0] - np.dot(gains, origin)
+        #Uncertainties from the residual scatter
+        weight = self._A[0, 0]
+        sse    = max(self._yy - 2*np.dot(theta, self._b)
+                     + theta.dot(self._A).dot(theta), 0.)
+        if weight > size and rank == size:
+            cov = sse / (weight - size) * np.linalg.inv(self._A)
+        else:
+            cov = np.full((size, size), np.nan)
+        #Move the offset from the first point back to the origin
+        shift  = np.eye(size)
+        shift[0, 1:] = -origin
+        cov    = shift.dot(cov).dot(shift.T)
+        errors = np.sqrt(np.diag(cov))
+        values = dict(zip(self.par_names, np.concatenate([[offset], gains])))
+        self.result = LinearResult(self.model, values,
+                                   dict(zip(self.par_names, errors)),
+                                   ndata=self.count, covar=cov)
+        self.stale = False
+
+
+    @property
+    def gains(self):
+        """
+        Fitted response of the centroid to each input
+        """
+        return np.array([self.result.values[x] for x in self.par_names[1:]])
+
+
+    def _lookup(self, kwargs):
+        """
+        Map values given by model name or event key to the model names
+        """
+        values = dict()
+        for a, key in zip(self.var_names, self.inputs):
+            if a in kwargs:
+                values[a] = kwargs[a]
+            elif key in kwargs:
+                values[a] = kwargs[key]
+        return values
+
+
+    def eval_batch(self, configs):
+        """
+        Predict the centroid for many mirror configurations at once
+
+        Parameters
+        ----------
+        configs : array_like
+            Array whose last axis holds the value of each input
+
+        Returns
+        -------
+        centroid : np.ndarray
+            Predicted centroid for each configuration
+        """
+        if not self.result:
+            raise RuntimeError("Can not evaluate without a saved fit, "\
+                               "use .update_fit()")
+        configs = np.asarray(configs, dtype=float)
+        return self.result.values['x0'] + configs.dot(self.gains)
+
+
+    def eval(self, **kwargs):
+        """
+        Evaluate the predicted centroid for a configuration of the inputs
+
+        Parameters
+        ----------
+        kwargs :
+            Value of every input, either by model name, e.g ``a0``, or by
+            event key. Arrays are broadcast against each other to evaluate
+            several configurations
+
+        Returns
+        -------
+        centroid : float or np.ndarray
+            Position of the centroid as predicted by the current model fit
+        """
+        #Check result
+        super().eval(**kwargs)
+        values = self._lookup(kwargs)
+        missing = [a for a in self.var_names if a not in values]
+        if missing:
+            raise ValueError("Must supply values for {}".format(
+                             [self.inputs[self.var_names.index(a)]
+                              for a in missing]))
+        configs = np.broadcast_arrays(*[np.asarray(values[a], dtype=float)
+                                        for a in self.var_names])
+        return self.eval_batch(np.stack(configs, axis=-1))
+
+
+    def backsolve(self, target, start=None, **kwargs):
+        """
+        Find the configuration that reaches a target centroid
+
+        Any subset of the inputs can be held fixed. The remaining inputs are
+        solved for together, choosing the smallest total move away from
+        ``start`` that reaches the target.
+
+        Parameters
+        ----------
+        target : float
+            Desired pixel location
+
+        start : dict, optional
+            Current position of the free inputs, by model name or event key.
+            Free inputs without a start position are measured from zero
+
+        kwargs :
+            Values of the fixed inputs, by model name or event key
+
+        Returns
+        -------
+        positions : dict
+            Model name and solved value of each free input
+        """
+        #Make sure we have a fit
+        super().backsolve(target, **kwargs)
+        fixed = self._lookup(kwargs)
+        free  = [i for i, a in enumerate(self.var_names) if a not in fixed]
+        if not free:
+            raise ValueError("At least one input must be free to backsolve")
+        start  = self._lookup(start or dict())
+        origin = np.array([start.get(self.var_names[i], 0.) for i in free])
+        gains  = self.gains
+        #Distance left to cover with the free inputs
+        resid  = (target - self.result.values['x0']
+                  - sum(gains[i] * fixed[a]
+                        for i, a in enumerate(self.var_names) if a in fixed)
+                  - np.dot(gains[free], origin))
+        if not np.any(gains[free]):
+            raise ValueError("Unable to backsolve, the free inputs have no "
+                             "effect after {} data points"
+                             "".format(len(self.ydata)))
+        #Minimum-norm solution of the single equation
+        step = np.linalg.lstsq(gains[free][np.newaxis, :], [resid],
+                               rcond=None)[0]
+        return dict((self.var_names[i], pos)
+                    for i, pos in zip(free, origin + step))
+
+
+class LivePlotWithGoal(ShotPageFilter, LivePlot):
     """
     Build a function that updates a plot from a stream of Events.
     
@@ -559,6 +1592,8 @@ class LivePlotWithGoal(LivePlot):
         super().start(doc)
 
     def event(self, doc):
+        if self.is_shot_page(doc):
+            return
         super().event(doc)
         self.event_count += 1
 
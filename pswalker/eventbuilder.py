@@ -0,0 +1,211 @@
+"""
+Assemble readings from several devices into coherent shots
+"""
+############
+# Standard #
+############
+import logging
+
+##########
+# Module #
+##########
+from .buffers import RunningStats
+
+logger = logging.getLogger(__name__)
+
+
+class EventBuilder:
+    """
+    Align the readings of several devices to the same beam pulse
+
+    Each call to :meth:`.build` is handed the raw output of ``read`` for every
+    device in a shot. The timestamp of the ``reference`` key defines the pulse,
+    and every other aligned key must report a timestamp within ``tolerance``
+    of it. Keys listed in ``interpolate`` that updated after the pulse are
+    linearly interpolated back to the reference time from their previous
+    reading. Devices that report an areaDetector array counter can instead be
+    aligned by requiring that every counter advanced by the same number of
+    frames as the reference counter since the last shot. Shots that can not be
+    aligned are rejected.
+
+    Parameters
+    ----------
+    reference : str
+        Key whose timestamp defines the shot
+
+    keys : list, optional
+        Keys that must be aligned to the reference. All other keys are passed
+        through unchecked, which is appropriate for slow readbacks such as
+        motor positions that only update when moving. By default, only the
+        other keys of the device that reports the reference are aligned, see
+        :meth:`.build`
+
+    tolerance : float, optional
+        Maximum difference in seconds between the timestamp of a key and the
+        reference
+
+    interpolate : list, optional
+        Keys that may be interpolated to the reference time
+
+    counters : dict, optional
+        Map of aligned key to the key of the array counter of its device. If
+        given, these keys are aligned by counter instead of by timestamp. The
+        reference key must be included. A shot without one of the counters
+        raises a ValueError
+
+    Example
+    -------
+    .. code::
+
+        builder = EventBuilder('yag_detector_stats2_centroid_x',
+                               keys=['yag2_detector_stats2_centroid_x'],
+                               tolerance=0.004)
+        RE(measure([yag, yag2, mirror], num=10, align=builder))
+        builder.stats
+    """
+    def __init__(self, reference, keys=None, tolerance=1e-3,
+                 interpolate=None, counters=None):
+        self.reference   = reference
+        self.keys        = keys
+        self.tolerance   = tolerance
+        self.interpolate = set(interpolate or list())
+        self.counters    = dict(counters or dict())
+        if self.counters and reference not in self.counters:
+            raise ValueError("Array counter for reference key {} must be "
+                             "provided".format(reference))
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget previous readings and clear the alignment statistics
+        """
+        self._previous    = dict()
+        self._skew        = RunningStats()
+        self._max_skew    = 0.
+        self.shots        = 0
+        self.aligned      = 0
+        self.interpolated = 0
+        self.dropped      = 0
+
+
+    @property
+    def stats(self):
+        """
+        Summary of the alignment performance
+
+        Returns
+        -------
+        stats : dict
+            Number of ``shots`` presented, ``aligned`` and ``dropped``, the
+            number of values ``interpolated`` as well as the ``mean_skew`` and
+            ``max_skew`` in seconds of accepted timestamps from the reference
+        """
+        return {'shots' : self.shots, 'aligned' : self.aligned,
+                'dropped' : self.dropped, 'interpolated' : self.interpolated,
+                'mean_skew' : self._skew.mean, 'max_skew' : self._max_skew}
+
+
+    def _aligned_keys(self, reading, own=None):
+        if self.keys is not None:
+            keys = self.keys
+        elif own is not None:
+            keys = list(own) + [key for key in self.interpolate
+                                if key not in own]
+        else:
+            keys = reading
+        return [key for key in keys if key != self.reference]
+
+
+    def _by_counter(self, reading):
+        """
+        Check that all array counters advanced in lockstep
+        """
+        missing = [(key, cnt) for key, cnt in self.counters.items()
+                   if cnt not in reading]
+        if missing:
+            raise ValueError("Array counters missing from the shot, {}. "
+                             "Check that each device reports its counter"
+                             "".format(', '.join('{} of {}'.format(cnt, key)
+                                                 for key, cnt in missing)))
+        counts = dict((key, reading[cnt]['value'])
+                      for key, cnt in self.counters.items())
+        previous = self._previous.get('counters')
+        self._previous['counters'] = counts
+        #Nothing to compare the first shot against
+        if previous is None:
+            return True
+        step = counts[self.reference] - previous[self.reference]
+        return all(counts[key] - previous[key] == step for key in counts)
+
+
+    def build(self, reading, own=None):
+        """
+        Align a single shot
+
+        Parameters
+        ----------
+        reading : dict
+            Merged output of ``read`` from each device, mapping keys to
+            dictionaries with ``value`` and ``timestamp``
+
+        own : list, optional
+            Keys read from the device that reports the reference. Unless
+            ``keys`` were given, only these and the keys in ``interpolate``
+            are aligned. If neither is given, every key is aligned
+
+        Returns
+        -------
+        shot : dict or None
+            Field name and value pairs of the aligned shot, None if the shot
+            could not be aligned and should be dropped
+        """
+        self.shots += 1
+        shot = dict((key, val['value']) for key, val in reading.items())
+        try:
+            ref_ts = reading[self.reference]['timestamp']
+        except KeyError:
+            logger.debug("Reference key %s missing from shot", self.reference)
+            self.dropped += 1
+            return None
+
+        ok = True
+        if self.counters:
+            ok = self._by_counter(reading)
+        else:
+            for key in self._aligned_keys(reading, own=own):
+                try:
+                    ts = reading[key]['timestamp']
+                except KeyError:
+                    ok = False
+                    break
+                skew = abs(ts - ref_ts)
+                if skew <= self.tolerance:
+                    self._skew.update(skew)
+                    self._max_skew = max(self._max_skew, skew)
+                    continue
+                #Interpolate values that updated after the pulse
+                prev = self._previous.get(key)
+                if (key in self.interpolate and prev is not None
+                        and prev['timestamp'] <= ref_ts <= ts
+                        and ts > prev['timestamp']):
+                    frac = (ref_ts - prev['timestamp'])/(ts - prev['timestamp'])
+                    shot[key] = (prev['value']
+                                 + frac * (reading[key]['value'] - prev['value']))
+                    self.interpolated += 1
+                    continue
+                logger.debug("Reading of %s is %.4fs from the reference",
+                             key, skew)
+                ok = False
+                break
+
+        #Store readings for interpolation of the next shot
+        for key in self.interpolate:
+            if key in reading:
+                self._previous[key] = reading[key]
+
+        if not ok:
+            self.dropped += 1
+            return None
+        self.aligned += 1
+        return shot
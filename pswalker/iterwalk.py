@@ -5,10 +5,17 @@ import logging
 import uuid
 from copy import copy
 
+import numpy as np
 from bluesky.plan_stubs import checkpoint, mv, wait as plan_wait, abs_set
 
-from .plans import walk_to_pixel, measure_average
+from .plans import walk_to_pixel, measure_stats, read_timing
 from .plan_stubs import prep_img_motors
+from .buffers import PrecisionStop
+from .strategies import BroydenJacobian
+from .store import WalkCheckpoint
+from .callbacks import fit_errors
+from .timing import PhaseTimer, DeadlinePlanner
+from .profiling import StackSampler
 from .utils.argutils import as_list, field_prepend
 from .utils.exceptions import FilterCountError
 
@@ -19,7 +26,13 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
              gradients=None, detector_fields='centroid_x',
              motor_fields='alpha', tolerances=20, system=None, averages=1,
              overshoot=0, max_walks=None, timeout=None, recovery_plan=None,
-             filters=None, tol_scaling=None):
+             filters=None, tol_scaling=None, min_averages=None,
+             monitors=False, emit='shots', beams=None,
+             selective_read=False, incremental_fit=False, model_store=None,
+             energy=None, joint=False, jacobian=None, scheduler=None,
+             walk_checkpoint=None, resume=False, deadline=None,
+             overlap=False, timer=None, profile=None, delay=None,
+             uniques=None):
     """
     Iteratively adjust a system of detectors and motors where each motor
     primarily affects the reading of a single detector but also affects the
@@ -122,7 +135,128 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
         from the goal, tolerance for the walk is set at
         current_dist/tol_scaling instead of the set tolerance. Scaling ends
         when calculated tolerance < targeted tolerance.  
+
+    min_averages: list of numbers, optional
+        For each detector, the minimum number of shots to average. If
+        provided, measurements stop as soon as it is statistically settled
+        whether the beam is within tolerance of the goal, and ``averages``
+        becomes the maximum number of shots. See :class:`.PrecisionStop`
+
+    monitors: list of bools, optional
+        For each detector, whether to collect the updates pushed by the
+        centroid and motor readback signals instead of triggering and reading
+        each shot. See :func:`.measure_monitor`
+
+    emit: {'shots', 'summary', 'page'}, optional
+        Documents emitted for each measurement. 'summary' and 'page' save a
+        single averaged Event per measurement instead of an Event per shot,
+        see :func:`.measure`
+
+    beams: list of :class:`.BeamPresence`, optional
+        For each detector, a check for the presence of beam. A measurement
+        that loses the beam raises a :class:`.BeamLostError` within a few
+        shots, handing off to the ``recovery_plan`` immediately
+
+    selective_read: bool, optional
+        Only read the centroid, motor readback and filter keys of each shot
+        instead of every component of the detector, motor and ``system``
+        devices. The shots of each detector are saved in a separate stream,
+        see :func:`.measure`
+
+    incremental_fit: bool, optional
+        Update the linear fit of each walk in constant time from running sums
+        instead of refitting with lmfit. See :class:`.IncrementalLinearFit`
+
+    model_store: :class:`.ModelStore`, optional
+        Persistent record of previous fits. Any detector without a provided
+        gradient is seeded with the stored slope of its mirror, and the final
+        fits are recorded once the walk finishes. The stored intercept is not
+        used, the first step is taken from the measured position of the beam
+
+    energy: float, optional
+        Photon energy used to select and record fits in the ``model_store``
+
+    joint: bool, optional
+        Move every motor at once to the setpoint predicted by the estimated
+        sensitivity of every detector to every motor, cycling the detectors
+        only to verify each move. See :func:`.jointwalk`. The
+        ``overshoot``, ``tol_scaling``, ``incremental_fit``, ``scheduler``
+        and ``overlap`` options do not apply
+
+    jacobian: array-like, optional
+        Initial sensitivities for the ``joint`` mode, one row per detector
+        and one column per motor
+
+    scheduler: :class:`.CouplingScheduler`, optional
+        Choose the order the detectors are visited in from the predicted
+        effect of each move on every detector, instead of cycling through
+        them in order. Detectors predicted to stay well within tolerance are
+        only verified once the others are done
+
+    walk_checkpoint: :class:`.WalkCheckpoint`, optional
+        Save the gradients, fits, motor positions, finished flags and
+        progress of the walk to disk
+        before visiting each detector. The checkpoint is removed once the
+        alignment converges. In the ``joint`` mode, the estimated
+        sensitivities are saved after each joint step instead
+
+    resume: bool, optional
+        Continue from the ``walk_checkpoint`` of an interrupted walk of the
+        same system to the same goals. The motors are returned to the
+        positions saved in the checkpoint rather than their nominal or
+        ``starts`` positions, the fits of the previous walks are kept for the
+        ``model_store``, and detectors that were already aligned only need to
+        be verified
+
+    deadline: float or :class:`.DeadlinePlanner`, optional
+        Seconds available for the alignment. The remaining cost is projected
+        from the measured time of each imager insertion, measurement and
+        mirror walk. When it exceeds the time left, ``averages`` and
+        ``tol_scaling`` are reduced in proportion. Once the deadline passes,
+        the walk finishes with the alignment it has reached instead of
+        raising. The projected completion time is available as
+        :attr:`.DeadlinePlanner.eta` throughout
+
+    overlap: bool, optional
+        Move each mirror while its imager is being inserted rather than
+        afterwards. The moves to the nominal positions are made with the
+        first insertion, and each mirror is moved to its ``starts`` position
+        with its first insertion. With a ``scheduler``, a mirror whose
+        detector is predicted to be out of tolerance is moved to the
+        position predicted by the learned coupling
+
+    timer: :class:`.PhaseTimer`, optional
+        Record the time spent inserting imagers, measuring, rejecting shots,
+        fitting, moving the mirrors, walking and recovering. A summary is
+        logged when the walk finishes, and :meth:`.PhaseTimer.report` gives
+        the full breakdown. Shared with the ``deadline``
+
+    profile: str or :class:`.StackSampler`, optional
+        Sample the Python stack of the RunEngine for the length of the walk
+        to find the time spent by each function of ``pswalker``. Given a
+        path, the summary and collapsed stacks are saved there once the walk
+        finishes
+
+    delay: float or 'auto', optional
+        Minimum time between consecutive shots. With 'auto', the time between
+        frames reported by the camera or the beam rate is used, see
+        :func:`.read_cadence`
+
+    uniques: list of strings, optional
+        For each detector, the key that identifies a frame, e.g the
+        areaDetector array counter. Repeated frames are skipped rather than
+        averaged, see :func:`.measure`
+
+    The ``delay`` and the time to wait after a repeated frame are resolved
+    for each detector once at the start of the walk, see :func:`.read_timing`
     """
+    # Sample the stack for the whole walk
+    if profile is not None:
+        options = dict(locals(), profile=None)
+        if not isinstance(profile, StackSampler):
+            profile = StackSampler(path=profile)
+        return (yield from profile.wrapper(iterwalk(**options)))
+
     num = len(detectors)
 
     # Listify most optional arguments
@@ -137,10 +271,53 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
     averages = as_list(averages, num)
     filters = as_list(filters, num)
     tol_scaling = as_list(tol_scaling, num)
+    min_averages = as_list(min_averages, num)
+    monitors = as_list(monitors, num)
+    beams = as_list(beams, num)
+    uniques = as_list(uniques, num)
+    # Read the camera rates once rather than for every measurement
+    timings = [read_timing([det], delay=delay, unique=unique)
+               for det, unique in zip(detectors, uniques)]
+
+    # Warm start from previous alignments
+    if model_store is not None:
+        for index in range(num):
+            record = model_store.lookup(
+                motors[index].name, detectors[index].name,
+                field_prepend(motor_fields[index], motors[index]),
+                field_prepend(detector_fields[index], detectors[index]),
+                energy=energy)
+            if record is None:
+                continue
+            logger.info("Seeding %s from stored slope %s +/- %s",
+                        motors[index].name, record.slope, record.slope_err)
+            # The intercept drifts between alignments, the first measurement
+            # of the walk anchors the line instead
+            if gradients[index] is None:
+                gradients[index] = record.slope
 
     logger.debug("iterwalk aligning %s to %s on %s",
                  motors, goals, detectors)
 
+    # Seed the coupling of each mirror to its own detector
+    if scheduler is not None:
+        scheduler.reset()
+        for index, gradient in enumerate(gradients):
+            if (gradient is not None
+                    and not np.isfinite(scheduler.coupling[index, index])):
+                scheduler.coupling[index, index] = gradient
+
+    # Plan the rest of the walk against the deadline
+    if deadline is not None and not isinstance(deadline, DeadlinePlanner):
+        deadline = DeadlinePlanner(deadline, timer=timer)
+    elif deadline is not None:
+        deadline.timer = timer or deadline.timer
+        deadline.reset()
+    if deadline is not None:
+        timer = deadline.timer
+    timer = timer or PhaseTimer()
+    out_of_time = False
+
     # Debug counters
     mirror_walks = 0
     yag_cycles = 0
@@ -149,44 +326,214 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
     n_steps = 0
     start_time = time.time()
     models   = [None]* num
+    fits     = [None] * num
     finished = [False] * num
     done_pos = [0] * num
     selected_tol = [None] * num
+    start_index = 0
+
+    # Pick up from an interrupted walk
+    if walk_checkpoint is not None:
+        identity = WalkCheckpoint.identity(detectors, motors, goals,
+                                           joint=joint)
+        state = walk_checkpoint.load(identity) if resume else None
+    else:
+        state = None
+    if state is not None and not joint:
+        logger.info("Resuming walk from step %s on %s",
+                    state['n_steps'], detectors[state['index']].name)
+        start_index = state['index']
+        n_steps = state['n_steps']
+        recoveries = state['recoveries']
+        mirror_walks = state['mirror_walks']
+        yag_cycles = state['yag_cycles']
+        gradients = state['gradients']
+        first_steps = state['first_steps']
+        finished = state['finished']
+        done_pos = state['done_pos']
+        selected_tol = state['selected_tol']
+        fits = state.get('fits', fits)
+
+    def save_state(index):
+        if walk_checkpoint is None:
+            return
+        walk_checkpoint.save(identity,
+                             {'index' : index, 'n_steps' : n_steps,
+                              'recoveries' : recoveries,
+                              'mirror_walks' : mirror_walks,
+                              'yag_cycles' : yag_cycles,
+                              'gradients' : gradients,
+                              'first_steps' : first_steps,
+                              'finished' : finished, 'done_pos' : done_pos,
+                              'selected_tol' : selected_tol,
+                              'fits' : fits,
+                              'positions' : [mot.position for mot in motors]})
 
     moving_to_nominal = False
+    pending_moves = list()
     group = str(uuid.uuid4())
-    for mot in motors:
+    # Keep the positions reached by an interrupted walk
+    for mot in (motors if state is None else list()):
         try:
             position = mot.nominal_position
         except AttributeError:
             continue
-        if position is not None:
+        if position is not None and overlap and not joint:
+            # Wait for these with the first imager
+            pending_moves.append((mot, position))
+        elif position is not None:
             yield from abs_set(mot, mot.nominal_position, group=group)
             moving_to_nominal = True
     if moving_to_nominal:
         yield from plan_wait(group=group)
 
+    # Return the motors to where the interrupted walk left them
+    if state is not None and not joint:
+        restoring = False
+        for mot, position in zip(motors, state['positions']):
+            if position is None or np.isclose(mot.position, position):
+                continue
+            logger.warning("%s has moved from %s to %s since the checkpoint, "
+                           "restoring it", mot.name, position, mot.position)
+            yield from abs_set(mot, position, group=group)
+            restoring = True
+        if restoring:
+            yield from plan_wait(group=group)
+
+    def report():
+        logger.info("Time spent in each phase: %s",
+                    ', '.join('{} {:.2f}s over {}'.format(name,
+                                                         timer.total(name),
+                                                         timer.count(name))
+                              for name in sorted(timer.phases)))
+
+    if joint:
+        yield from jointwalk(detectors, motors, goals, starts=starts,
+                             first_steps=first_steps, gradients=gradients,
+                             detector_fields=detector_fields,
+                             motor_fields=motor_fields,
+                             tolerances=tolerances, system=system,
+                             averages=averages, max_walks=max_walks,
+                             timeout=timeout, filters=filters,
+                             min_averages=min_averages, monitors=monitors,
+                             emit=emit, beams=beams,
+                             selective_read=selective_read,
+                             jacobian=jacobian, model_store=model_store,
+                             energy=energy, delay=delay, uniques=uniques,
+                             timings=timings,
+                             recovery_plan=recovery_plan,
+                             walk_checkpoint=walk_checkpoint, resume=resume,
+                             deadline=deadline, timer=timer)
+        report()
+        return
+
+    # Track the inserted imager to avoid needless insertions
+    inserted = None
+    visits = 0
+
+    def predicted_setpoint(index):
+        # Position that removes the predicted error of a detector
+        residual = scheduler.predicted(index)
+        slope = scheduler.coupling[index, index]
+        if (np.isfinite(residual) and np.isfinite(slope) and slope
+                and abs(residual) >= tolerances[index]):
+            return motors[index].position - residual / slope
+        return None
+
+    def converged():
+        if scheduler is not None:
+            return scheduler.converged
+        return all(finished)
+
+    def advance(index):
+        nonlocal visits
+        if scheduler is None:
+            return index + 1
+        # Each set of walks visits as many detectors as a sequential one
+        visits += 1
+        if visits >= num:
+            return None
+        return scheduler.next_index(inserted)
+
     while True:
-        index = 0
-        while index < num:
+        visits = 0
+        index = scheduler.next_index(inserted) if scheduler else start_index
+        start_index = 0
+        while index is not None and index < num:
             try:
+                save_state(index)
+
                 # Before each walk, check the global timeout.
                 if timeout is not None and time.time() - start_time > timeout:
                     raise RuntimeError("Iterwalk has timed out after %s s",
                                        time.time() - start_time)
 
-                logger.debug("putting imager in")
-                ok = (yield from prep_img_motors(index, detectors, timeout=15))
-                yag_cycles += 1
+                # Trade precision for time as the deadline approaches
+                average = averages[index]
+                scaling = tol_scaling[index]
+                if deadline is not None:
+                    if deadline.expired:
+                        logger.warning("Deadline reached, finishing with the "
+                                       "current alignment")
+                        out_of_time = True
+                        break
+                    walks_left = sum(not done for done in finished[index:])
+                    deadline.update(visits=(num - index
+                                            + (num if walks_left else 0)),
+                                    walks=walks_left)
+                    logger.info("Alignment projected to finish in %.0f s",
+                                deadline.eta - time.time())
+                    average = deadline.average(average)
+                    scaling = deadline.tol_scaling(scaling)
 
-                # Be loud if the yags fail to move! Operator should know!
-                if not ok:
-                    err = "Detector motion timed out!"
-                    logger.error(err)
-                    raise RuntimeError(err)
+                # Mirror moves to overlap with the imager motion
+                extra_moves = list()
+                if overlap:
+                    extra_moves, pending_moves = pending_moves, list()
+                    if n_steps == 0 and starts[index] is not None and not state:
+                        setpoint = starts[index]
+                    elif scheduler is not None:
+                        setpoint = predicted_setpoint(index)
+                    else:
+                        setpoint = None
+                    if setpoint is not None:
+                        extra_moves = [(mot, pos) for (mot, pos) in extra_moves
+                                       if mot is not motors[index]]
+                        extra_moves.append((motors[index], setpoint))
+                before = [mot.position for (mot, pos) in extra_moves]
+
+                if scheduler is not None and index == inserted:
+                    logger.debug("imager is already in")
+                    scheduler.reordered += 1
+                    if extra_moves:
+                        group = str(uuid.uuid4())
+                        for mot, pos in extra_moves:
+                            yield from abs_set(mot, pos, group=group)
+                        yield from plan_wait(group=group)
+                else:
+                    logger.debug("putting imager in")
+                    with timer.phase(DeadlinePlanner.imager):
+                        ok = (yield from prep_img_motors(
+                                                    index, detectors,
+                                                    timeout=15,
+                                                    extra_moves=extra_moves))
+                    yag_cycles += 1
+
+                    # Be loud if the yags fail to move! Operator should know!
+                    if not ok:
+                        err = "Detector motion timed out!"
+                        logger.error(err)
+                        raise RuntimeError(err)
+                    inserted = index
+
+                # Let the scheduler know about the overlapped moves
+                if scheduler is not None:
+                    for (mot, pos), old in zip(extra_moves, before):
+                        scheduler.moved(motors.index(mot), mot.position - old)
 
                 # Choose a start position for the first move if it was given
-                if n_steps == 0 and starts[index] is not None:
+                if (n_steps == 0 and starts[index] is not None and not state
+                        and not overlap):
                     firstpos = starts[index]
                 else:
                     firstpos = None
@@ -210,29 +557,61 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
                 original_position = motors[index].position
 
                 # Check if we're already done
-                logger.debug("measure_average on det=%s, mot=%s, sys=%s",
+                logger.debug("measure_stats on det=%s, mot=%s, sys=%s",
                              detectors[index], motors[index], full_system)
-                avgs = (yield from measure_average([detectors[index],
-                                                    motors[index]]
-                                                    + full_system,
-                                                    num=averages[index],
-                                                    filters=filters[index]))
+                det_field = field_prepend(detector_fields[index],
+                                          detectors[index])
+                mot_field = field_prepend(motor_fields[index], motors[index])
+                if monitors[index]:
+                    monitor = [det_field, mot_field]
+                else:
+                    monitor = None
+                if selective_read:
+                    fields = [det_field, mot_field]
+                else:
+                    fields = None
+                if min_averages[index]:
+                    stop = PrecisionStop(det_field,
+                                         min_num=min_averages[index],
+                                         goal=goals[index],
+                                         tolerance=tolerances[index])
+                else:
+                    stop = None
+                read_delay, cadence = timings[index]
+                with timer.phase(DeadlinePlanner.measure):
+                    stats = (yield from measure_stats([detectors[index],
+                                                       motors[index]]
+                                                      + full_system,
+                                                      num=average,
+                                                      filters=filters[index],
+                                                      stop=stop,
+                                                      monitor=monitor,
+                                                      emit=emit,
+                                                      beam=beams[index],
+                                                      fields=fields,
+                                                      timer=timer,
+                                                      delay=read_delay,
+                                                      unique=uniques[index],
+                                                      cadence=cadence))
+
+                det_stats = stats[det_field]
+                pos = det_stats.mean
+                logger.debug("recieved %s +/- %s from measure_stats on %s",
+                             pos, det_stats.sem, detectors[index])
 
-                pos = avgs[field_prepend(detector_fields[index],
-                                         detectors[index])]
-                logger.debug("recieved %s from measure_average on %s", pos,
-                             detectors[index])
+                if scheduler is not None:
+                    scheduler.measured(index, pos - goals[index])
 
                 if abs(pos - goals[index]) < tolerances[index]:
                     logger.info("Beam was aligned on %s without a move",
                                  detectors[index].name)
                     finished[index] = True
                     done_pos[index] = pos
-                    if all(finished):
+                    if converged():
                         logger.debug("beam aligned on all yags")
                         break
                     # Increment index before restarting loop
-                    index += 1
+                    index = advance(index)
                     continue
                 else:
                     # If any of the detectors were wrong, reset finished flags
@@ -246,9 +625,9 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
                     goal = (goals[index] - pos) * (1 + overshoot) + pos
 
                 # Calculate adaptive tolerance - otherwise use static tolerance
-                if tol_scaling[index] != None:
+                if scaling != None:
                     selected_tol[index] = \
-                        abs(pos-goals[index]) / tol_scaling[index]
+                        abs(pos-goals[index]) / scaling
                     if selected_tol[index] < tolerances[index]:
                         selected_tol[index] = tolerances[index]
                 else:
@@ -268,25 +647,43 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
                 logger.debug("selected tolerance: {}".format(
                     selected_tol[index]))
 
-                pos, models[index] = (
-                    yield from walk_to_pixel(
-                        detectors[index],
-                        motors[index],
-                        goal,
-                        filters=filters[index],
-                        start=firstpos,
-                        gradient=gradients[index],
-                        target_fields=[
-                            detector_fields[index],
-                            motor_fields[index]],
-                        first_step=first_steps[index],
-                        tolerance=selected_tol[index],
-                        system=full_system,
-                        average=averages[index],
-                        max_steps=10))
+                with timer.phase(DeadlinePlanner.walk):
+                    pos, models[index] = (
+                        yield from walk_to_pixel(
+                            detectors[index],
+                            motors[index],
+                            goal,
+                            filters=filters[index],
+                            start=firstpos,
+                            gradient=gradients[index],
+                            target_fields=[
+                                detector_fields[index],
+                                motor_fields[index]],
+                            first_step=first_steps[index],
+                            tolerance=selected_tol[index],
+                            system=full_system,
+                            average=average,
+                            max_steps=10,
+                            min_average=min_averages[index],
+                            monitor=monitors[index],
+                            emit=emit,
+                            beam=beams[index],
+                            selective_read=selective_read,
+                            incremental_fit=incremental_fit,
+                            timer=timer,
+                            delay=read_delay,
+                            unique=uniques[index],
+                            cadence=cadence))
 
                 if models[index]:
                     try:
+                        result = models[index].result
+                        errors = fit_errors(result)
+                        fits[index] = {
+                            'slope' : float(result.values['slope']),
+                            'intercept' : float(result.values['intercept']),
+                            'slope_err' : errors.get('slope'),
+                            'intercept_err' : errors.get('intercept')}
                         gradients[index] = models[index].result.values['slope']
                         logger.debug("Found equation of ({}, {}) between " 
                                      "linear fit of {} to {}"
@@ -314,8 +711,16 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
                 finished[index] = True
                 done_pos[index] = pos
 
+                # Predict the effect of the move on the other detectors
+                if scheduler is not None:
+                    scheduler.moved(index,
+                                    motors[index].position - original_position)
+                    scheduler.measured(index, pos - goals[index])
+                    if gradients[index] is not None:
+                        scheduler.coupling[index, index] = gradients[index]
+
                 # Increment index before restarting loop
-                index += 1
+                index = advance(index)
             except FilterCountError as err:
                 if recovery_plan is None:
                     logger.error("No recovery plan, not attempting to recover")
@@ -337,10 +742,13 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
                     # parameters.
                     logger.info(("Bad state reached during walk_to_pixel. "
                                  "Undoing walk_to_pixel..."))
-                    yield from mv(motors[index], original_position)
+                    with timer.phase('recovery'):
+                        yield from mv(motors[index], original_position)
 
                     # Reset the finished flag
                     finished = [False] * num
+                    if scheduler is not None:
+                        scheduler.invalidate()
 
                     # Cut our step parameters in half, because they were
                     # probably too big
@@ -351,36 +759,41 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
                         first_steps[index] = first_steps[index] / -2
                     continue
 
-                ok = yield from recovery_plan(detectors=detectors,
-                                              motors=motors, goals=goals,
-                                              starts=starts,
-                                              first_steps=first_steps,
-                                              gradients=gradients,
-                                              detector_fields=detector_fields,
-                                              motor_fields=motor_fields,
-                                              tolerances=tolerances,
-                                              system=system,
-                                              averages=averages,
-                                              overshoot=overshoot,
-                                              max_walks=max_walks,
-                                              timeout=timeout,
-                                              filters=filters,
-                                              index=index)
+                with timer.phase('recovery'):
+                    ok = yield from recovery_plan(detectors=detectors,
+                                                  motors=motors, goals=goals,
+                                                  starts=starts,
+                                                  first_steps=first_steps,
+                                                  gradients=gradients,
+                                                  detector_fields=detector_fields,
+                                                  motor_fields=motor_fields,
+                                                  tolerances=tolerances,
+                                                  system=system,
+                                                  averages=averages,
+                                                  overshoot=overshoot,
+                                                  max_walks=max_walks,
+                                                  timeout=timeout,
+                                                  filters=filters,
+                                                  index=index)
 
                 # Reset the finished tag because we moved something
                 finished = [False] * num
                 recoveries += 1
+                inserted = None
+                if scheduler is not None:
+                    scheduler.invalidate()
 
                 # If recovery failed, move to nominal and switch to next device
                 if not ok:
                     logger.info(("Recover failed, using fallback pos and "
                                  "trying next device alignment."))
-                    yield from mv(motors[index], fallback_pos)
-                    index += 1
+                    with timer.phase('recovery'):
+                        yield from mv(motors[index], fallback_pos)
+                    index = advance(index)
                 # Try again
                 continue
 
-        if all(finished):
+        if converged() or out_of_time:
             break
 
         # After each set of walks, check if we've exceeded max_walks
@@ -403,3 +816,350 @@ def iterwalk(detectors, motors, goals, starts=None, first_steps=1,
                 goals,
                 [d - g for g, d in zip(goals, done_pos)],
                 [m.position for m in motors])
+    if scheduler is not None:
+        logger.info("Scheduler postponed %s verifications and reused the "
+                    "inserted imager for %s visits", scheduler.postponed,
+                    scheduler.reordered)
+    report()
+
+    # Nothing left to resume
+    if walk_checkpoint is not None and converged():
+        walk_checkpoint.clear()
+
+    # Remember the fits for the next alignment, including those made before
+    # the walk was resumed
+    if model_store is not None:
+        for index, fit in enumerate(fits):
+            if fit is None:
+                continue
+            model_store.record(
+                motors[index].name, detectors[index].name,
+                field_prepend(motor_fields[index], motors[index]),
+                field_prepend(detector_fields[index], detectors[index]),
+                energy=energy, save=False, **fit)
+        model_store.save()
+
+
+def jointwalk(detectors, motors, goals, starts=None, first_steps=1,
+              gradients=None, detector_fields='centroid_x',
+              motor_fields='alpha', tolerances=20, system=None, averages=1,
+              max_walks=None, timeout=None, filters=None, min_averages=None,
+              monitors=False, emit='shots', beams=None, selective_read=False,
+              jacobian=None, damping=1., model_store=None, energy=None,
+              delay=None, uniques=None, timings=None, recovery_plan=None,
+              walk_checkpoint=None, resume=False, deadline=None, timer=None):
+    """
+    Align a system of detectors and motors by moving every motor at once
+
+    Instead of walking one mirror at a time, the sensitivity of every
+    detector to every motor is estimated and all of the motors are moved
+    together to the setpoint that solves for every goal. Each detector is
+    then inserted in turn to measure the result, and the observed response
+    corrects the estimate with a :class:`.BroydenJacobian` update. Detectors
+    are only cycled to verify each joint step, so a system whose response is
+    linear converges after a single move.
+
+    As in :func:`.iterwalk`, detectors earlier in the list are assumed to be
+    upstream of the motors that follow their own, so a motor never moves the
+    beam on an earlier detector. Other sensitivities that are not provided
+    by ``jacobian``, ``gradients`` or the ``model_store`` are seeded from a
+    first move of their motors by ``first_steps``, see
+    :meth:`.BroydenJacobian.seed`, and refined by the steps that follow.
+
+    This is a Bluesky plan without run decorators. It takes the arguments of
+    :func:`.iterwalk`, which runs it when ``joint`` is set, with a few
+    additions.
+
+    Parameters
+    ----------
+    jacobian : array-like, optional
+        Initial estimate of the change of each detector, one row each, per
+        unit move of each motor, one column each. Unknown entries may be NaN
+
+    damping : float, optional
+        Fraction of each joint step to take
+
+    model_store : :class:`.ModelStore`, optional
+        Stored slopes of each motor against each detector are used for the
+        initial estimate, and the final estimate is recorded once the walk
+        finishes
+
+    walk_checkpoint : :class:`.WalkCheckpoint`, optional
+        Save the estimate and progress of the walk to disk after each joint
+        step. The checkpoint is removed once the alignment converges
+
+    resume : bool, optional
+        Start from the estimate in the ``walk_checkpoint`` of an interrupted
+        joint walk of the same system to the same goals
+
+    deadline : :class:`.DeadlinePlanner`, optional
+        Finish with the alignment reached instead of raising once the
+        deadline passes. The number of shots is reduced as it approaches
+
+    timings : list, optional
+        Delay and repeated frame cadence of each detector, as returned by
+        :func:`.read_timing`. Resolved once at the start by default
+
+    Returns
+    -------
+    jacobian : np.ndarray
+        Final estimate of the sensitivities
+    """
+    num = len(detectors)
+    num_mot = len(motors)
+
+    # Listify most optional arguments
+    goals = as_list(goals, num)
+    starts = as_list(starts, num_mot)
+    first_steps = as_list(first_steps, num_mot, float)
+    gradients = as_list(gradients, num)
+    detector_fields = as_list(detector_fields, num)
+    motor_fields = as_list(motor_fields, num_mot)
+    tolerances = as_list(tolerances, num)
+    system = as_list(system)
+    averages = as_list(averages, num)
+    filters = as_list(filters, num)
+    min_averages = as_list(min_averages, num)
+    monitors = as_list(monitors, num)
+    beams = as_list(beams, num)
+    uniques = as_list(uniques, num)
+    if timings is None:
+        timings = [read_timing([det], delay=delay, unique=unique)
+                   for det, unique in zip(detectors, uniques)]
+    timer = timer or (deadline.timer if deadline is not None
+                      else PhaseTimer())
+
+    det_fields = [field_prepend(fld, det)
+                  for fld, det in zip(detector_fields, detectors)]
+    mot_fields = [field_prepend(fld, mot)
+                  for fld, mot in zip(motor_fields, motors)]
+
+    # Debug counters
+    joint_steps = 0
+    yag_cycles = 0
+    recoveries = 0
+    start_time = time.time()
+
+    # Pick up from an interrupted walk
+    if walk_checkpoint is not None:
+        identity = WalkCheckpoint.identity(detectors, motors, goals,
+                                           joint=True)
+        state = walk_checkpoint.load(identity) if resume else None
+    else:
+        state = None
+
+    # Assemble the initial estimate
+    if state is not None:
+        logger.info("Resuming joint walk from step %s", state['joint_steps'])
+        jacobian = np.array([[np.nan if value is None else value
+                              for value in row]
+                             for row in state['jacobian']], dtype=float)
+        joint_steps = state['joint_steps']
+        yag_cycles = state['yag_cycles']
+        recoveries = state['recoveries']
+    elif jacobian is not None:
+        jacobian = np.array(jacobian, dtype=float)
+        if jacobian.shape != (num, num_mot):
+            raise ValueError("Jacobian must have a row for each detector and "
+                             "a column for each motor")
+    else:
+        jacobian = np.full((num, num_mot), np.nan)
+    for index in range(min(num, num_mot)):
+        if gradients[index] is not None and np.isnan(jacobian[index, index]):
+            jacobian[index, index] = gradients[index]
+    # Downstream motors do not move the beam on upstream detectors
+    for i, j in zip(*np.where(np.isnan(jacobian))):
+        if j > i:
+            jacobian[i, j] = 0.
+    if model_store is not None:
+        for i, j in zip(*np.where(np.isnan(jacobian))):
+            record = model_store.lookup(motors[j].name, detectors[i].name,
+                                        mot_fields[j], det_fields[i],
+                                        energy=energy)
+            if record is not None:
+                jacobian[i, j] = record.slope
+    estimate = BroydenJacobian(jacobian)
+
+    def save_state():
+        if walk_checkpoint is None:
+            return
+        walk_checkpoint.save(identity,
+                             {'jacobian' : [[value if np.isfinite(value)
+                                             else None for value in row]
+                                            for row in
+                                            estimate.jacobian.tolist()],
+                              'joint_steps' : joint_steps,
+                              'yag_cycles' : yag_cycles,
+                              'recoveries' : recoveries})
+
+    def move_all(positions):
+        group = str(uuid.uuid4())
+        with timer.phase('motion'):
+            for mot, pos in zip(motors, positions):
+                yield from abs_set(mot, pos, group=group)
+            yield from plan_wait(group=group)
+
+    def measure(index):
+        if min_averages[index]:
+            stop = PrecisionStop(det_fields[index],
+                                 min_num=min_averages[index],
+                                 goal=goals[index],
+                                 tolerance=tolerances[index])
+        else:
+            stop = None
+        average = averages[index]
+        if deadline is not None:
+            average = deadline.average(average)
+        keys = [det_fields[index]] + mot_fields
+        with timer.phase(DeadlinePlanner.measure):
+            stats = yield from measure_stats([detectors[index]] + motors
+                                             + [obj for obj in system
+                                                if obj is not detectors[index]
+                                                and obj not in motors],
+                                             num=average,
+                                             filters=filters[index],
+                                             stop=stop,
+                                             monitor=keys if monitors[index]
+                                                     else None,
+                                             emit=emit, beam=beams[index],
+                                             fields=keys if selective_read
+                                                    else None,
+                                             timer=timer,
+                                             delay=timings[index][0],
+                                             unique=uniques[index],
+                                             cadence=timings[index][1])
+        return stats[det_fields[index]].mean
+
+    def measure_all():
+        nonlocal yag_cycles, recoveries
+        readings = list()
+        while len(readings) < num:
+            index = len(readings)
+            # Before each insertion, check the global timeout.
+            if timeout is not None and time.time() - start_time > timeout:
+                raise RuntimeError("Jointwalk has timed out after {} s"
+                                   "".format(time.time() - start_time))
+            if deadline is not None:
+                deadline.update(visits=num - index, walks=0)
+            logger.debug("putting imager in")
+            with timer.phase(DeadlinePlanner.imager):
+                ok = (yield from prep_img_motors(index, detectors,
+                                                 timeout=15))
+            yag_cycles += 1
+            # Be loud if the yags fail to move! Operator should know!
+            if not ok:
+                err = "Detector motion timed out!"
+                logger.error(err)
+                raise RuntimeError(err)
+            yield from checkpoint()
+            try:
+                reading = yield from measure(index)
+            except FilterCountError:
+                if recovery_plan is None:
+                    logger.error("No recovery plan, not attempting to "
+                                 "recover")
+                    raise
+                with timer.phase('recovery'):
+                    ok = yield from recovery_plan(detectors=detectors,
+                                                  motors=motors, goals=goals,
+                                                  starts=starts,
+                                                  first_steps=first_steps,
+                                                  gradients=gradients,
+                                                  detector_fields=detector_fields,
+                                                  motor_fields=motor_fields,
+                                                  tolerances=tolerances,
+                                                  system=system,
+                                                  averages=averages,
+                                                  overshoot=0,
+                                                  max_walks=max_walks,
+                                                  timeout=timeout,
+                                                  filters=filters,
+                                                  index=index)
+                recoveries += 1
+                if not ok:
+                    raise
+                # The recovery moved the motors, measure every detector again
+                logger.info("Recovered beam on %s, measuring again",
+                            detectors[index].name)
+                readings = list()
+                continue
+            logger.debug("recieved %s from %s", reading, detectors[index].name)
+            readings.append(reading)
+        return np.array(readings)
+
+    # Travel to starting positions
+    if state is None and any(start is not None for start in starts):
+        yield from move_all([mot.position if start is None else start
+                             for mot, start in zip(motors, starts)])
+
+    readings = yield from measure_all()
+    positions = np.array([mot.position for mot in motors], dtype=float)
+    converged = False
+    while True:
+        save_state()
+        error = np.array(goals, dtype=float) - readings
+        logger.debug("Joint step #%s has errors %s", joint_steps, error)
+        if np.all(np.abs(error) < tolerances):
+            logger.debug("beam aligned on all yags")
+            converged = True
+            break
+        if max_walks is not None and joint_steps >= max_walks:
+            logger.info("Jointwalk has reached the max_walks limit")
+            break
+        if deadline is not None and deadline.expired:
+            logger.warning("Deadline reached, finishing with the current "
+                           "alignment")
+            break
+
+        # Probe the unknown sensitivities with a first step, otherwise move
+        # every motor to the joint setpoint
+        missing = estimate.missing
+        if missing:
+            unknown = set(j for i, j in missing)
+            step = np.array([first_steps[j] if j in unknown else 0.
+                             for j in range(num_mot)])
+            logger.info("Seeding response of %s with a first step of %s",
+                        [mot.name for mot in motors], step.tolist())
+        else:
+            step = estimate.step(error, damping=damping)
+        if not np.all(np.isfinite(step)):
+            raise RuntimeError("Invalid joint step {}".format(step))
+        logger.info("Moving %s by %s", [mot.name for mot in motors],
+                    step.tolist())
+        yield from move_all(positions + step)
+        joint_steps += 1
+
+        # Verify and learn from the response
+        new_readings = yield from measure_all()
+        new_positions = np.array([mot.position for mot in motors],
+                                 dtype=float)
+        if missing:
+            estimate.seed(new_positions - positions, new_readings - readings)
+        else:
+            estimate.update(new_positions - positions,
+                            new_readings - readings)
+        positions, readings = new_positions, new_readings
+
+    logger.info('Finished in %.2fs after %s joint steps, %s yag cycles, and '
+                '%s recoveries.\n'
+                'Aligned to %s\n'
+                'Goals were %s\n'
+                'Mirror positions are %s',
+                time.time() - start_time, joint_steps, yag_cycles, recoveries,
+                readings.tolist(), goals, positions.tolist())
+
+    # Nothing left to resume
+    if walk_checkpoint is not None and converged:
+        walk_checkpoint.clear()
+
+    # Remember the learned sensitivities for the next alignment, each as the
+    # line through the final reading with the other motors held in place
+    if model_store is not None:
+        for i, j in zip(*np.where(np.isfinite(estimate.jacobian))):
+            slope = estimate.jacobian[i, j]
+            model_store.record(motors[j].name, detectors[i].name,
+                               mot_fields[j], det_fields[i], slope=slope,
+                               intercept=readings[i] - slope * positions[j],
+                               energy=energy, save=False)
+        model_store.save()
+    return estimate.jacobian
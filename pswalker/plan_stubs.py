@@ -7,7 +7,7 @@ import logging
 
 from bluesky.plan_stubs import wait as plan_wait, abs_set, create, read, save
 from bluesky.preprocessors import stage_wrapper
-from bluesky.utils import FailedStatus
+from bluesky.utils import FailedStatus, Msg
 
 from .plans import measure_average
 from .utils.argutils import as_list, field_prepend
@@ -19,7 +19,7 @@ logger = logging.getLogger(__name__)
 
 
 def prep_img_motors(n_mot, img_motors, prev_out=True, tail_in=True,
-                    timeout=None):
+                    timeout=None, extra_moves=None):
     """
     Plan to prepare image motors for taking data. Moves the correct imagers in
     and waits for them to be ready.
@@ -47,6 +47,11 @@ def prep_img_motors(n_mot, img_motors, prev_out=True, tail_in=True,
     timeout: number, optional
         Only wait for this many seconds before moving on.
 
+    extra_moves: list of tuples, optional
+        Pairs of movable objects and positions to set alongside the imagers.
+        The moves are waited on in the same group, so they overlap with the
+        imager motion instead of following it.
+
     Returns
     -------
     ok: bool
@@ -73,6 +78,10 @@ def prep_img_motors(n_mot, img_motors, prev_out=True, tail_in=True,
                                        timeout=timeout)
             elif tail_in:
                 yield from abs_set(mot, "IN")
+        for mover, position in (extra_moves or list()):
+            logger.debug("Moving %s to %s with the imagers",
+                         mover.name, position)
+            yield from abs_set(mover, position, group=prev_img_mot)
         yield from plan_wait(group=prev_img_mot)
     except FailedStatus:
         ok = False
@@ -505,3 +514,207 @@ def homs_fiducialize(slit_set, yag_set, x_width=.01, y_width=.01, samples=10,
         results.append(fiducial)
     return results
 
+
+
+class _Branch:
+    """
+    State of a single plan interleaved by :func:`.merge_plans`
+    """
+    #Messages that return a Status added to a group
+    grouped = ('set', 'trigger', 'kickoff', 'complete')
+
+    def __init__(self, plan, label, rename_streams=True):
+        self.plan     = plan
+        self.label    = label
+        self.rename   = rename_streams
+        self.result   = None
+        self.done     = False
+        self.bundling = False
+        self.asleep   = None
+        self.waiting  = None
+        self.statuses = dict()
+
+
+    def group(self, group):
+        """
+        Name of a status group unique to the branch
+        """
+        return '{}:{}'.format(self.label, group)
+
+
+    def rewrite(self, msg):
+        """
+        Rename the status group or event stream of a message
+
+        Messages without a group are passed unchanged, as the RunEngine
+        already keeps their statuses apart from every named group
+        """
+        if msg.command in self.grouped or (msg.command == 'wait'
+                                           and not msg.args):
+            if msg.kwargs.get('group') is None:
+                return msg
+            kwargs = dict(msg.kwargs)
+            kwargs['group'] = self.group(kwargs['group'])
+            return msg._replace(kwargs=kwargs)
+        elif msg.command == 'wait':
+            if msg.args[0] is None:
+                return msg
+            return msg._replace(args=(self.group(msg.args[0]),)
+                                     + tuple(msg.args[1:]))
+        elif msg.command == 'create' and self.rename:
+            kwargs = dict(msg.kwargs)
+            kwargs['name'] = '{}_{}'.format(kwargs.get('name') or 'primary',
+                                            self.label)
+            return msg._replace(kwargs=kwargs)
+        return msg
+
+
+    def step(self, value=None, exc=None):
+        """
+        Advance the plan, returning the next message or None when finished
+        """
+        try:
+            if exc is not None:
+                msg = self.plan.throw(exc)
+            else:
+                msg = self.plan.send(value)
+        except StopIteration as stop:
+            self.done   = True
+            self.result = stop.value
+            return None
+        return self.rewrite(msg)
+
+
+    def ready(self, now):
+        """
+        Whether the branch can make progress
+        """
+        if self.asleep is not None:
+            if now < self.asleep:
+                return False
+            self.asleep = None
+        if self.waiting is not None:
+            msg, start = self.waiting
+            group   = msg.args[0] if msg.args else msg.kwargs.get('group')
+            timeout = msg.kwargs.get('timeout')
+            pending = [status for status in self.statuses.get(group, list())
+                       if not getattr(status, 'done', True)]
+            if pending and (timeout is None or now - start < timeout):
+                return False
+        return True
+
+
+def merge_plans(*plans, labels=None, poll=0.01, rename_streams=True):
+    """
+    Interleave independent plans so that their motion overlaps
+
+    Each plan is run until it waits on a group of statuses or sleeps, at which
+    point the next plan is advanced. Status groups are made unique to each
+    plan so a ``wait`` only blocks on the devices of the plan that sent it,
+    and is only passed to the RunEngine once those devices are done. When no
+    plan can make progress the merged plan sleeps for ``poll`` seconds. The
+    plans must not share devices, as a device moved by one plan may be
+    stopped or read by another.
+
+    Event bundles are kept whole, once a plan creates a bundle no other plan
+    is advanced until it is saved or dropped.
+
+    Parameters
+    ----------
+    plans : iterable
+        Plans to merge
+
+    labels : list of str, optional
+        Name of each plan, used to tag the status groups and event streams.
+        By default ``branch0``, ``branch1`` ...
+
+    poll : float, optional
+        Time to sleep when every plan is waiting
+
+    rename_streams : bool, optional
+        Suffix the name of the event streams created by each plan with its
+        label. The RunEngine only allows a stream to read the same devices
+        each time, which independent plans do not
+
+    Returns
+    -------
+    results : list
+        Return value of each plan
+    """
+    labels = labels or ['branch{}'.format(i) for i in range(len(plans))]
+    if len(labels) != len(plans):
+        raise ValueError("Received {} labels for {} plans"
+                         "".format(len(labels), len(plans)))
+    branches = [_Branch(iter(plan), label, rename_streams=rename_streams)
+                for plan, label in zip(plans, labels)]
+    active = list(branches)
+
+    def advance(branch, msg):
+        """
+        Pass messages of a branch to the RunEngine until it blocks
+        """
+        while msg is not None:
+            if msg.command == 'sleep':
+                duration = msg.args[0] if msg.args else msg.kwargs['time']
+                branch.asleep = time.time() + duration
+                return
+            elif msg.command == 'wait':
+                if not branch.waiting:
+                    branch.waiting = (msg, time.time())
+                if not branch.ready(time.time()):
+                    return
+                #Only leave the RunEngine what is left of the timeout
+                msg, start = branch.waiting
+                if msg.kwargs.get('timeout') is not None:
+                    kwargs = dict(msg.kwargs)
+                    kwargs['timeout'] = max(kwargs['timeout']
+                                            - (time.time() - start), 0)
+                    msg = msg._replace(kwargs=kwargs)
+            #Forward the message, returning the response to the branch
+            response, error = None, None
+            try:
+                response = yield msg
+            except Exception as exc:
+                error = exc
+            if msg.command == 'wait':
+                group = msg.args[0] if msg.args else msg.kwargs.get('group')
+                branch.statuses.pop(group, None)
+                branch.waiting = None
+            if error is not None:
+                msg = branch.step(exc=error)
+                continue
+            if msg.command in _Branch.grouped and response is not None:
+                branch.statuses.setdefault(msg.kwargs.get('group'),
+                                           list()).append(response)
+            elif msg.command == 'create':
+                branch.bundling = True
+            elif msg.command in ('save', 'drop'):
+                branch.bundling = False
+            msg = branch.step(response)
+
+    try:
+        while True:
+            active = [branch for branch in active if not branch.done]
+            if not active:
+                break
+            now = time.time()
+            bundling = [branch for branch in active if branch.bundling]
+            ready = [branch for branch in (bundling or active)
+                     if branch.ready(now)]
+            if not ready:
+                yield Msg('sleep', None, poll)
+                continue
+            for branch in ready:
+                #Another branch may have started a bundle
+                if any(other.bundling for other in active
+                       if other is not branch):
+                    continue
+                if branch.waiting:
+                    yield from advance(branch, branch.waiting[0])
+                else:
+                    yield from advance(branch, branch.step())
+    finally:
+        for branch in active:
+            if not branch.done:
+                branch.plan.close()
+    return [branch.result for branch in branches]
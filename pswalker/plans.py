@@ -5,9 +5,11 @@ Bluesky Plans for the Walker
 # Standard #
 ############
 import time
+import uuid
+import numbers
 import itertools
 import logging
-from collections import Iterable
+from collections import Iterable, deque
 from copy import copy
 ###############
 # Third Party #
@@ -17,6 +19,7 @@ import pandas as pd
 import bluesky
 from scipy.stats   import linregress
 from ophyd import Device, Signal
+from ophyd.signal import EpicsSignalRO
 from bluesky.utils import Msg
 from bluesky.plan_stubs import mv, rel_set, trigger_and_read
 from bluesky.preprocessors import run_decorator, stage_decorator
@@ -24,14 +27,22 @@ from bluesky.preprocessors import run_decorator, stage_decorator
 ##########
 # Module #
 ##########
-from .callbacks import LinearFit, apply_filters, rank_models
+from .buffers import (ShotBuffer, RingBuffer, ShotStats, PrecisionStop,
+                      BufferReading, SHOT_STREAM)
+from .callbacks import (LinearFit, IncrementalLinearFit, FilterSet,
+                        ModelRanker)
+from .strategies import ModelStep
+from .timing import PhaseTimer
 from .utils import field_prepend
-from .utils.exceptions import FilterCountError
+from .utils.argutils import find_signal
+from .suspenders import BEAM_RATE_PV
+from .sim.sim import SimDevice
+from .utils.exceptions import FilterCountError, BeamLostError
 
 logger = logging.getLogger(__name__)
 
 def measure_average(detectors, num=1, filters=None,
-                    delay=None, drop_missing=True):
+                    delay=None, drop_missing=True, stop=None, **kwargs):
     """
     Gather a series of measurements from a list of detectors and return the
     average over the number of shots.
@@ -46,6 +57,14 @@ def measure_average(detectors, num=1, filters=None,
     delay : iterable or scalar, optional
         Time delay between successive readings
 
+    stop : :class:`.PrecisionStop`, optional
+        End the measurement early once the shots are precise enough. In this
+        case `num` is the maximum number of shots
+
+    kwargs :
+        Additional acquisition options passed to :func:`.measure`, e.g
+        ``pipeline``
+
     Returns
     -------
     average : dict
@@ -55,27 +74,276 @@ def measure_average(detectors, num=1, filters=None,
 
     See Also
     --------
-    :func:`.measure`
+    :func:`.measure`, :func:`.measure_stats`
     """
-    #Gather data
-    data = yield from measure(detectors, num=num, delay=delay,
-                              filters=filters, drop_missing=drop_missing)
+    #Gather statistics
+    stats = yield from measure_stats(detectors, num=num, delay=delay,
+                                     filters=filters,
+                                     drop_missing=drop_missing, stop=stop,
+                                     **kwargs)
 
-    #Gather keys
-    avg = dict.fromkeys(set([key for d in data for key in d.keys()]))
-    for key in avg.keys():
-        try:
-            avg[key] = np.mean([d[key] for d in data])
-        except TypeError:
-            avg[key] = data[-1][key]
+    #Reduce to averages
+    avg = dict((key, value.mean if isinstance(value, ShotStats) else value)
+               for key, value in stats.items())
 
     logger.debug("Found the following averages: %s", avg)
     return avg
 
 
+def measure_stats(detectors, num=1, filters=None,
+                  delay=None, drop_missing=True, stop=None, monitor=None,
+                  emit='shots', fields=None, timer=None, **kwargs):
+    """
+    Gather a series of measurements from a list of detectors and return the
+    statistics of each field over the number of shots.
+
+    Shots are accumulated in a preallocated :class:`.ShotBuffer` so that the
+    mean, median, standard deviation, extrema and standard error of every
+    numeric field are computed in a single vectorized pass.
+
+    Parameters
+    ----------
+    detectors : list
+        List of detectors to measure at each event
+
+    num : int, optional
+        Number of samples to gather
+
+    filters : dict, optional
+        Key, callable pairs of event keys and single input functions that
+        evaluate to True or False. For more infromation see
+        :meth:`.apply_filters`
+
+    delay : iterable or scalar, optional
+        Time delay between successive readings
+
+    drop_missing : bool, optional
+        Choice to include events where event keys are missing
+
+    stop : :class:`.PrecisionStop`, optional
+        End the measurement early once the shots are precise enough. In this
+        case `num` is the maximum number of shots
+
+    monitor : list, optional
+        Instead of triggering and reading the detectors, collect the updates
+        pushed by the signals reporting these fields. The first field paces
+        the shots. Signals for each filter key are monitored as well. See
+        :func:`.measure_monitor`
+
+    emit : {'shots', 'summary', 'page'}, optional
+        Documents emitted by :func:`.measure`. Monitored measurements emit no
+        documents, so this is ignored if ``monitor`` is given
+
+    fields : list, optional
+        Only read the signals reporting these fields, see :func:`.measure`.
+        Monitoring is already selective, so this is ignored if ``monitor`` is
+        given
+
+    timer : :class:`.PhaseTimer`, optional
+        Record the time spent on rejected shots, see :func:`.measure`. Not
+        used if ``monitor`` is given
+
+    kwargs :
+        Additional acquisition options passed to :func:`.measure`, e.g
+        ``pipeline``, or :func:`.measure_monitor` if ``monitor`` is given.
+        Monitored updates are never repeated frames, so ``unique`` is
+        ignored in that case
+
+    Returns
+    -------
+    stats : dict
+        Numeric fields map to a :class:`.ShotStats` of all the passing shots.
+        Fields that are strings, or can not be averaged, map to the value from
+        the last shot
+
+    See Also
+    --------
+    :func:`.measure`
+    """
+    #Collect pushed updates
+    if monitor:
+        keys = (filters.filters if isinstance(filters, FilterSet)
+                else filters or dict())
+        fields  = list(monitor) + [key for key in keys if key not in monitor]
+        #Monitor the keys that show the presence of beam
+        beam    = kwargs.get('beam')
+        if beam is not None:
+            fields += [key for key in (beam.centroid, beam.intensity)
+                       if key is not None and key not in fields]
+        signals = monitor_signals(detectors, fields)
+        #Pushed updates are new by definition
+        kwargs.pop('unique', None)
+        kwargs.pop('cadence', None)
+        return (yield from measure_monitor(signals, num=num, filters=filters,
+                                           drop_missing=drop_missing,
+                                           stop=stop, **kwargs))
+    #Gather data
+    buf = yield from measure(detectors, num=num, delay=delay,
+                             filters=filters, drop_missing=drop_missing,
+                             buffer=ShotBuffer(capacity=num), stop=stop,
+                             emit=emit, fields=fields, timer=timer, **kwargs)
+    return buf.stats()
+
+
+def monitor_signals(detectors, fields):
+    """
+    Find the signals that report a list of fields
+
+    Parameters
+    ----------
+    detectors : list
+        Devices to search for each field
+
+    fields : list
+        Event keys, e.g ``yag_detector_stats2_centroid_x``
+
+    Returns
+    -------
+    signals : list
+        One signal per unique field, in the order given
+
+    Raises
+    ------
+    ValueError:
+        If no signal in the detectors reports one of the fields
+    """
+    signals = list()
+    for field in fields:
+        if field in [sig.name for sig in signals]:
+            continue
+        for det in detectors:
+            signal = find_signal(det, field)
+            if signal is not None:
+                signals.append(signal)
+                break
+        else:
+            raise ValueError("Unable to find a signal for {} in {}"
+                             "".format(field, [det.name for det in detectors]))
+    return signals
+
+
+def measure_monitor(signals, num=1, filters=None, drop_missing=True,
+                    stop=None, max_dropped=50, timeout=5., poll=0.01,
+                    beam=None):
+    """
+    Gather a number of updates pushed by a group of signals
+
+    Rather than triggering and reading each shot through the RunEngine, the
+    signals are subscribed to and their updates collected into a
+    :class:`.RingBuffer`. Every update of the first signal is a shot, with the
+    other signals contributing the most recent value they have reported. No
+    documents are emitted for the individual shots.
+
+    Parameters
+    ----------
+    signals : list
+        Signals to monitor, the first one paces the shots. For instance, the
+        ``stats2.centroid`` signal of a detector followed by the readback of a
+        motor
+
+    num : int, optional
+        Number of shots that pass filters
+
+    filters : dict or :class:`.FilterSet`, optional
+        Key, callable pairs of event keys and single input functions that
+        evaluate to True or False. For more infromation see
+        :meth:`.apply_filters`
+
+    drop_missing : bool, optional
+        Choice to include events where event keys are missing
+
+    stop : :class:`.PrecisionStop`, optional
+        End the measurement early once the shots are precise enough
+
+    max_dropped : int, optional
+        Maximum number of shots to drop before raising a FilterCountError
+
+    timeout : float, optional
+        Maximum time to wait for an update of the first signal before raising
+        a FilterCountError
+
+    poll : float, optional
+        Time to sleep between checks of the buffer
+
+    beam : :class:`.BeamPresence`, optional
+        Check every update for the presence of beam, raising a
+        :class:`.BeamLostError` as soon as it is considered lost
+
+    Returns
+    -------
+    stats : dict
+        Same format as :func:`.measure_stats`
+    """
+    logger.debug("Running measure_monitor on %s", [sig.name for sig in signals])
+    if not isinstance(filters, FilterSet):
+        filters = FilterSet(filters, drop_missing=drop_missing)
+    filters.reset()
+    if stop is not None:
+        stop.clear()
+    if beam is not None:
+        beam.reset()
+
+    buf     = RingBuffer(num)
+    latest  = dict((sig.name, sig.get()) for sig in signals[1:])
+    state   = {'dropped' : 0, 'settled' : False, 'lost' : None,
+               'last_update' : time.time()}
+    pacer   = signals[0]
+
+    #Each update of the pacing signal is a shot
+    def pace(*args, value, timestamp=None, **kwargs):
+        shot = dict(latest)
+        shot[pacer.name] = value
+        with buf.lock:
+            state['last_update'] = time.time()
+            passed = filters(shot)
+            if passed:
+                buf.append(shot, timestamp=timestamp)
+                if stop is not None and stop.update(shot):
+                    state['settled'] = True
+            else:
+                state['dropped'] += 1
+            if beam is not None and not state['lost']:
+                state['lost'] = beam.update(shot, passed,
+                                            remaining=num - buf.total,
+                                            budget=(max_dropped
+                                                    - state['dropped']))
+
+    #Other signals are held at their most recent value
+    def hold(name):
+        def update(*args, value, **kwargs):
+            latest[name] = value
+        return update
+
+    subs = [(pacer, pace)] + [(sig, hold(sig.name)) for sig in signals[1:]]
+    try:
+        for sig, cb in subs:
+            sig.subscribe(cb, run=False)
+        while buf.total < num and not state['settled']:
+            if state['lost']:
+                logger.info("Beam lost on %s: %s", pacer.name, state['lost'])
+                raise BeamLostError(state['lost'])
+            if state['dropped'] > max_dropped:
+                raise FilterCountError("Dropped {} updates, rejections by "
+                                       "filter were {}"
+                                       "".format(state['dropped'],
+                                                 filters.rejections))
+            if time.time() - state['last_update'] > timeout:
+                raise FilterCountError("No update from {} in {} seconds"
+                                       "".format(pacer.name, timeout))
+            yield Msg('sleep', None, poll)
+    finally:
+        for sig, cb in subs:
+            sig.clear_sub(cb)
+
+    logger.debug("Finished monitoring {} updates, filters removed {} "
+                 "updates {}".format(len(buf), state['dropped'],
+                                     filters.rejections))
+    return buf.stats()
+
+
 def measure_centroid(det, target_field='centroid_x',
                      average=1, delay=None, filters=None,
-                     drop_missing=True):
+                     drop_missing=True, monitor=False):
     """
     Measure the centroid of the beam over one or more images
 
@@ -92,14 +360,21 @@ def measure_centroid(det, target_field='centroid_x',
 
     delay : float, optional
         Time to wait inbetween images
+
+    monitor : bool, optional
+        Collect the updates pushed by the centroid signal instead of triggering
+        and reading each image. ``delay`` is ignored. See
+        :func:`.measure_monitor`
     """
     logger.debug("Running measure_centroid.") 
+    target_field = field_prepend(target_field, det)
     #Use default filters
-    filters = filters or {field_prepend(target_field, det) : lambda x : x > 0}
+    filters = filters or {target_field : lambda x : x > 0}
     #Take average measurement
     avgs = yield from measure_average([det], num=average, delay=delay,
-                                       filters=filters, drop_missing=drop_missing)
-    return avgs[field_prepend(target_field, det)]
+                                       filters=filters, drop_missing=drop_missing,
+                                       monitor=[target_field] if monitor else None)
+    return avgs[target_field]
 
 
 def walk_to_pixel(detector, motor, target, filters=None,
@@ -107,7 +382,10 @@ def walk_to_pixel(detector, motor, target, filters=None,
                   target_fields=['centroid_x', 'alpha'],
                   first_step=1., tolerance=20, system=None,
                   average=1, delay=None, max_steps=None,
-                  drop_missing=True):
+                  drop_missing=True, min_average=None, monitor=False,
+                  emit='shots', beam=None, selective_read=False,
+                  incremental_fit=False, strategy=None, schedule=None,
+                  timer=None, unique=None, cadence=None):
     """
     Step a motor until a specific threshold is reached on the detector
 
@@ -170,8 +448,58 @@ def walk_to_pixel(detector, motor, target, filters=None,
     average : int, optional
         Number of images to average together for each step along the scan
 
+    delay : float or 'auto', optional
+        Minimum time between consecutive images, see :func:`.measure`
+
     max_steps : int, optional
         Limit the number of steps the walk will take before exiting
+
+    min_average : int, optional
+        If provided, each measurement stops as soon as it is statistically
+        settled whether the centroid is within ``tolerance`` of the target,
+        taking between ``min_average`` and ``average`` images. See
+        :class:`.PrecisionStop`
+
+    monitor : bool, optional
+        Collect the updates pushed by the centroid and motor readback signals
+        instead of triggering and reading each image. See
+        :func:`.measure_monitor`
+
+    emit : {'shots', 'summary', 'page'}, optional
+        Documents emitted for each measurement, see :func:`.measure`
+
+    beam : :class:`.BeamPresence`, optional
+        Raise a :class:`.BeamLostError` as soon as the beam leaves the
+        detector during a measurement
+
+    selective_read : bool, optional
+        Only read the centroid, motor readback and filter keys of each shot
+        instead of every component of the detector, motor and ``system``
+
+    incremental_fit : bool, optional
+        Update the linear fit in constant time from running sums rather than
+        refitting all of the data with lmfit each step. See
+        :class:`.IncrementalLinearFit`
+
+    strategy : :class:`.StepStrategy`, optional
+        Method of choosing each step of the walk, see :func:`.fitwalk`
+
+    schedule : :class:`.AveragingSchedule`, optional
+        Choose the number of readings at each step from the distance to the
+        target and the measured noise, see :func:`.fitwalk`
+
+    timer : :class:`.PhaseTimer`, optional
+        Record the time spent measuring, moving the motor, fitting and
+        rejecting shots, see :func:`.fitwalk`
+
+    unique : str, optional
+        Key that identifies each frame of the detector, e.g the areaDetector
+        array counter. Repeated frames are skipped rather than averaged, see
+        :func:`.measure`
+
+    cadence : float, optional
+        Time to wait for a new frame after a repeated one. Resolved once for
+        the walk by default, see :func:`.read_timing`
     """
     #Prepend field names
     target_fields = [field_prepend(fld, obj)
@@ -179,13 +507,26 @@ def walk_to_pixel(detector, motor, target, filters=None,
 
     system  = system or list()
     average = average or 1
+    timer   = timer or PhaseTimer()
+    #Resolve the read timing once for every measurement of the walk
+    if cadence is None:
+        delay, cadence = read_timing([detector] + system, delay=delay,
+                                     unique=unique)
     #Travel to starting position
     if start:
-        yield from mv(motor, start)
+        with timer.phase('motion'):
+            yield from mv(motor, start)
 
     else:
         start = motor.position
 
+    #Create early stopping condition
+    if min_average:
+        stop = PrecisionStop(target_fields[0], min_num=min_average,
+                             goal=target, tolerance=tolerance)
+    else:
+        stop = None
+
     #Create initial step plan
     if gradient:
         #Seed the fit with our estimate
@@ -195,12 +536,27 @@ def walk_to_pixel(detector, motor, target, filters=None,
             logger.debug("Using gradient of {} for naive step..."
                         "".format(gradient))
             #Take a quick measurement 
-            avgs = yield from measure_average([detector, motor] + system,
-                                               filters=filters,
-                                               num=average, delay=delay,
-                                               drop_missing=drop_missing)
+            with timer.phase('measure'):
+                stats = yield from measure_stats([detector, motor] + system,
+                                                 filters=filters,
+                                                 num=average, delay=delay,
+                                                 drop_missing=drop_missing,
+                                                 stop=stop, emit=emit,
+                                                 beam=beam,
+                                                 fields=(target_fields
+                                                         if selective_read
+                                                         else None),
+                                                 monitor=(target_fields
+                                                          if monitor
+                                                          else None),
+                                                 timer=timer, unique=unique,
+                                                 cadence=cadence)
             #Extract centroid and position
-            center, pos = avgs[target_fields[0]], avgs[target_fields[1]]
+            center, pos = (stats[target_fields[0]].mean,
+                           stats[target_fields[1]].mean)
+            logger.debug("Measured {} at {} +/- {}"
+                         "".format(target_fields[0], center,
+                                   stats[target_fields[0]].sem))
             #Calculate corresponding intercept
             intercept = center - gradient*pos
             #Calculate best step on first guess of line
@@ -208,24 +564,33 @@ def walk_to_pixel(detector, motor, target, filters=None,
             logger.debug("Predicting position using line y = {}*x + {}"
                          "".format(gradient, intercept))
             #Move to position
-            yield from mv(motor, next_pos)
+            with timer.phase('motion'):
+                yield from mv(motor, next_pos)
 
         naive_step = gradient_step
     else:
         init_guess = dict()
         def naive_step():
-            return (yield from rel_set(motor, first_step, wait=True))
+            with timer.phase('motion'):
+                return (yield from rel_set(motor, first_step, wait=True))
 
     #Create fitting callback
-    fit = LinearFit(target_fields[0], target_fields[1],
-                    init_guess=init_guess, average=average,
-                    name='Linear')
+    fit_cls = IncrementalLinearFit if incremental_fit else LinearFit
+    fit = fit_cls(target_fields[0], target_fields[1],
+                  init_guess=init_guess, average=average,
+                  name='Linear')
 
     #Fitwalk
     last_shot, accurate_model = yield from fitwalk([detector]+system, motor, [fit]+models, target,
                                         naive_step=naive_step, average=average,
                                         filters=filters, tolerance=tolerance, delay=delay,
-                                        drop_missing=drop_missing, max_steps=max_steps)
+                                        drop_missing=drop_missing, max_steps=max_steps,
+                                        min_average=min_average, monitor=monitor,
+                                        emit=emit, beam=beam,
+                                        selective_read=selective_read,
+                                        strategy=strategy,
+                                        schedule=schedule, timer=timer,
+                                        unique=unique, cadence=cadence)
     
     #Report if we did not need a model
     if not accurate_model:
@@ -234,8 +599,114 @@ def walk_to_pixel(detector, motor, target, filters=None,
     return last_shot, accurate_model
 
 
+def is_simulated(device):
+    """
+    Whether a device is simulated rather than connected to EPICS
+    """
+    return (isinstance(device, SimDevice)
+            or type(device).__module__.startswith('ophyd.sim'))
+
+
+#Beam rate signal shared by every call of read_cadence
+_beam_rate = None
+
+
+def read_cadence(detectors, beam_rate=True):
+    """
+    Determine the time between new frames from a group of detectors
+
+    The ``cam.array_rate`` of each areaDetector is checked, looking within the
+    ``detector`` component of each device. If no camera reports a rate, the
+    LCLS beam rate is used instead, unless every detector is simulated.
+
+    Each call reads the devices, so walks resolve the cadence once with
+    :func:`.read_timing` rather than for every measurement.
+
+    Parameters
+    ----------
+    detectors : list
+        Devices to inspect
+
+    beam_rate : bool, optional
+        Fall back to the beam rate PV used by :class:`.BeamRateSuspendFloor`
+
+    Returns
+    -------
+    period : float or None
+        Seconds between frames of the slowest source, None if no rate could
+        be determined
+    """
+    global _beam_rate
+    rates = list()
+    for det in detectors:
+        cam = getattr(getattr(det, 'detector', det), 'cam', None)
+        try:
+            rate = cam.array_rate.get()
+        except AttributeError:
+            continue
+        if rate and rate > 0:
+            rates.append(rate)
+    #Fall back to the beam rate, simulated detectors do not follow it
+    if (not rates and beam_rate
+            and not all(is_simulated(det) for det in detectors)):
+        try:
+            if _beam_rate is None:
+                _beam_rate = EpicsSignalRO(BEAM_RATE_PV)
+            rate = _beam_rate.get(timeout=1.0)
+        except Exception as e:
+            logger.debug("Unable to read beam rate: %s", e)
+        else:
+            if rate and rate > 0:
+                logger.info("No camera rate found, using the beam rate of "
+                            "%s Hz", rate)
+                rates.append(rate)
+    if not rates:
+        return None
+    return 1./min(rates)
+
+
+def read_timing(detectors, delay=None, unique=None):
+    """
+    Resolve the timing of the reads of a group of detectors
+
+    Parameters
+    ----------
+    detectors : list
+        Devices to inspect
+
+    delay : float or 'auto', optional
+        Minimum time between consecutive reads. 'auto' is replaced by the
+        :func:`.read_cadence` of the detectors
+
+    unique : str, optional
+        Key that identifies a frame, see :func:`.measure`
+
+    Returns
+    -------
+    delay : float or None
+        Resolved minimum time between reads
+
+    cadence : float or None
+        Time to wait for a new frame after a repeated one, zero if it can not
+        be determined. None if ``unique`` is not given
+    """
+    if isinstance(delay, str) and delay == 'auto':
+        delay = read_cadence(detectors)
+        logger.debug("Using automatic read cadence of %s", delay)
+    cadence = None
+    if unique is not None:
+        if isinstance(delay, numbers.Number):
+            cadence = delay
+        else:
+            cadence = read_cadence(detectors, beam_rate=False) or 0.
+        logger.debug("Waiting %s between repeated frames", cadence)
+    return delay, cadence
+
+
 def measure(detectors, num=1, delay=None, filters=None, drop_missing=True,
-            max_dropped=50):
+            max_dropped=50, buffer=None, stop=None, pipeline=False, align=None,
+            unique=None, emit='shots', beam=None, fields=None, timer=None,
+            cadence=None):
     """
     Gather a fixed number of measurements from a group of detectors
 
@@ -247,24 +718,98 @@ def measure(detectors, num=1, delay=None, filters=None, drop_missing=True,
     num : int
         Number of measurements that pass filters
 
-    delay : float
-        Minimum time between consecutive reads of the detectors.
+    delay : float or 'auto'
+        Minimum time between consecutive reads of the detectors. If 'auto',
+        the delay is derived from the camera or beam rate, see
+        :func:`.read_timing`
 
-    filters : dict, optional
+    filters : dict or :class:`.FilterSet`, optional
         Key, callable pairs of event keys and single input functions that
         evaluate to True or False. For more infromation see
-        :meth:`.apply_filters`
+        :meth:`.apply_filters`. A dictionary is compiled into a
+        :class:`.FilterSet` whose rejection counts are reported if too many
+        events are dropped
 
     drop_missing : bool, optional
-        Choice to include events where event keys are missing
+        Choice to include events where event keys are missing. Ignored if
+        ``filters`` is already a :class:`.FilterSet`
 
     max_dropped : int, optional
     	Maximum number of events to drop before raising a ValueError
 
+    buffer : :class:`.ShotBuffer`, optional
+        Accumulate the passing shots in a columnar buffer instead of a list of
+        dictionaries
+
+    stop : :class:`.PrecisionStop`, optional
+        Stopping condition updated with every passing shot. The measurement
+        ends as soon as the condition is settled, even if fewer than `num`
+        shots have been gathered. The condition is cleared before the first
+        shot
+
+    pipeline : bool, optional
+        Trigger the next shot before reading the current one. By default each
+        shot is triggered and read before the next trigger. With a pipeline,
+        the trigger of the next shot overlaps with the read and filtering of
+        the current one, so the measurement is limited by the detector rate
+        rather than the round trip of each message. Only one trigger per
+        device is ever in flight, because ophyd devices only track the status
+        of their latest trigger. Only use this with detectors that report the
+        values of the completed acquisition while the next one is in progress
+
+    align : :class:`.EventBuilder`, optional
+        Align the readings of each shot to a single pulse. Shots that can not
+        be aligned are dropped without emitting an Event and count towards
+        ``max_dropped``. Unless the builder was given ``keys``, only the keys
+        of the device that reports the reference are aligned and the readings
+        of other devices, e.g motors, pass through. The builder is reset
+        before the first shot, so its statistics cover this measurement
+
+    unique : str, optional
+        Key that identifies a frame, e.g the areaDetector array counter or the
+        centroid itself. A shot whose value and timestamp for this key match
+        the previous shot is a repeated frame and is dropped without emitting
+        an Event. After a repeated frame, the detectors are read again once
+        the ``cadence`` has elapsed. Raises a FilterCountError after ``max_dropped``
+        consecutive repeats
+
+    emit : {'shots', 'summary', 'page'}, optional
+        Documents emitted for the measurement. By default, every shot is saved
+        as an Event in the ``primary`` stream. With 'summary', the shots are
+        read but dropped, and a single Event with the average of the passing
+        shots is saved in the ``primary`` stream once the measurement is
+        complete. 'page' emits the same summary followed by one Event in the
+        :data:`.SHOT_STREAM` holding an array of every passing shot for each
+        numeric field. See :func:`.emit_summary`
+
+    beam : :class:`.BeamPresence`, optional
+        Check every shot for the presence of beam. Raises a
+        :class:`.BeamLostError` as soon as the beam is considered lost rather
+        than waiting for ``max_dropped`` shots to be filtered
+
+    fields : list, optional
+        Event keys needed from each shot. The detectors are still triggered,
+        but only the signals reporting these fields are read rather than the
+        entire device. The keys used by ``filters``, ``stop``, ``unique``,
+        ``align`` and ``beam`` are read as well. See :func:`.monitor_signals`.
+        The RunEngine only allows a stream to read the same objects, so the
+        Events are saved in a stream named after the signals read, e.g
+        ``primary_motor``, rather than the ``primary`` stream
+
+    timer : :class:`.PhaseTimer`, optional
+        Record the time taken by each shot that is filtered, repeated or can
+        not be aligned as a ``reject``
+
+    cadence : float, optional
+        Time to wait for a new frame after a repeated one. By default the
+        scalar ``delay`` or the camera rate is used, see :func:`.read_timing`.
+        Walks resolve it once and pass it to every measurement
+
     Returns
     -------
-    data : list
-        List of mock-event documents
+    data : list or :class:`.ShotBuffer`
+        List of mock-event documents, or the supplied buffer filled with the
+        passing shots
     """
     #Log setup
     logger.debug("Running measure")
@@ -273,6 +818,20 @@ def measure(detectors, num=1, delay=None, filters=None, drop_missing=True,
                  "".format([d.name for d in detectors],
                            num, delay,drop_missing))
 
+    if emit not in ('shots', 'summary', 'page'):
+        raise ValueError("Unrecognized emit mode {!r}".format(emit))
+
+    #Devices replace the status of a trigger with the next one
+    if pipeline not in (True, False):
+        raise ValueError("Pipeline must be True or False, only the next shot "
+                         "can be triggered while one is read")
+
+    #Match the cadence of the slowest source, unless already resolved
+    if cadence is None:
+        delay, cadence = read_timing(detectors, delay=delay, unique=unique)
+    elif isinstance(delay, str) and delay == 'auto':
+        delay, _ = read_timing(detectors, delay=delay)
+
     #If scalable, repeat forever
     if not isinstance(delay, Iterable):
         delay = itertools.repeat(delay)
@@ -303,34 +862,122 @@ def measure(detectors, num=1, delay=None, filters=None, drop_missing=True,
     logger.debug("Gathering shots..")
     shots   = 0
     dropped = 0
-    data    = list()
-    filters = filters or dict()
+    data    = buffer if buffer is not None else list()
+    if not isinstance(filters, FilterSet):
+        filters = FilterSet(filters, drop_missing=drop_missing)
+    filters.reset()
+    if stop is not None:
+        stop.clear()
+    if beam is not None:
+        beam.reset()
+    if align is not None:
+        align.reset()
+    #Read only the signals that report the requested fields
+    if fields is not None:
+        required = list(fields) + list(filters.filters)
+        if stop is not None:
+            required.append(stop.field)
+        if unique is not None:
+            required.append(unique)
+        if beam is not None:
+            required.extend(key for key in (beam.centroid, beam.intensity)
+                            if key is not None)
+        if align is not None:
+            required.append(align.reference)
+            required.extend(align.keys or list())
+            required.extend(align.counters.values())
+        readables = monitor_signals(detectors, required)
+        logger.debug("Reading only %s", [sig.name for sig in readables])
+        #Each set of signals is saved in a stream of its own
+        suffix = '_'.join(sig.name for sig in readables)
+    else:
+        readables = detectors
+        suffix    = None
+    stream = 'primary_' + suffix if suffix else 'primary'
+    duplicates = 0
+    repeats    = 0
+    last_frame = None
+    #Groups of shots that have been triggered but not read
+    in_flight = deque()
+
+    def trigger_shot():
+        group = str(uuid.uuid4()) if pipeline else 'B'
+        for det in detectors:
+            yield Msg('trigger', det, group=group)
+        in_flight.append(group)
+
     #Gather fixed number of shots
     while shots < num:
         #Timestamp earliest possible moment
         now = time.time()
 
-        #Trigger detector and wait for completion
-        for det in detectors:
-            yield Msg('trigger', det, group='B')
+        #Trigger detector unless already in flight
+        if not in_flight:
+            yield from trigger_shot()
 
-        #Wait for completion and start bundling
-        yield Msg('wait',   None, 'B')
-        yield Msg('create', None, name='primary')
+        #Wait for completion
+        yield Msg('wait',   None, in_flight.popleft())
 
-        #Mock-event document
-        det_reads = dict()
+        #Trigger the next shot to overlap with this read
+        if pipeline and not in_flight and shots < num - 1:
+            yield from trigger_shot()
+
+        #Start bundling
+        yield Msg('create', None, name=stream)
 
         #Gather shots
-        for det in detectors:
+        raw_reads = dict()
+        own       = None
+        for det in readables:
             cur_det = yield Msg('read', det)
-            det_reads.update(dict([(k,v['value'])
-                             for k,v in cur_det.items()]))
-        #Emit Event doc to callbacks
-        yield Msg('save')
+            raw_reads.update(cur_det)
+            #Keys that share the clock of the reference
+            if align is not None and align.reference in cur_det:
+                own = list(cur_det)
 
-        #Apply filters
-        unfiltered = apply_filters(det_reads, filters=filters, drop_missing=drop_missing)
+        #Mock-event document
+        det_reads = dict([(k,v['value']) for k,v in raw_reads.items()])
+
+        #Skip frames we have already seen
+        if unique is not None:
+            frame = raw_reads.get(unique)
+            frame = frame and (frame['value'], frame['timestamp'])
+            if frame is not None and frame == last_frame:
+                yield Msg('drop')
+                duplicates += 1
+                repeats    += 1
+                if repeats > max_dropped:
+                    raise FilterCountError("Read the same frame of {} {} "
+                                           "times in a row"
+                                           "".format(unique, repeats))
+                #Give the camera time to produce a new frame
+                if cadence:
+                    d = cadence - (time.time() - now)
+                    if d > 0:
+                        yield Msg('sleep', None, d)
+                if timer is not None:
+                    timer.record('reject', time.time() - now)
+                continue
+            last_frame = frame
+            repeats    = 0
+
+        #Align readings to a single pulse
+        aligned = True
+        if align is not None:
+            shot    = align.build(raw_reads, own=own)
+            aligned = shot is not None
+            if aligned:
+                det_reads = shot
+
+        if aligned:
+            #Emit Event doc to callbacks, or leave it for the summary
+            yield Msg('save' if emit == 'shots' else 'drop')
+            #Apply filters
+            unfiltered = filters(det_reads)
+        else:
+            #Discard shots that could not be aligned
+            yield Msg('drop')
+            unfiltered = False
         #Increment shots if filters are passed
         shots += int(unfiltered)
         #Do not delay if we have not passed filter
@@ -338,6 +985,11 @@ def measure(detectors, num=1, delay=None, filters=None, drop_missing=True,
             #Append recent read to data list
             data.append(det_reads)
 
+            #Stop early if the measurement is precise enough
+            if stop is not None and stop.update(det_reads):
+                logger.debug("Measurement settled after %s shots", shots)
+                break
+
             #Gather next delay
             try:
                 d = next(delay)
@@ -363,27 +1015,96 @@ def measure(detectors, num=1, delay=None, filters=None, drop_missing=True,
         #Report filtered event
         else:
             dropped += 1
+            if timer is not None:
+                timer.record('reject', time.time() - now)
             logger.debug('Ignoring inadequate measurement, '\
                          'attempting to gather again...')
+        #Give up early if the beam is gone
+        if beam is not None and aligned:
+            lost = beam.update(det_reads, unfiltered,
+                               remaining=num - shots,
+                               budget=max_dropped - dropped)
+            if lost:
+                logger.info("Beam lost after %s shots: %s", beam.shots, lost)
+                raise BeamLostError(lost)
         if dropped > max_dropped:
             dropped_dict = {}
-            for key in filters.keys():
-                dropped_dict[key] = det_reads[key]
+            for key in filters.filters.keys():
+                dropped_dict[key] = det_reads.get(key)
             logger.debug(('Dropped too many events, raising exception. Latest '
                           'bad values were %s'), dropped_dict)
-            raise FilterCountError
+            raise FilterCountError("Dropped {} events, rejections by filter "
+                                   "were {}".format(dropped,
+                                                    filters.rejections))
+    #Let shots triggered ahead of an early stop finish
+    while in_flight:
+        yield Msg('wait', None, in_flight.popleft())
+
     #Report finished
     logger.debug("Finished taking {} measurements, "\
-                 "filters removed {} events"\
-                 "".format(len(data), dropped))
+                 "filters removed {} events {}, skipped {} repeated frames"\
+                 "".format(len(data), dropped, filters.rejections,
+                           duplicates))
+    if align is not None:
+        logger.debug("Alignment statistics: %s", align.stats)
+
+    #Emit a single summary of the passing shots
+    if emit != 'shots' and len(data):
+        if isinstance(data, ShotBuffer):
+            summary = data
+        else:
+            summary = ShotBuffer(capacity=len(data))
+            for shot in data:
+                summary.append(shot)
+        yield from emit_summary(summary, page=(emit == 'page'),
+                                suffix=suffix)
 
     return data
 
 
+def emit_summary(buffer, page=False, name='measure', suffix=None):
+    """
+    Save the average of a series of shots as a single Event
+
+    The Event is saved in the ``primary`` stream with the same keys as each
+    individual shot, so callbacks treat it as one already averaged reading.
+
+    Parameters
+    ----------
+    buffer : :class:`.ShotBuffer`
+        Shots to summarize
+
+    page : bool, optional
+        Also save an Event in the :data:`.SHOT_STREAM` that holds an array of
+        every shot for each numeric field. Pages of a different number of
+        shots are saved in separate streams, e.g ``shots_120``
+
+    name : str, optional
+        Name of the readable that reports the summary
+
+    suffix : str, optional
+        Appended to the name of each stream, keeping apart summaries with
+        different keys
+    """
+    suffix = '_' + suffix if suffix else ''
+    yield Msg('create', None, name='primary' + suffix)
+    yield Msg('read', BufferReading(buffer, name=name))
+    yield Msg('save')
+    if page:
+        reading = BufferReading(buffer, name=name, page=True)
+        yield Msg('create', None,
+                  name=SHOT_STREAM + suffix + reading.stream_suffix)
+        yield Msg('read', reading)
+        yield Msg('save')
+
+
 def fitwalk(detectors, motor, models, target,
             naive_step=None, average=120,
             filters=None, drop_missing=True,
-            tolerance=10, delay=None, max_steps=10):
+            tolerance=10, delay=None, max_steps=10,
+            min_average=None, monitor=False, emit='shots', beam=None,
+            selective_read=False, strategy=None, schedule=None,
+            timer=None, unique=None, cadence=None):
     """
     Parameters
     ----------
@@ -424,13 +1145,71 @@ def fitwalk(detectors, motor, models, target,
     tolerance : float, optional
         Maximum distance from target considered successful
 
-    delay : float, optional
-        Mininum time between consecutive readings
+    delay : float or 'auto', optional
+        Mininum time between consecutive readings, see :func:`.measure`
 
     max_steps : int, optional
         Maximum number of steps the scan will attempt before faulting.
         There is a max of 10 by default, but you may disable this by setting
         this option to None. Note that this may cause the walk to run indefinitely.
+
+    min_average : int, optional
+        Minimum number of readings at each event. If provided, each measurement
+        stops as soon as it is statistically settled whether the target field
+        is within ``tolerance`` of the target, so ``average`` becomes the
+        maximum number of readings. Because the number of readings varies, the
+        :attr:`.LiveBuild.average` setting of each model is set to 1
+
+    monitor : bool, optional
+        Collect the updates pushed by the signals of the target field, model
+        variables and filter keys instead of triggering and reading each
+        event, see :func:`.measure_monitor`. No documents are emitted, so each
+        averaged measurement is handed to the models directly and the
+        :attr:`.LiveBuild.average` setting of each model is set to 1
+
+    emit : {'shots', 'summary', 'page'}, optional
+        Documents emitted for each measurement, see :func:`.measure`. Unless
+        every shot is emitted, the models receive one averaged Event per
+        measurement and the :attr:`.LiveBuild.average` setting of each model
+        is set to 1
+
+    beam : :class:`.BeamPresence`, optional
+        Raise a :class:`.BeamLostError` as soon as the beam leaves the
+        detector during a measurement
+
+    selective_read : bool, optional
+        Only read the signals reporting the target field, model variables and
+        filter keys rather than every component of each detector. Other
+        fields of the detectors are absent from the emitted Events
+
+    strategy : :class:`.StepStrategy`, optional
+        Method of choosing each step of the walk, e.g :class:`.SecantStep`,
+        :class:`.BracketStep` or :class:`.TrustRegionStep`. By default, the
+        motor is moved to the backsolved position of the most accurate
+        model, see :class:`.ModelStep`
+
+    schedule : :class:`.AveragingSchedule`, optional
+        Choose the number of readings at each event from the distance to the
+        target and the measured noise, so that ``average`` is ignored. An
+        event that appears to be within ``tolerance`` is remeasured if it had
+        too few readings to be certain. Unless the events are already
+        averaged, each model fits the average of every reading at a step as a
+        single point, see :meth:`.LiveBuild.flush`
+
+    timer : :class:`.PhaseTimer`, optional
+        Record the time spent acquiring each step as ``measure``, moving the
+        motor as ``motion``, updating the models as ``fit`` and on rejected
+        shots as ``reject``. The ``naive_step`` is only timed by the default
+        plan
+
+    unique : str, optional
+        Key that identifies each frame, so that repeated frames are skipped
+        rather than averaged, see :func:`.measure`. Ignored if ``monitor`` is
+        set
+
+    cadence : float, optional
+        Time to wait for a new frame after a repeated one. Resolved once for
+        the walk by default, see :func:`.read_timing`
     """
     #Check all models are fitting the same key
     if len(set([model.y for model in models])) > 1:
@@ -439,17 +1218,33 @@ def fitwalk(detectors, motor, models, target,
     #Prepare model callbacks
     for model in models:
         #Modify averaging
-        if average % model.average != 0:
+        if schedule and not (monitor or emit != 'shots'):
+            logger.debug("Model {} will average every reading at each step"
+                         "".format(model.name))
+            model.average = None
+        elif (min_average or monitor or emit != 'shots') and model.average != 1:
+            logger.debug("Model {} will fit every reading because the number "
+                         "of shots per event varies or each event is already "
+                         "averaged".format(model.name))
+            model.average = 1
+        elif not model.average or average % model.average != 0:
             logger.warning("Model {} was set to an incompatible averaging "
                            "setting, changing setting to {}".format(model.name,
                                                                     average))
             model.average = average
+        #Time the fits
+        if timer is not None:
+            model.timer = timer
         #Subscribe callbacks
         yield Msg('subscribe', None, model, 'all')
 
     #Target field
     target_field = models[0].y
 
+    #Resolve the read timing once for every measurement of the walk
+    if cadence is None:
+        delay, cadence = read_timing(detectors, delay=delay, unique=unique)
+
     #Install filters
     filters = filters or {}
     [m.install_filters(filters) for m in models]
@@ -461,40 +1256,107 @@ def fitwalk(detectors, motor, models, target,
     motors  = dict((key, motor) for key in field_names
                     if key in motor.read_attrs)
 
+    #Create early stopping condition
+    if min_average:
+        stop = PrecisionStop(target_field, min_num=min_average,
+                             goal=target, tolerance=tolerance)
+    else:
+        stop = None
+
+    #Fields used by the models, the target paces monitored shots
+    model_fields = [target_field] + [key for model in models
+                                     for key in model.field_names
+                                     if key != target_field]
+    monitor = model_fields if monitor else None
+    fields  = model_fields if selective_read else None
+
     #Initialize variables
     steps      = 0
+    shots      = 0
+    ranker     = ModelRanker(models)
+    strategy   = strategy or ModelStep()
+    strategy.reset()
+    timer      = timer or PhaseTimer()
+    if schedule:
+        schedule.reset()
     if not naive_step:
         def naive_step():
-            return (yield from rel_set(motor, 0.01, wait=True))
+            with timer.phase('motion'):
+                return (yield from rel_set(motor, 0.01, wait=True))
 
     #Measurement method
-    def model_measure():
-        #Take average measurement
-        avg = yield from measure_average(detectors,
-                                         num=average, delay=delay,
-                                         drop_missing=drop_missing,
-                                         filters=filters)
+    def model_measure(num=average):
+        nonlocal shots
+        #Readings taken by other plans, e.g the naive step, are their own point
+        if schedule:
+            [model.flush() for model in models]
+        #Take measurement
+        with timer.phase('measure'):
+            stats = yield from measure_stats(detectors,
+                                             num=num, delay=delay,
+                                             drop_missing=drop_missing,
+                                             filters=filters, stop=stop,
+                                             monitor=monitor, emit=emit,
+                                             beam=beam, fields=fields,
+                                             timer=timer, unique=unique,
+                                             cadence=cadence)
+        avg = dict((key, value.mean if isinstance(value, ShotStats) else value)
+                   for key, value in stats.items())
+        #Monitored measurements emit no documents for the models
+        if monitor:
+            doc = {'time' : time.time(), 'data' : avg,
+                   'timestamps' : dict.fromkeys(avg, time.time())}
+            for model in models:
+                model.event(dict(doc, data=dict(avg)))
+        #Fit the readings of this step as one point
+        if schedule:
+            [model.flush() for model in models]
+            schedule.update(stats[target_field].std,
+                            stats[target_field].count)
+        shots = stats[target_field].count
         #Save current target position
         last_shot = avg.pop(target_field)
-        logger.debug("Averaged data yielded {} is at {}"
-                     "".format(target_field, last_shot))
+        logger.debug("Averaged data yielded {} is at {} +/- {} over {} shots"
+                     "".format(target_field, last_shot,
+                               stats[target_field].sem,
+                               stats[target_field].count))
 
         #Rank models based on accuracy of fit
-        model_ranking = rank_models(models, last_shot, **avg)
+        model_ranking = ranker.rank(last_shot, **avg)
 
         #Determine if any models are accurate enough
         if len(model_ranking):
-            model = model_ranking[0]
-
+            model = model_ranking[0].model
+            logger.debug("Model {} is off by {} +/- {}"
+                         "".format(model.name, model_ranking[0].residual,
+                                   model_ranking[0].uncertainty))
         else:
             model = None
 
+        #Report the outcome of the last step
+        strategy.update(motor.position, last_shot)
         return avg, last_shot, model
 
+    #Check whether the walk has finished
+    def converged():
+        nonlocal averaged_data, last_shot, accurate_model
+        done = np.isclose(last_shot, target, atol=tolerance)
+        #Confirm success with enough readings to be certain
+        if done and schedule:
+            required = schedule.num(target - last_shot, tolerance)
+            if shots < required:
+                logger.debug("Verifying convergence with {} readings"
+                             "".format(required))
+                (averaged_data, last_shot,
+                 accurate_model) = yield from model_measure(required)
+                done = np.isclose(last_shot, target, atol=tolerance)
+        return done
+
     #Make first measurements
-    averaged_data, last_shot, accurate_model = yield from model_measure()
+    averaged_data, last_shot, accurate_model = yield from model_measure(
+                                        schedule.num() if schedule else average)
     #Begin walk
-    while not np.isclose(last_shot, target, atol=tolerance):
+    while not (yield from converged()):
         #Log error
         if not steps:
             logger.debug("Initial error before fitwalk is {}"
@@ -507,55 +1369,57 @@ def fitwalk(detectors, motor, models, target,
             raise RuntimeError("fitwalk failed to converge after {} steps"\
                                "".format(steps))
 
-        #Use naive step plan if no model is accurate enough
-        #or we have not made a step yet
-        if not accurate_model or steps==0:
-            logger.debug("No model yielded accurate prediction, "\
-                         "using naive plan")
+        #Ask the strategy for the next position. Without an accurate model,
+        #or before a step has been made, only model-free strategies propose
+        model = accurate_model if steps else None
+        if model:
+            logger.debug("Using model {} to determine next step."\
+                        "".format(model.name))
+        fixed_motors = dict((key, averaged_data[key])
+                             for key in field_names
+                             if key not in motors.keys()
+                             and key in averaged_data)
+        try:
+            pos = strategy.propose(target, model=model, **fixed_motors)
+
+        #Report strategy faults
+        except Exception as e:
+            logger.warning("Strategy {} was unable to propose a step "
+                           "for target {}".format(type(strategy).__name__,
+                                                  target))
+            logger.warning(e)
+            pos = None
+
+        #Use naive step plan if no proposal was made
+        if pos is None:
+            logger.debug("No step was proposed, using naive plan")
             yield from naive_step()
         else:
-            logger.debug("Using model {} to determine next step."\
-                        "".format(accurate_model.name))
-            #Calculate estimate of next step from accurate model
-            fixed_motors = dict((key, averaged_data[key])
-                                 for key in field_names
-                                 if key not in motors.keys())
-
-            #Try and step off model prediction
-            try:
-                estimates = accurate_model.backsolve(target, **fixed_motors)
-
-            #Report model faults
-            except Exception as e:
-                logger.warning("Accurate model {} was unable to backsolve "
-                               "for target {}".format(accurate_model.name,
-                                                      target))
-                logger.warning(e)
-
-                #Reuse naive step
-                logger.debug("Reusing naive step due to lack of accurate model")
-                yield from naive_step()
-            else:
-                #Move system to match estimate
-                for param, pos in estimates.items():
-                    #Watch for NaN
-                    if pd.isnull(pos) or np.isinf(pos):
-                        raise RuntimeError("Invalid position return by fit")
-                    #Attempt to move
-                    try:
-                        logger.debug("Adjusting motor {} to position {:.1f}"\
-                                     "".format(motor.name, pos))
-                        yield from mv(motor, pos)
-
-                    except KeyboardInterrupt as e:
-                        logger.debug("No motor found to adjust variable {}"\
-                                     "".format(e))
+            #Watch for NaN
+            if pd.isnull(pos) or np.isinf(pos):
+                raise RuntimeError("Invalid position return by fit")
+            logger.debug("Adjusting motor {} to position {:.1f}"\
+                         "".format(motor.name, pos))
+            with timer.phase('motion'):
+                yield from mv(motor, pos)
         #Count our steps
         steps += 1
 
-        #Take a new measurement
+        #Take a new measurement, averaging less when the step is predicted
+        #to land far from the target
+        if schedule:
+            distance = target - last_shot
+            if model and pos is not None:
+                inputs = dict(averaged_data, **dict.fromkeys(motors, pos))
+                predicted = ranker.predict(**inputs).get(model)
+                if predicted is not None and np.isfinite(predicted[0]):
+                    distance = target - predicted[0]
+            num = schedule.num(distance, tolerance)
+        else:
+            num = average
         logger.debug("Resampling after successfull move")
-        averaged_data, last_shot, accurate_model = yield from model_measure()
+        averaged_data, last_shot, accurate_model = yield from model_measure(
+                                        num)
 
     #Report a succesfull run
     logger.info("Succesfully walked to value {} (target={}) after {} steps."\
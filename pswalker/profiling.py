@@ -0,0 +1,540 @@
+"""
+Profiling of the messages and Python time of an alignment
+"""
+############
+# Standard #
+############
+import os
+import sys
+import time
+import logging
+import threading
+from collections import defaultdict
+
+###############
+# Third Party #
+###############
+import numpy as np
+from prettytable import PrettyTable
+from bluesky.utils import ensure_generator
+
+##########
+# Module #
+##########
+from .utils.fileutils import dump_json
+
+logger = logging.getLogger(__name__)
+
+
+def _device(obj):
+    """
+    Name of the object a message is sent to
+    """
+    if obj is None:
+        return None
+    return getattr(obj, 'name', None) or repr(obj)
+
+
+def _summarize(durations):
+    """
+    Summary statistics of a list of durations
+    """
+    durations = np.asarray(durations, dtype=float)
+    if not len(durations):
+        return {'count' : 0, 'total' : 0.}
+    return {'count'  : len(durations),
+            'total'  : float(durations.sum()),
+            'mean'   : float(durations.mean()),
+            'median' : float(np.median(durations)),
+            'p95'    : float(np.percentile(durations, 95)),
+            'max'    : float(durations.max())}
+
+
+def _in_modules(module, modules):
+    """
+    Whether a module is one of or within one of a list of modules
+    """
+    return not modules or any(module == name or module.startswith(name + '.')
+                              for name in modules)
+
+
+def plan_stack(plan, modules=('pswalker',)):
+    """
+    Names of the plans a generator is suspended in
+
+    Plans that ``yield from`` one another form a chain of suspended
+    generators, followed from the outermost plan to the one that yielded the
+    current message. Plans that drive another plan by hand, e.g
+    :func:`.merge_plans` or the ``plan_mutator`` of bluesky, end the chain
+
+    Parameters
+    ----------
+    plan : generator
+        Outermost plan
+
+    modules : tuple, optional
+        Only include plans defined in these modules and their submodules. All
+        plans are included if None
+
+    Returns
+    -------
+    stack : list of str
+    """
+    names = list()
+    while plan is not None:
+        frame = getattr(plan, 'gi_frame', None)
+        if frame is None:
+            break
+        if _in_modules(frame.f_globals.get('__name__', ''), modules):
+            names.append(plan.gi_code.co_name)
+        plan = getattr(plan, 'gi_yieldfrom', None)
+    return names
+
+
+class MsgProfiler:
+    """
+    Latency profiler for the messages processed by the RunEngine
+
+    The profiler is called with each message as the RunEngine ``msg_hook``,
+    either directly or through the ``msg_hook`` of a :class:`.Watcher`. Each
+    message is timestamped as it is processed, and lasts until the next
+    message. A ``read`` is timed on its own, while a ``set`` or ``trigger``
+    is timed from the moment it is sent until the ``wait`` on its group
+    returns. The time of each message is also attributed to the stack of
+    plans that yielded it, e.g ``skywalker;iterwalk;walk_to_pixel;fitwalk``,
+    if the plan is wrapped with :meth:`.wrapper`.
+
+    Parameters
+    ----------
+    modules : tuple, optional
+        Modules whose plans appear in the stacks, see :func:`.plan_stack`
+
+    msg_hook : callable, optional
+        Also pass each message on to this hook
+
+    Example
+    -------
+    .. code::
+
+        profiler = MsgProfiler()
+        RE.msg_hook = Watcher(msg_hook=profiler)
+        RE(profiler.wrapper(skywalker(...)))
+        print(profiler.table())
+    """
+    #Messages that add a Status to a group
+    grouped = ('set', 'trigger', 'kickoff', 'complete')
+
+    def __init__(self, modules=('pswalker',), msg_hook=None):
+        self.modules  = modules
+        self.msg_hook = msg_hook
+        self._plan    = None
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget every recorded message
+        """
+        self.durations = defaultdict(list)
+        self.latencies = defaultdict(list)
+        self.stacks    = defaultdict(float)
+        self._pending  = defaultdict(list)
+        self._last     = None
+
+
+    def __call__(self, msg):
+        now = time.time()
+        self._close(now)
+        if msg.command in self.grouped:
+            self._pending[msg.kwargs.get('group')].append(
+                                    (msg.command, _device(msg.obj), now))
+        stack = ';'.join(plan_stack(self._plan, modules=self.modules))
+        self._last = (msg, now, stack or '<other>')
+        if self.msg_hook:
+            self.msg_hook(msg)
+
+
+    def _close(self, now):
+        """
+        Record the time taken by the last message
+        """
+        if self._last is None:
+            return
+        msg, start, stack = self._last
+        self._last = None
+        duration   = now - start
+        self.durations[msg.command].append(duration)
+        self.stacks[stack] += duration
+        if msg.command == 'read':
+            self.latencies[('read', _device(msg.obj))].append(duration)
+        elif msg.command == 'wait':
+            group = msg.args[0] if msg.args else msg.kwargs.get('group')
+            for command, device, sent in self._pending.pop(group, list()):
+                self.latencies[(command, device)].append(now - sent)
+
+
+    def finish(self):
+        """
+        Record the time taken by the last message, called automatically at
+        the end of a plan run with :meth:`.wrapper`
+        """
+        self._close(time.time())
+
+
+    def wrapper(self, plan):
+        """
+        Follow the plans nested within a plan
+
+        Parameters
+        ----------
+        plan : iterable
+            Plan to profile
+        """
+        plan       = ensure_generator(plan)
+        self._plan = plan
+        try:
+            return (yield from plan)
+        finally:
+            self.finish()
+            self._plan = None
+
+
+    def latency(self, command=None, device=None):
+        """
+        Round trip times of the messages
+
+        Parameters
+        ----------
+        command : str, optional
+            Only messages of this command. Commands that are not paired with
+            a ``wait`` or a ``read`` are timed until the next message
+
+        device : str, optional
+            Only messages sent to the device of this name
+
+        Returns
+        -------
+        latencies : np.ndarray
+        """
+        if device is None and command is not None and not any(
+                key[0] == command for key in self.latencies):
+            return np.asarray(self.durations.get(command, list()))
+        return np.asarray([value for (cmd, dev), values
+                           in self.latencies.items()
+                           for value in values
+                           if (command is None or cmd == command)
+                           and (device is None or dev == device)])
+
+
+    def histogram(self, command=None, device=None, bins=None):
+        """
+        Histogram of the round trip times of the messages
+
+        Parameters
+        ----------
+        command, device : str, optional
+            Messages to include, see :meth:`.latency`
+
+        bins : int or sequence, optional
+            By default, logarithmic bins from 10 microseconds to 1000 seconds
+
+        Returns
+        -------
+        counts, edges : np.ndarray
+        """
+        if bins is None:
+            bins = np.logspace(-5, 3, 25)
+        return np.histogram(self.latency(command=command, device=device),
+                            bins=bins)
+
+
+    def report(self):
+        """
+        Machine readable summary of the messages
+
+        Returns
+        -------
+        report : dict
+            Statistics of the time taken by each ``command``, the round trips
+            of each ``device`` by command and the total time of each
+            collapsed plan ``stack``
+        """
+        devices = dict()
+        for (command, device), values in self.latencies.items():
+            devices.setdefault(device, dict())[command] = _summarize(values)
+        return {'commands' : dict((command, _summarize(values))
+                                  for command, values
+                                  in self.durations.items()),
+                'devices'  : devices,
+                'stacks'   : dict(self.stacks)}
+
+
+    def collapsed(self):
+        """
+        Time of each plan stack in the collapsed format read by flame graph
+        tools, in microseconds
+
+        Returns
+        -------
+        lines : str
+        """
+        return '\n'.join('{} {}'.format(stack, int(round(total * 1e6)))
+                         for stack, total in sorted(self.stacks.items()))
+
+
+    def save(self, path):
+        """
+        Write the :meth:`.report` to a JSON file, and the :meth:`.collapsed`
+        stacks alongside it with the extension ``.folded``
+
+        Parameters
+        ----------
+        path : str
+        """
+        path = os.path.expanduser(path)
+        dump_json(path, self.report())
+        with open(os.path.splitext(path)[0] + '.folded', 'w') as f:
+            f.write(self.collapsed() + '\n')
+        logger.debug("Saved message profile to %s", path)
+
+
+    def table(self):
+        """
+        Table of the round trip times of each device
+
+        Returns
+        -------
+        table : prettytable.PrettyTable
+        """
+        pt = PrettyTable(['Device', 'Command', 'Count', 'Mean (s)',
+                          'p95 (s)', 'Max (s)'])
+        pt.align = 'r'
+        pt.align['Device'] = 'l'
+        pt.float_format = '8.4'
+        rows = [(device, command, _summarize(values))
+                for (command, device), values in self.latencies.items()]
+        for device, command, stats in sorted(rows,
+                                             key=lambda row: -row[2]['total']):
+            pt.add_row([device, command, stats['count'], stats['mean'],
+                        stats['p95'], stats['max']])
+        return pt
+
+
+class StackSampler:
+    """
+    Statistical profiler of the Python time spent by a plan
+
+    A background thread samples the stack of the thread that runs the plan,
+    which for the RunEngine is its event loop, at a fixed interval. Time
+    spent filtering shots, fitting, ranking models and in the callbacks that
+    receive the documents all appear in the stacks, while time the RunEngine
+    spends waiting on devices is sampled outside of the plan. Because only
+    the stack is sampled, the overhead does not depend on the number of
+    function calls.
+
+    Parameters
+    ----------
+    path : str, optional
+        Save the profile here once a plan run with :meth:`.wrapper` finishes,
+        see :meth:`.save`
+
+    interval : float, optional
+        Seconds between samples
+
+    modules : tuple, optional
+        Modules whose functions are summarized, see :meth:`.summary`
+
+    Example
+    -------
+    .. code::
+
+        sampler = StackSampler('~/profiles/alignment.json')
+        RE(sampler.wrapper(iterwalk(...)))
+        sampler.summary()['functions']['pswalker.plans.fitwalk']
+    """
+    def __init__(self, path=None, interval=0.01, modules=('pswalker',)):
+        self.path     = path
+        self.interval = interval
+        self.modules  = modules
+        self._thread  = None
+        self._names   = dict()
+        self._modules = dict()
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget every sample
+        """
+        self.counts  = defaultdict(int)
+        self.samples = 0
+        self.ticks   = 0
+        self.elapsed = 0.
+
+
+    def _name(self, code, module):
+        """
+        Name of the function of a frame, cached by code object
+        """
+        try:
+            return self._names[code]
+        except KeyError:
+            name = '{}.{}'.format(module, getattr(code, 'co_qualname',
+                                                  code.co_name))
+            self._names[code]   = name
+            self._modules[name] = module
+            return name
+
+
+    def _collapse(self, frame):
+        """
+        Stack of a frame, outermost call first, joined by semicolons
+        """
+        names = list()
+        while frame is not None:
+            names.append(self._name(frame.f_code,
+                                    frame.f_globals.get('__name__', '')))
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+
+    def _sample(self, ident, stop):
+        start = time.time()
+        while not stop.wait(self.interval):
+            self.ticks += 1
+            frame = sys._current_frames().get(ident)
+            if frame is None:
+                continue
+            self.counts[self._collapse(frame)] += 1
+            self.samples += 1
+            del frame
+        self.elapsed += time.time() - start
+
+
+    @property
+    def running(self):
+        """
+        Whether the sampler is running
+        """
+        return self._thread is not None
+
+
+    def start(self, thread=None):
+        """
+        Start sampling a thread
+
+        Parameters
+        ----------
+        thread : int, optional
+            Identifier of the thread, by default the calling thread
+        """
+        if self.running:
+            raise RuntimeError("StackSampler is already running")
+        ident = thread or threading.get_ident()
+        self._stop   = threading.Event()
+        self._thread = threading.Thread(target=self._sample,
+                                        args=(ident, self._stop),
+                                        name='StackSampler', daemon=True)
+        self._thread.start()
+        logger.debug("Sampling the stack of thread %s every %s s",
+                     ident, self.interval)
+
+
+    def stop(self):
+        """
+        Stop sampling
+        """
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+
+    def wrapper(self, plan):
+        """
+        Sample the thread running a plan for as long as it runs, saving the
+        profile to :attr:`.path` if given
+
+        Parameters
+        ----------
+        plan : iterable
+            Plan to profile
+        """
+        plan = ensure_generator(plan)
+        #The first step of the plan is run by the thread to sample
+        self.start()
+        try:
+            return (yield from plan)
+        finally:
+            self.stop()
+            if self.path:
+                self.save(self.path)
+
+
+    def collapsed(self):
+        """
+        Number of samples of each stack in the collapsed format read by flame
+        graph tools
+
+        Returns
+        -------
+        lines : str
+        """
+        return '\n'.join('{} {}'.format(stack, count)
+                         for stack, count in sorted(self.counts.items()))
+
+
+    def summary(self):
+        """
+        Time spent in the functions of :attr:`.modules`
+
+        The ``self`` time of a function includes the functions of other
+        modules it calls, e.g the time lmfit spends fitting a model is the
+        ``self`` time of the callback that asked for the fit. The ``total``
+        time includes every function below it. Samples without a function of
+        :attr:`.modules` on the stack are counted as ``other``, e.g the
+        RunEngine waiting on a device
+
+        Returns
+        -------
+        summary : dict
+            Times in seconds, estimated from the number of samples
+        """
+        period    = self.elapsed / self.ticks if self.ticks else self.interval
+        functions = dict()
+        other     = 0
+        for stack, count in self.counts.items():
+            names = [name for name in stack.split(';')
+                     if _in_modules(self._modules.get(name, ''),
+                                    self.modules)]
+            if not names:
+                other += count
+                continue
+            for name in set(names):
+                entry = functions.setdefault(name, {'self' : 0, 'total' : 0})
+                entry['total'] += count
+            functions[names[-1]]['self'] += count
+        for entry in functions.values():
+            entry['self']  *= period
+            entry['total'] *= period
+        return {'interval' : self.interval, 'samples' : self.samples,
+                'elapsed' : self.elapsed, 'other' : other * period,
+                'functions' : functions}
+
+
+    def save(self, path):
+        """
+        Write the :meth:`.summary` to a JSON file, and the :meth:`.collapsed`
+        stacks alongside it with the extension ``.folded``
+
+        Parameters
+        ----------
+        path : str
+        """
+        path = os.path.expanduser(path)
+        dump_json(path, self.summary())
+        with open(os.path.splitext(path)[0] + '.folded', 'w') as f:
+            f.write(self.collapsed() + '\n')
+        logger.info("Saved stack profile of %s samples to %s",
+                    self.samples, path)
@@ -8,6 +8,8 @@ from bluesky.preprocessors import run_decorator, stage_decorator
 from .recovery import homs_recovery, sim_recovery
 from .suspenders import BeamEnergySuspendFloor, BeamRateSuspendFloor
 from .iterwalk import iterwalk
+from .plan_stubs import merge_plans
+from .callbacks import BeamPresence
 from .utils.argutils import as_list
 from .utils import field_prepend
 
@@ -38,9 +40,40 @@ def skywalker(detectors, motors, det_fields, mot_fields, goals,
               first_steps=1,
               gradients=None, tolerances=20, averages=20, timeout=600,
               sim=False, use_filters=True, md=None, tol_scaling=None,
-              extra_stage=None):
+              extra_stage=None, min_averages=None, emit='shots',
+              beam_presence=False, beam_threshold=None, selective_read=False,
+              incremental_fit=False, model_store=None, energy=None,
+              walk_checkpoint=None, resume=False, deadline=None, run=True,
+              timer=None, profile=None):
     """
     Iterwalk as a base, with recovery plans, filters, and bonus staging.
+
+    If ``beam_presence`` is set, each measurement also watches for the loss
+    of beam and hands off to the recovery plan within a few shots rather than
+    after the maximum number of dropped shots, see :class:`.BeamPresence`. If
+    ``beam_threshold`` is given, a mean image intensity below it is treated
+    as no beam.
+
+    Given a :class:`.ModelStore`, the walk is seeded with the fits of
+    previous alignments at the same photon ``energy`` and the new fits are
+    stored when it finishes.
+
+    Given a :class:`.WalkCheckpoint`, the progress of the walk is saved as
+    it goes, and an interrupted walk is continued if ``resume`` is set.
+
+    A ``deadline`` in seconds plans the walk against a fixed time budget, see
+    :class:`.DeadlinePlanner`.
+
+    Given a :class:`.PhaseTimer`, the time spent in each phase of the
+    alignment is recorded. Pass the same timer to the :class:`.Watcher` to
+    include it in the report.
+
+    A ``profile`` path or :class:`.StackSampler` samples the Python stack of
+    the walk, see :func:`.iterwalk`. The path is kept in the metadata of the
+    run.
+
+    If ``run`` is False, the walk is not wrapped in its own run so that it can
+    be combined with other plans, see :func:`.skywalker_branches`.
     """
     _md = {'goals'     : goals,
            'detectors' : [det.name for det in as_list(detectors)],
@@ -50,7 +83,19 @@ def skywalker(detectors, motors, det_fields, mot_fields, goals,
                               tolerances=tolerances, averages=averages,
                               timeout=timeout, det_fields=as_list(det_fields),
                               mot_fields=as_list(mot_fields),
-                              first_steps=first_steps,tol_scaling=tol_scaling)
+                              first_steps=first_steps,tol_scaling=tol_scaling,
+                              min_averages=min_averages, emit=emit,
+                              beam_presence=beam_presence,
+                              beam_threshold=beam_threshold,
+                              selective_read=selective_read,
+                              incremental_fit=incremental_fit,
+                              energy=energy,
+                              model_store=getattr(model_store, 'path', None),
+                              walk_checkpoint=getattr(walk_checkpoint, 'path',
+                                                      None),
+                              resume=resume,
+                              deadline=getattr(deadline, 'budget', deadline),
+                              profile=getattr(profile, 'path', profile))
           }
     _md.update(md or {})
     goals = [480 - g for g in goals]
@@ -62,6 +107,18 @@ def skywalker(detectors, motors, det_fields, mot_fields, goals,
     else:
         # Don't filter on sims unless testing recovery
         filters = None
+    if beam_presence:
+        beams = []
+        for det, fld in zip(detectors, det_fields):
+            if beam_threshold is not None:
+                intensity = field_prepend('detector_stats2_mean_value', det)
+            else:
+                intensity = None
+            beams.append(BeamPresence(centroid=field_prepend(fld, det),
+                                      intensity=intensity,
+                                      threshold=beam_threshold))
+    else:
+        beams = None
     if sim:
         recovery_plan = sim_recovery
     else:
@@ -74,7 +131,6 @@ def skywalker(detectors, motors, det_fields, mot_fields, goals,
         for dev in extra_stage:
             to_stage.append(dev)
 
-    @run_decorator(md=_md)
     @stage_decorator(to_stage)
     def letsgo():
         walk = iterwalk(detectors, motors, goals, first_steps=first_steps,
@@ -82,7 +138,59 @@ def skywalker(detectors, motors, det_fields, mot_fields, goals,
                         tolerances=tolerances, averages=averages, timeout=timeout,
                         detector_fields=det_fields, motor_fields=mot_fields,
                         system=detectors + motors, recovery_plan=recovery_plan,
-                        filters=filters,tol_scaling=tol_scaling)
+                        filters=filters,tol_scaling=tol_scaling,
+                        min_averages=min_averages, emit=emit,
+                        beams=beams, selective_read=selective_read,
+                        incremental_fit=incremental_fit,
+                        model_store=model_store, energy=energy,
+                        walk_checkpoint=walk_checkpoint, resume=resume,
+                        deadline=deadline, timer=timer, profile=profile)
         return (yield from walk)
 
+    if run:
+        letsgo = run_decorator(md=_md)(letsgo)
+    return (yield from letsgo())
+
+
+def skywalker_branches(branches, md=None, poll=0.01):
+    """
+    Align independent branches of the beamline in a single run
+
+    Each branch is a :func:`.skywalker` of mirrors and imagers that share no
+    optics with the other branches. The walks are interleaved with
+    :func:`.merge_plans` so the motion of one branch overlaps with the others,
+    and the alignment takes as long as the slowest branch rather than the sum
+    of all of them. The events of each branch are saved in streams suffixed
+    with ``branch0``, ``branch1`` ...
+
+    Parameters
+    ----------
+    branches : list of dict
+        Keyword arguments of :func:`.skywalker` for each branch
+
+    md : dict, optional
+        Metadata of the run
+
+    poll : float, optional
+        Time to sleep when every branch is waiting on its devices
+
+    Returns
+    -------
+    results : list
+        Result of the walk of each branch
+    """
+    _md = {'plan_name' : 'homs_skywalker_branches',
+           'branches'  : [{'goals' : branch['goals'],
+                           'detectors' : [det.name for det
+                                          in as_list(branch['detectors'])],
+                           'mirrors' : [mot.name for mot
+                                        in as_list(branch['motors'])]}
+                          for branch in branches]}
+    _md.update(md or {})
+    plans = [skywalker(run=False, **branch) for branch in branches]
+
+    @run_decorator(md=_md)
+    def letsgo():
+        return (yield from merge_plans(*plans, poll=poll))
+
     return (yield from letsgo())
@@ -0,0 +1,340 @@
+"""
+Persistent storage of the models found during previous alignments
+"""
+############
+# Standard #
+############
+import os
+import time
+import logging
+import threading
+from collections import namedtuple
+
+###############
+# Third Party #
+###############
+import numpy as np
+import simplejson as sjson
+
+##########
+# Module #
+##########
+from .callbacks import fit_errors
+from .utils.fileutils import dump_json
+
+logger = logging.getLogger(__name__)
+
+#Linear relationship between a mirror and a detector
+ModelRecord = namedtuple('ModelRecord', ['slope', 'intercept', 'slope_err',
+                                         'intercept_err', 'energy', 'time'])
+
+
+def _clean(value):
+    """
+    Convert a value to something JSON can store, NaN becomes None
+    """
+    if value is None:
+        return None
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+
+class ModelStore:
+    """
+    Record of the linear fits between mirrors and detectors on disk
+
+    The slope of a mirror pitch against the centroid on a detector barely
+    changes between alignments. Each fit is stored in a JSON file keyed by
+    the names of the mirror and detector and their fields, so later walks can
+    be seeded with the last known gradient instead of probing the system
+    with a naive first step. Fits can also be kept per photon energy, in
+    which case the record closest in energy is returned.
+
+    Parameters
+    ----------
+    path : str
+        Location of the JSON file. It is created on the first save
+
+    energy_tolerance : float, optional
+        Maximum relative difference in photon energy between a request and a
+        stored record for the record to be used
+
+    Example
+    -------
+    .. code::
+
+        store = ModelStore('~/.pswalker/models.json')
+        store.record('m1h', 'p3h', 'm1h_pitch',
+                     'p3h_detector_stats2_centroid_x', slope=-0.4,
+                     intercept=350)
+        store.lookup('m1h', 'p3h', 'm1h_pitch',
+                     'p3h_detector_stats2_centroid_x').slope
+    """
+    version = 1
+
+    def __init__(self, path, energy_tolerance=0.05):
+        self.path             = os.path.expanduser(path)
+        self.energy_tolerance = energy_tolerance
+        self._lock            = threading.RLock()
+        self.models           = self.load()
+
+
+    @staticmethod
+    def key(mirror, detector, mirror_field, detector_field):
+        """
+        Key of the relationship between two fields
+        """
+        return '{}:{}|{}:{}'.format(mirror, mirror_field,
+                                    detector, detector_field)
+
+
+    def load(self):
+        """
+        Read the stored models from disk
+
+        Returns
+        -------
+        models : dict
+            Map of key to a list of records at different energies. Empty if
+            the file does not exist or can not be read
+        """
+        try:
+            with open(self.path, 'r') as f:
+                contents = sjson.load(f)
+        except FileNotFoundError:
+            return dict()
+        except (OSError, ValueError) as e:
+            logger.warning("Unable to read model store %s: %s", self.path, e)
+            return dict()
+        if contents.get('version') != self.version:
+            logger.warning("Ignoring model store %s with version %s",
+                           self.path, contents.get('version'))
+            return dict()
+        return contents.get('models', dict())
+
+
+    def save(self):
+        """
+        Write the models to disk
+
+        The file is replaced atomically so that a concurrent reader never
+        sees a partial write
+        """
+        with self._lock:
+            dump_json(self.path, {'version' : self.version,
+                                  'models' : self.models})
+
+
+    def _same_energy(self, stored, energy):
+        if stored is None or energy is None:
+            return stored is None and energy is None
+        return abs(stored - energy) <= self.energy_tolerance * abs(energy)
+
+
+    def lookup(self, mirror, detector, mirror_field, detector_field,
+               energy=None):
+        """
+        Find the most relevant stored model
+
+        Parameters
+        ----------
+        mirror, detector : str
+            Names of the devices
+
+        mirror_field, detector_field : str
+            Event keys of the mirror pitch and beam centroid
+
+        energy : float, optional
+            Photon energy of the beam. If given, only records within the
+            ``energy_tolerance`` are considered and the closest is returned.
+            Otherwise the most recent record is returned
+
+        Returns
+        -------
+        record : :class:`.ModelRecord` or None
+        """
+        with self._lock:
+            entries = self.models.get(self.key(mirror, detector,
+                                               mirror_field, detector_field),
+                                      list())
+            if energy is not None:
+                entries = [entry for entry in entries
+                           if entry['energy'] is not None
+                           and self._same_energy(entry['energy'], energy)]
+                entries.sort(key=lambda entry: abs(entry['energy'] - energy))
+            else:
+                entries = sorted(entries, key=lambda entry: -entry['time'])
+            if not entries:
+                return None
+            return ModelRecord(**entries[0])
+
+
+    def record(self, mirror, detector, mirror_field, detector_field,
+               slope, intercept, slope_err=None, intercept_err=None,
+               energy=None, save=True):
+        """
+        Store a fit, replacing any previous record at the same energy
+
+        Parameters
+        ----------
+        mirror, detector : str
+            Names of the devices
+
+        mirror_field, detector_field : str
+            Event keys of the mirror pitch and beam centroid
+
+        slope, intercept : float
+            Parameters of the fitted line
+
+        slope_err, intercept_err : float, optional
+            Standard errors of the parameters
+
+        energy : float, optional
+            Photon energy of the beam
+
+        save : bool, optional
+            Write the store to disk immediately
+        """
+        if not (np.isfinite(slope) and np.isfinite(intercept)) or slope == 0:
+            logger.debug("Not storing degenerate fit of %s to %s",
+                         mirror_field, detector_field)
+            return
+        entry = {'slope' : _clean(slope), 'intercept' : _clean(intercept),
+                 'slope_err' : _clean(slope_err),
+                 'intercept_err' : _clean(intercept_err),
+                 'energy' : _clean(energy), 'time' : time.time()}
+        with self._lock:
+            key = self.key(mirror, detector, mirror_field, detector_field)
+            entries = [old for old in self.models.get(key, list())
+                       if not self._same_energy(old['energy'], energy)]
+            entries.append(entry)
+            self.models[key] = entries
+            logger.debug("Stored model %s: %s", key, entry)
+            if save:
+                self.save()
+
+
+    def record_fit(self, mirror, detector, mirror_field, detector_field,
+                   result, energy=None, save=True):
+        """
+        Store the result of a :class:`.LinearFit`
+
+        Parameters
+        ----------
+        result : lmfit.model.ModelResult or :class:`.LinearResult`
+            Fit with ``slope`` and ``intercept`` values
+
+        See :meth:`.record` for the other parameters
+        """
+        errors = fit_errors(result)
+        self.record(mirror, detector, mirror_field, detector_field,
+                    slope=result.values['slope'],
+                    intercept=result.values['intercept'],
+                    slope_err=errors.get('slope'),
+                    intercept_err=errors.get('intercept'),
+                    energy=energy, save=save)
+
+
+class WalkCheckpoint:
+    """
+    State of an :func:`.iterwalk` saved to disk after each walk
+
+    If an alignment is aborted, times out, or the process restarts, the
+    learned gradients and fits, motor positions, finished flags and progress
+    of the walk are kept so that the next attempt can resume where it left
+    off rather than starting from scratch. The state is only resumed by a
+    walk of the same mirrors and detectors to the same goals.
+
+    Parameters
+    ----------
+    path : str
+        Location of the JSON file
+
+    Example
+    -------
+    .. code::
+
+        state = WalkCheckpoint('~/.pswalker/walk.json')
+        RE(iterwalk(detectors, motors, goals, walk_checkpoint=state,
+                    resume=True))
+    """
+    version = 1
+
+    def __init__(self, path):
+        self.path = os.path.expanduser(path)
+
+
+    @staticmethod
+    def identity(detectors, motors, goals, joint=False):
+        """
+        Description of the alignment a state belongs to. The states of a
+        ``joint`` walk, see :func:`.jointwalk`, are kept apart
+        """
+        identity = {'detectors' : [det.name for det in detectors],
+                    'motors' : [mot.name for mot in motors],
+                    'goals' : [_clean(goal) for goal in goals]}
+        if joint:
+            identity['joint'] = True
+        return identity
+
+
+    def save(self, identity, state):
+        """
+        Write the state of a walk to disk
+
+        Parameters
+        ----------
+        identity : dict
+            Output of :meth:`.identity` for the walk
+
+        state : dict
+            Progress of the walk. Values must be serializable to JSON
+        """
+        dump_json(self.path, {'version' : self.version,
+                              'time' : time.time(),
+                              'identity' : identity, 'state' : state})
+        logger.debug("Saved walk checkpoint to %s", self.path)
+
+
+    def load(self, identity):
+        """
+        Read the state of a previous walk
+
+        Parameters
+        ----------
+        identity : dict
+            Output of :meth:`.identity` for the walk
+
+        Returns
+        -------
+        state : dict or None
+            None if there is no checkpoint or it belongs to another walk
+        """
+        try:
+            with open(self.path, 'r') as f:
+                contents = sjson.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Unable to read walk checkpoint %s: %s",
+                           self.path, e)
+            return None
+        if contents.get('version') != self.version:
+            logger.warning("Ignoring walk checkpoint %s with version %s",
+                           self.path, contents.get('version'))
+            return None
+        if contents.get('identity') != identity:
+            logger.warning("Walk checkpoint %s belongs to a different "
+                           "alignment, ignoring it", self.path)
+            return None
+        return contents.get('state')
+
+
+    def clear(self):
+        """
+        Remove the checkpoint from disk
+        """
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,573 @@
+"""
+Strategies for choosing the next step of a walk
+"""
+############
+# Standard #
+############
+import logging
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+from .callbacks import fit_errors
+
+logger = logging.getLogger(__name__)
+
+
+class StepStrategy:
+    """
+    Base class for choosing the next position of the motor in
+    :func:`.fitwalk`
+
+    After every measurement the walk reports the position of the motor and
+    the measured value of the target field with :meth:`.update`. The walk
+    then asks for the next position with :meth:`.propose`. A strategy that
+    can not make a proposal returns None and the walk takes its naive step.
+    """
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget the history of the previous walk
+        """
+        self.positions = list()
+        self.values    = list()
+
+
+    def update(self, position, value):
+        """
+        Record a measurement
+
+        Parameters
+        ----------
+        position : float
+            Position of the motor
+
+        value : float
+            Measured value of the target field
+        """
+        self.positions.append(float(position))
+        self.values.append(float(value))
+
+
+    def propose(self, target, model=None, **kwargs):
+        """
+        Choose the next position of the motor
+
+        Parameters
+        ----------
+        target : float
+            Desired value of the target field
+
+        model : :class:`.LiveBuild`, optional
+            Most accurate model of the walk, if there is one
+
+        kwargs :
+            Positions of the other model variables that are held fixed
+
+        Returns
+        -------
+        position : float or None
+            Next position of the motor, None to take the naive step
+        """
+        raise NotImplementedError
+
+
+    def _secant_slope(self):
+        """
+        Slope through the two most recent distinct positions
+        """
+        if len(self.positions) < 2:
+            return None
+        dx = self.positions[-1] - self.positions[-2]
+        dy = self.values[-1] - self.values[-2]
+        if dx == 0 or dy == 0:
+            return None
+        return dy / dx
+
+
+class ModelStep(StepStrategy):
+    """
+    Move to the position the model backsolves for the target
+
+    This is the behavior of :func:`.fitwalk` without a strategy
+    """
+    def propose(self, target, model=None, **kwargs):
+        if model is None:
+            return None
+        estimates = model.backsolve(target, **kwargs)
+        if not estimates:
+            return None
+        #The motor is the last variable solved for
+        return list(estimates.values())[-1]
+
+
+class SecantStep(StepStrategy):
+    """
+    Step along the line through the two most recent measurements
+
+    The secant does not depend on a fit of every previous point, so it
+    follows a response that is only locally linear. Until two measurements
+    are available, the model is used instead.
+
+    Parameters
+    ----------
+    damping : float, optional
+        Fraction of the secant step to take. Values below one trade an extra
+        step for protection against overshooting a noisy slope
+
+    max_step : float, optional
+        Largest move the strategy will propose
+    """
+    def __init__(self, damping=1., max_step=None):
+        self.damping  = damping
+        self.max_step = max_step
+        super().__init__()
+
+
+    def _limit(self, step):
+        if self.max_step is not None and abs(step) > self.max_step:
+            logger.debug("Limiting step of %s to %s", step, self.max_step)
+            step = np.sign(step) * self.max_step
+        return step
+
+
+    def propose(self, target, model=None, **kwargs):
+        slope = self._secant_slope()
+        if slope is None:
+            return ModelStep.propose(self, target, model=model, **kwargs)
+        step = self.damping * (target - self.values[-1]) / slope
+        return self.positions[-1] + self._limit(step)
+
+
+class BracketStep(SecantStep):
+    """
+    Illinois regula falsi once the target has been bracketed
+
+    Until measurements on both sides of the target are available, secant
+    steps are taken. Afterwards, each step interpolates between the closest
+    measurements that bracket the target. The retained endpoint has its
+    error halved each time it is kept, which avoids the slow one-sided
+    convergence of plain regula falsi.
+    """
+    def reset(self):
+        super().reset()
+        self.bracket = None
+
+
+    def update(self, position, value):
+        super().update(position, value)
+        #Errors of the latest point are compared against the target later
+        self._latest = (float(position), float(value))
+
+
+    def propose(self, target, model=None, **kwargs):
+        if not self.positions:
+            return None
+        pos, err = self._latest[0], self._latest[1] - target
+        if self.bracket is None:
+            #Search the history for a measurement on the other side
+            for p, v in zip(self.positions[:-1], self.values[:-1]):
+                if np.sign(v - target) == -np.sign(err) != 0:
+                    self.bracket = [(p, v - target), (pos, err)]
+            if self.bracket is None:
+                return super().propose(target, model=model, **kwargs)
+        else:
+            (a, fa), (b, fb) = self.bracket
+            if np.sign(err) == np.sign(fb):
+                #Latest point replaces the same side, halve the other end
+                self.bracket = [(a, fa / 2.), (pos, err)]
+            else:
+                self.bracket = [(b, fb), (pos, err)]
+        (a, fa), (b, fb) = self.bracket
+        if fa == fb:
+            return super().propose(target, model=model, **kwargs)
+        logger.debug("Bracketed target between %s and %s", a, b)
+        return b - fb * (b - a) / (fb - fa)
+
+
+class TrustRegionStep(StepStrategy):
+    """
+    Limit each step to a region where the linear model has proven reliable
+
+    The step is taken from the slope of the model, or the secant if the
+    model has none. Its length is limited to a trust radius that grows when
+    the measured change agrees with the prediction and shrinks when it does
+    not. The radius is further reduced by the relative uncertainty of the
+    slope, so steps stay short until the fit is well determined.
+
+    Parameters
+    ----------
+    radius : float, optional
+        Initial trust radius. By default, the first proposed step is trusted
+
+    confidence : float, optional
+        Number of standard errors of the slope used to shrink the radius
+
+    grow, shrink : float, optional
+        Factors applied to the radius after a good or poor prediction
+    """
+    def __init__(self, radius=None, confidence=2., grow=2., shrink=0.5):
+        self.initial    = radius
+        self.confidence = confidence
+        self.grow       = grow
+        self.shrink     = shrink
+        super().__init__()
+
+
+    def reset(self):
+        super().reset()
+        self.radius     = self.initial
+        self._predicted = None
+
+
+    def update(self, position, value):
+        #Compare the prediction of the last step with the outcome
+        if self._predicted is not None and self.values:
+            actual = value - self.values[-1]
+            ratio  = actual / self._predicted if self._predicted else 0.
+            if 0.75 <= ratio <= 1.25:
+                self.radius *= self.grow
+            elif ratio < 0.25 or ratio > 2.:
+                self.radius *= self.shrink
+            logger.debug("Step achieved %.2f of the predicted change, trust "
+                         "radius is now %s", ratio, self.radius)
+            self._predicted = None
+        super().update(position, value)
+
+
+    def _model_slope(self, model):
+        """
+        Slope and standard error from a linear model
+        """
+        try:
+            slope = model.result.values['slope']
+        except (AttributeError, KeyError, TypeError):
+            return None, None
+        err = fit_errors(model.result).get('slope')
+        return slope, err
+
+
+    def propose(self, target, model=None, **kwargs):
+        if not self.positions:
+            return None
+        slope, err = self._model_slope(model) if model is not None \
+                     else (None, None)
+        if not slope:
+            slope, err = self._secant_slope(), None
+        if not slope:
+            return None
+        step = (target - self.values[-1]) / slope
+        if self.radius is None:
+            self.radius = abs(step)
+        #Shrink the region while the slope is poorly determined
+        limit = self.radius
+        if err is not None and np.isfinite(err):
+            limit /= 1. + self.confidence * abs(err / slope)
+        if abs(step) > limit:
+            step = np.sign(step) * limit
+        self._predicted = slope * step
+        return self.positions[-1] + step
+
+
+class BroydenJacobian:
+    """
+    Estimate of the sensitivity of several detectors to several motors
+
+    Entry ``[i, j]`` is the change in the reading of detector ``i`` per unit
+    move of motor ``j``. After each simultaneous move of the motors, the
+    estimate is corrected with Broyden's rank-one update, the smallest change
+    to the matrix that reproduces the observed response. Steps already taken
+    refine the coupling between mirrors without probing each pair again.
+
+    Parameters
+    ----------
+    jacobian : array-like
+        Initial estimate, with one row per detector and one column per motor.
+        Entries that are not yet known may be NaN, see :attr:`.missing`
+    """
+    def __init__(self, jacobian):
+        self.jacobian = np.array(jacobian, dtype=float)
+        if self.jacobian.ndim != 2:
+            raise ValueError("Jacobian must be a two dimensional array")
+
+
+    @property
+    def missing(self):
+        """
+        Indices of the entries that are not yet known
+        """
+        return list(zip(*np.where(~np.isfinite(self.jacobian))))
+
+
+    def update(self, dx, dy):
+        """
+        Correct the estimate with an observed response
+
+        Parameters
+        ----------
+        dx : array-like
+            Move of each motor
+
+        dy : array-like
+            Change in the reading of each detector
+        """
+        dx, dy = np.asarray(dx, dtype=float), np.asarray(dy, dtype=float)
+        norm = np.dot(dx, dx)
+        if not norm or self.missing:
+            return
+        self.jacobian += np.outer(dy - self.jacobian.dot(dx), dx) / norm
+        logger.debug("Updated jacobian to %s", self.jacobian.tolist())
+
+
+    def seed(self, dx, dy):
+        """
+        Fill in the unknown entries from an observed response
+
+        The part of the change in each reading that is not explained by the
+        known entries is attributed to the unknown entries of its row with
+        the same rank-one correction as :meth:`.update`, so an unknown entry
+        is exact if it is the only one in its row. Unknown entries of motors
+        that did not move are set to zero. Later updates correct the rest
+
+        Parameters
+        ----------
+        dx : array-like
+            Move of each motor
+
+        dy : array-like
+            Change in the reading of each detector
+        """
+        dx, dy = np.asarray(dx, dtype=float), np.asarray(dy, dtype=float)
+        for row in set(i for i, j in self.missing):
+            unknown = ~np.isfinite(self.jacobian[row])
+            explained = self.jacobian[row, ~unknown].dot(dx[~unknown])
+            norm = np.dot(dx[unknown], dx[unknown])
+            if norm:
+                self.jacobian[row, unknown] = ((dy[row] - explained)
+                                               * dx[unknown] / norm)
+            else:
+                self.jacobian[row, unknown] = 0.
+        logger.debug("Seeded jacobian to %s", self.jacobian.tolist())
+
+
+    def step(self, error, damping=1.):
+        """
+        Move of each motor that removes an error on each detector
+
+        Parameters
+        ----------
+        error : array-like
+            Goal minus the reading of each detector
+
+        damping : float, optional
+            Fraction of the step to take
+
+        Returns
+        -------
+        step : np.ndarray
+            Least-squares, minimum norm solution of ``jacobian . step = error``
+        """
+        if self.missing:
+            raise RuntimeError("Can not solve with unknown entries {}"
+                               "".format(self.missing))
+        step = np.linalg.lstsq(self.jacobian, np.asarray(error, dtype=float),
+                               rcond=None)[0]
+        return damping * step
+
+
+class CouplingScheduler:
+    """
+    Choose the next detector to visit in :func:`.iterwalk`
+
+    Each detector is paired with the motor at the same index, but every
+    motor can also shift the other detectors. The scheduler keeps the last
+    measured distance of each detector from its goal and the moves of every
+    motor since, and predicts the current distance from the coupling between
+    each pair. The coupling is learned whenever a detector is measured after
+    only a single motor has moved, and may be seeded with known values.
+
+    Detectors that are predicted to need a walk are visited first, the one
+    furthest out of tolerance leading. Detectors whose predicted distance is
+    well inside tolerance are not verified until every other detector is
+    done. The walk is only converged once every detector has been measured
+    within tolerance after the last move of any motor, so a final
+    verification pass is always made.
+
+    Parameters
+    ----------
+    tolerances : list
+        Allowed distance from the goal of each detector
+
+    coupling : array-like, optional
+        Known change of each detector, one row each, per unit move of each
+        motor, one column each. Unknown entries may be NaN
+
+    margin : float, optional
+        Fraction of the tolerance that a predicted distance must be inside
+        for the verification of the detector to be postponed
+
+    Attributes
+    ----------
+    postponed : int
+        Verifications that a fixed order would have made before the walk
+        that was chosen instead
+
+    reordered : int
+        Visits made to the imager that was already inserted rather than the
+        next detector in a fixed order, counted by :func:`.iterwalk`
+    """
+    def __init__(self, tolerances, coupling=None, margin=0.5):
+        self.tolerances = np.asarray(tolerances, dtype=float)
+        num = len(self.tolerances)
+        if coupling is None:
+            coupling = np.full((num, num), np.nan)
+        self.coupling = np.array(coupling, dtype=float)
+        self.margin   = margin
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget every measurement and move
+        """
+        num = len(self.tolerances)
+        self.residuals = np.full(num, np.nan)
+        self.postponed = 0
+        self.reordered = 0
+        self._moves    = np.zeros((num, num))
+        self._fresh    = np.zeros(num, dtype=bool)
+        self._passed   = set()
+
+
+    def moved(self, motor, step):
+        """
+        Record the move of a motor
+
+        Parameters
+        ----------
+        motor : int
+            Index of the motor
+
+        step : float
+            Distance moved
+        """
+        if not step or not np.isfinite(step):
+            return
+        self._moves[:, motor] += step
+        self._fresh[:] = False
+
+
+    def invalidate(self):
+        """
+        Forget the state of every detector after an unknown move
+        """
+        self.residuals[:] = np.nan
+        self._moves[:]    = 0.
+        self._fresh[:]    = False
+        self._passed.clear()
+
+
+    def measured(self, index, residual):
+        """
+        Record a measurement
+
+        Parameters
+        ----------
+        index : int
+            Index of the detector
+
+        residual : float
+            Measured position minus the goal
+        """
+        moves = self._moves[index]
+        moved = np.flatnonzero(moves)
+        #The shift can only be attributed if a single motor moved
+        if len(moved) == 1 and np.isfinite(self.residuals[index]):
+            motor = moved[0]
+            self.coupling[index, motor] = ((residual - self.residuals[index])
+                                           / moves[motor])
+            logger.debug("Learned coupling of detector %s to motor %s as %s",
+                         index, motor, self.coupling[index, motor])
+        self.residuals[index] = residual
+        self._moves[index]    = 0.
+        self._fresh[index]    = True
+        self._passed.discard(index)
+
+
+    def predicted(self, index):
+        """
+        Predicted distance of a detector from its goal
+
+        Returns
+        -------
+        residual : float
+            NaN if the detector has not been measured or a motor with an
+            unknown coupling has moved since
+        """
+        moves = self._moves[index]
+        moved = moves != 0
+        coupling = self.coupling[index, moved]
+        if not np.isfinite(self.residuals[index]) or not np.all(
+                np.isfinite(coupling)):
+            return np.nan
+        return self.residuals[index] + coupling.dot(moves[moved])
+
+
+    def _done(self, index):
+        return (self._fresh[index]
+                and abs(self.residuals[index]) < self.tolerances[index])
+
+
+    @property
+    def converged(self):
+        """
+        Whether every detector was within tolerance after the last move
+        """
+        return all(self._done(index) for index in range(len(self.tolerances)))
+
+
+    def next_index(self, current=None):
+        """
+        Choose the next detector to visit
+
+        Parameters
+        ----------
+        current : int, optional
+            Detector that is already inserted, preferred for verification
+
+        Returns
+        -------
+        index : int or None
+            None once the walk has converged
+        """
+        remaining = [index for index in range(len(self.tolerances))
+                     if not self._done(index)]
+        if not remaining:
+            return None
+        #Distance in units of tolerance, unknown predictions are visited
+        distance = dict()
+        for index in remaining:
+            dist = abs(self.predicted(index)) / self.tolerances[index]
+            distance[index] = dist if np.isfinite(dist) else np.inf
+        walks = [index for index in remaining
+                 if distance[index] > self.margin]
+        if walks:
+            choice = max(walks, key=lambda index: (distance[index], -index))
+            #Detectors a fixed order would have verified first
+            passed = set(index for index in remaining
+                         if index < choice and index not in walks)
+            self.postponed += len(passed - self._passed)
+            self._passed |= passed
+            return choice
+        #Only verification is left, avoid moving the imagers if possible
+        if current in remaining:
+            return current
+        return remaining[0]
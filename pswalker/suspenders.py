@@ -18,6 +18,9 @@ from .path import get_path, _controller
 
 logger = logging.getLogger(__name__)
 
+#LCLS beam rate in Hz
+BEAM_RATE_PV = "EVNT:SYS0:1:LCLSBEAMRATE"
+
 
 class AvgSignal(Signal):
     """
@@ -112,7 +115,7 @@ class BeamRateSuspendFloor(PvSuspendFloor):
     """
     def __init__(self, suspend_thresh, resume_thresh=None, sleep=5.0,
                  pre_plan=None, post_plan=None, **kwargs):
-        super().__init__("EVNT:SYS0:1:LCLSBEAMRATE", suspend_thresh,
+        super().__init__(BEAM_RATE_PV, suspend_thresh,
                          resume_thresh=resume_thresh, sleep=sleep,
                          pre_plan=pre_plan, post_plan=post_plan, **kwargs)
 
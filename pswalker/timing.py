@@ -0,0 +1,310 @@
+"""
+Timing of the phases of an alignment and planning against a deadline
+"""
+############
+# Standard #
+############
+import os
+import time
+import logging
+from contextlib import contextmanager
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+from .buffers import RunningStats
+from .utils.fileutils import dump_json
+
+logger = logging.getLogger(__name__)
+
+
+class PhaseTimer:
+    """
+    Accumulate the wall time spent in each phase of an alignment
+
+    Because the timed section may be a ``yield from`` of a plan, the time
+    includes the execution of every message by the RunEngine, e.g the motion
+    of the devices. Phases may be nested, the time of a mirror ``walk``
+    includes the ``measure``, ``fit`` and ``motion`` within it. The phases
+    recorded by :func:`.iterwalk` are:
+
+    ========== ===============================================================
+    imager     Insertion of the imagers, :func:`.prep_img_motors`
+    measure    Acquisition of the shots of a measurement
+    reject     Each shot dropped by the filters, repeated or not aligned
+    fit        Update of a model with the readings of a step
+    motion     Move of a mirror during a walk
+    walk       Walk of a mirror to its target, :func:`.walk_to_pixel`
+    recovery   Recovery from a failed measurement or walk
+    suspended  Time the RunEngine was suspended, recorded by :class:`.Watcher`
+    ========== ===============================================================
+
+    Example
+    -------
+    .. code::
+
+        timer = PhaseTimer()
+        with timer.phase('imager'):
+            ok = yield from prep_img_motors(0, detectors)
+        timer.mean('imager')
+    """
+    #Keys of the report of each phase
+    report_keys = ('count', 'total', 'mean', 'std', 'min', 'max')
+
+    def __init__(self):
+        self.reset()
+
+
+    def reset(self):
+        """
+        Forget every recorded duration
+        """
+        self.phases = dict()
+        self.events = list()
+        self.start  = time.time()
+
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Time the enclosed code as a single event of a phase
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.record(name, time.time() - start)
+
+
+    def record(self, name, duration):
+        """
+        Add a single event to a phase
+
+        Parameters
+        ----------
+        name : str
+            Name of the phase
+
+        duration : float
+            Time taken in seconds
+        """
+        self.phases.setdefault(name, RunningStats()).update(duration)
+        self.events.append((name, time.time() - duration - self.start,
+                            duration))
+
+
+    def count(self, name):
+        """
+        Number of events of a phase
+        """
+        return self.phases[name].count if name in self.phases else 0
+
+
+    def mean(self, name):
+        """
+        Average duration of an event of a phase, NaN if none were recorded
+        """
+        return self.phases[name].mean if name in self.phases else np.nan
+
+
+    def total(self, name):
+        """
+        Time spent in a phase
+        """
+        if name not in self.phases:
+            return 0.
+        return self.phases[name].mean * self.phases[name].count
+
+
+    @property
+    def elapsed(self):
+        """
+        Time since the timer was reset
+        """
+        return time.time() - self.start
+
+
+    def report(self, events=True):
+        """
+        Machine readable summary of every phase
+
+        Parameters
+        ----------
+        events : bool, optional
+            Include the start, relative to the reset of the timer, and
+            duration of each recorded event
+
+        Returns
+        -------
+        report : dict
+            The ``elapsed`` time and, for each phase, the ``count``,
+            ``total``, ``mean``, ``std``, ``min`` and ``max`` of the
+            durations in seconds
+        """
+        phases = dict()
+        for name, stats in self.phases.items():
+            durations = [duration for (phase, start, duration) in self.events
+                         if phase == name]
+            phases[name] = dict(zip(self.report_keys,
+                                    (stats.count, self.total(name),
+                                     stats.mean, stats.std,
+                                     min(durations, default=np.nan),
+                                     max(durations, default=np.nan))))
+        report = {'start' : self.start, 'elapsed' : self.elapsed,
+                  'phases' : phases}
+        if events:
+            report['events'] = [{'phase' : phase, 'start' : start,
+                                 'duration' : duration}
+                                for (phase, start, duration) in self.events]
+        return report
+
+
+    def save(self, path, events=True):
+        """
+        Write the :meth:`.report` to a JSON file
+
+        Parameters
+        ----------
+        path : str
+            Location of the file
+
+        events : bool, optional
+            Include each recorded event
+        """
+        dump_json(os.path.expanduser(path), self.report(events=events))
+        logger.debug("Saved timing report to %s", path)
+
+
+class DeadlinePlanner:
+    """
+    Budget the rest of an alignment against a deadline
+
+    The remaining cost of an alignment is projected from the measured
+    durations of inserting an imager, taking a measurement and walking a
+    mirror. When the projection exceeds the time left, the planner returns a
+    ``factor`` below one that is used to reduce the number of shots averaged
+    and loosen the adaptive tolerances of the remaining walks. Once the
+    deadline passes, the walk should finish with the alignment it has.
+
+    Parameters
+    ----------
+    budget : float
+        Seconds available for the alignment from ``start``
+
+    timer : :class:`.PhaseTimer`, optional
+        Durations of the phases. A new timer is created by default
+
+    min_factor : float, optional
+        Smallest fraction of the requested effort to use
+
+    start : float, optional
+        Time the budget starts from, by default now
+
+    Attributes
+    ----------
+    eta : float
+        Projected time of completion, NaN until a projection is made
+    """
+    #Phases of an alignment used for the projection
+    imager  = 'imager'
+    measure = 'measure'
+    walk    = 'walk'
+
+    def __init__(self, budget, timer=None, min_factor=0.1, start=None):
+        self.budget     = budget
+        self.timer      = timer or PhaseTimer()
+        self.min_factor = min_factor
+        self.reset(start=start)
+
+
+    def reset(self, start=None):
+        """
+        Start the budget over
+        """
+        self.end       = (start or time.time()) + self.budget
+        self.factor    = 1.
+        self.projected = np.nan
+        self.eta       = np.nan
+
+
+    @property
+    def remaining(self):
+        """
+        Seconds left before the deadline
+        """
+        return self.end - time.time()
+
+
+    @property
+    def expired(self):
+        """
+        Whether the deadline has passed
+        """
+        return self.remaining <= 0
+
+
+    def _mean(self, name):
+        mean = self.timer.mean(name)
+        return mean if np.isfinite(mean) else 0.
+
+
+    def update(self, visits, walks):
+        """
+        Project the cost of the remaining alignment
+
+        Parameters
+        ----------
+        visits : int
+            Number of detector insertions and measurements left
+
+        walks : int
+            Number of mirror walks left
+
+        Returns
+        -------
+        factor : float
+            Fraction of the requested effort that fits in the time left
+        """
+        self.projected = (visits * (self._mean(self.imager)
+                                    + self._mean(self.measure))
+                          + walks * self._mean(self.walk))
+        self.eta = time.time() + self.projected
+        if self.projected > 0 and self.projected > self.remaining:
+            self.factor = float(np.clip(self.remaining / self.projected,
+                                        self.min_factor, 1.))
+        else:
+            self.factor = 1.
+        logger.debug("Projected %.1fs for %s visits and %s walks with %.1fs "
+                     "left, using %.2f of the requested effort",
+                     self.projected, visits, walks, self.remaining,
+                     self.factor)
+        return self.factor
+
+
+    def average(self, average):
+        """
+        Number of shots to average within the budget
+        """
+        if not average:
+            return average
+        return max(int(round(average * self.factor)), 1)
+
+
+    def tol_scaling(self, tol_scaling):
+        """
+        Adaptive tolerance scaling within the budget. A smaller scaling
+        accepts a larger distance from the goal for the early walks
+        """
+        if tol_scaling is None:
+            return None
+        return max(tol_scaling * self.factor, 1.)
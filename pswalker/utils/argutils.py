@@ -97,6 +97,35 @@ def field_prepend(field, obj):
     return field
 
 
+def find_signal(obj, field):
+    """
+    Find the Ophyd signal that reports a field in the event stream
+
+    Parameters
+    ----------
+    obj : object
+        Signal or Device to search
+
+    field : str
+        Full event key of the field, e.g the output of :func:`.field_prepend`
+
+    Returns
+    -------
+    signal : ophyd.Signal or None
+        Signal whose name matches the field, None if it can not be found
+    """
+    if isinstance(obj, Signal):
+        return obj if obj.name == field else None
+    #Only search the components whose name prefixes the field
+    for attr in getattr(obj, 'component_names', []):
+        child = getattr(obj, attr)
+        if field.startswith(getattr(child, 'name', '')):
+            signal = find_signal(child, field)
+            if signal is not None:
+                return signal
+    return None
+
+
 def isiterable(obj):
     """
     Function that determines if an object is an iterable, not including 
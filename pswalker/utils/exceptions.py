@@ -86,3 +86,7 @@ class MeasureException(PSWalkerException):
 class FilterCountError(MeasureException):
     """Exception to be raised when too many events are filtered."""
     pass
+
+class BeamLostError(FilterCountError):
+    """Exception to be raised when the beam is no longer on the detector."""
+    pass
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+import os
+import tempfile
+
+import simplejson as sjson
+
+
+def dump_json(path, contents):
+    """
+    Write JSON to disk, replacing the file atomically so that a concurrent
+    reader never sees a partial write. NaN is written as null
+
+    Parameters
+    ----------
+    path : str
+        Location of the file. Missing directories are created
+
+    contents : dict
+        Values to serialize
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            sjson.dump(contents, f, indent=2, ignore_nan=True)
+        os.replace(tmp, path)
+    except Exception:
+        os.remove(tmp)
+        raise
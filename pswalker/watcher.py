@@ -15,6 +15,8 @@ from bluesky.callbacks import CallbackBase
 ##########
 # Module #
 ##########
+from .callbacks import ShotPageFilter
+
 logger = logging.getLogger(__name__)
 
 
@@ -22,10 +24,11 @@ logger = logging.getLogger(__name__)
 RunSummary = namedtuple('RunSummary', ['successful', 'mirrors', 'pixels',
                                        'elapsed', 'reason', 'suspension_count',
                                        'suspended', 'tolerance', 'averaging',
-                                       'moves', 'cycles', 'table', 'detectors'])
+                                       'moves', 'cycles', 'table', 'detectors',
+                                       'timing'])
 
 
-class Watcher(CallbackBase):
+class Watcher(ShotPageFilter, CallbackBase):
     """
     The Watcher for the Skywalker run
 
@@ -44,15 +47,25 @@ class Watcher(CallbackBase):
     report_hook : callable, optional
         Send the final report to another process, this will be done
         automatically at the end of a run
+
+    timer : :class:`.PhaseTimer`, optional
+        Timer given to :func:`.skywalker`. It is reset at the start of each
+        run and the time spent suspended is added to it. The time spent in
+        each phase of the alignment is included in the report and the machine
+        readable :meth:`.PhaseTimer.report` is kept as the ``timing`` of the
+        :attr:`.summary`
     """
-    def __init__(self, msg_hook=None, report_hook=None):
+    def __init__(self, msg_hook=None, report_hook=None, timer=None):
+        super().__init__()
         #Hooks for displaying information
         self.msg_hook    = msg_hook
         self.report_hook = report_hook or print
+        self.timer       = timer
         #Store run parameters
         self.summary         = dict.fromkeys(RunSummary._fields, '')
         #Change default from str to int
         self.summary['suspension_count'] = 0
+        self.summary['suspended']        = 0.
         self.summary['moves']            = 0
         self.last_known      = dict()
         self.msgs            = list()
@@ -72,6 +85,8 @@ class Watcher(CallbackBase):
         self.mot_fields = doc.get('plan_args', {}).get('mot_fields')
         self.det_fields = doc.get('plan_args', {}).get('det_fields')
         self.summary['elapsed'] = doc['time']
+        if self.timer is not None:
+            self.timer.reset()
         super().start(doc)
 
 
@@ -80,6 +95,9 @@ class Watcher(CallbackBase):
         Parse event documents for information on suspensions and measured
         values
         """
+        #Pages of shots are summarized in the primary stream
+        if self.is_shot_page(doc):
+            return
         for key, value in doc['data'].items():
             if key == 'interruption':
                 #Keep track of suspensions
@@ -90,6 +108,9 @@ class Watcher(CallbackBase):
                 elif value == 'resume':
                     self.summary['suspended']+= (doc['time']
                                                  - self.last_suspension)
+                    if self.timer is not None:
+                        self.timer.record('suspended',
+                                          doc['time'] - self.last_suspension)
             #Update device state caches
             elif (value and any([field in key
                                  for group in [self.mot_fields,
@@ -131,6 +152,10 @@ class Watcher(CallbackBase):
 
         self.summary['table'] = pt
 
+        #Time spent in each phase
+        if self.timer is not None:
+            self.summary['timing'] = self.timer.report(events=False)
+
         #Report the run summary
         super().stop(doc)
 
@@ -156,12 +181,35 @@ class Watcher(CallbackBase):
         report = textwrap.fill(dedented, width=width)
         #Assemble full report
         report = '\n'.join(['',report,'',str(self.summary['table'])])
+        if self.summary['timing']:
+            report = '\n'.join([report, '', str(self.timing_table())])
         #Send report to optional hook
         if self.report_hook:
             self.report_hook(report)
         return report
 
 
+    def timing_table(self):
+        """
+        Table of the time spent in each phase of the last run
+
+        Returns
+        -------
+        table : prettytable.PrettyTable
+        """
+        pt = PrettyTable(['Phase', 'Count', 'Total (s)', 'Mean (s)',
+                          'Max (s)'])
+        pt.align = 'r'
+        pt.align['Phase'] = 'l'
+        pt.float_format = '8.3'
+        phases = (self.summary['timing'] or dict()).get('phases', dict())
+        for name, phase in sorted(phases.items(),
+                                  key=lambda item: -item[1]['total']):
+            pt.add_row([name, phase['count'], phase['total'], phase['mean'],
+                        phase['max']])
+        return pt
+
+
     def __call__(self, *args):
         if len(args) > 1:
             super().__call__(*args)
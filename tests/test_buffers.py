@@ -0,0 +1,157 @@
+############
+# Standard #
+############
+import logging
+
+###############
+# Third Party #
+###############
+import pytest
+import numpy as np
+
+##########
+# Module #
+##########
+from pswalker.buffers import (ShotBuffer, ShotStats, RingBuffer, RunningStats,
+                              PrecisionStop, RunningRegression,
+                              AveragingSchedule)
+
+logger = logging.getLogger(__name__)
+
+
+def test_shot_buffer_stats():
+    buf = ShotBuffer(capacity=2)
+    for i in range(5):
+        buf.append({'a': float(i), 'b': 2*i, 'name': 'shot{}'.format(i)})
+    # Buffer grows past the initial capacity
+    assert len(buf) == 5
+    assert buf.capacity >= 5
+    stats = buf.stats()
+    assert isinstance(stats['a'], ShotStats)
+    assert stats['a'].mean == 2.0
+    assert stats['a'].median == 2.0
+    assert stats['a'].min == 0.0
+    assert stats['a'].max == 4.0
+    assert stats['a'].count == 5
+    assert np.isclose(stats['a'].std, np.std(range(5), ddof=1))
+    assert np.isclose(stats['a'].sem, np.std(range(5), ddof=1)/np.sqrt(5))
+    assert stats['b'].mean == 4.0
+    # Strings fall back to the last value
+    assert stats['name'] == 'shot4'
+    assert buf.mean() == {'a': 2.0, 'b': 4.0, 'name': 'shot4'}
+
+
+def test_shot_buffer_missing_fields():
+    buf = ShotBuffer(capacity=4)
+    buf.append({'a': 1.0})
+    buf.append({'a': 3.0, 'b': 5.0})
+    stats = buf.stats()
+    assert stats['a'].mean == 2.0
+    assert stats['b'].mean == 5.0
+    assert stats['b'].count == 1
+    assert np.isnan(buf.column('b')[0])
+    buf.clear()
+    assert len(buf) == 0
+    assert buf.stats() == {}
+
+
+def test_running_stats():
+    values = np.random.normal(10, 2, 100)
+    rs = RunningStats()
+    assert np.isnan(rs.sem)
+    for val in values:
+        rs.update(val)
+    # NaN is ignored
+    rs.update(np.nan)
+    assert rs.count == 100
+    assert np.isclose(rs.mean, np.mean(values))
+    assert np.isclose(rs.std, np.std(values, ddof=1))
+    assert np.isclose(rs.sem, np.std(values, ddof=1)/10)
+
+
+def test_precision_stop():
+    # Far outside of tolerance settles after the minimum number of shots
+    stop = PrecisionStop('a', min_num=3, goal=0, tolerance=10)
+    assert not stop.update({'a': 300.})
+    assert not stop.update({'a': 301.})
+    assert stop.update({'a': 299.})
+    # Noisy data straddling the tolerance never settles
+    stop.clear()
+    assert not any(stop.update({'a': val}) for val in [0., 20.] * 10)
+    # Target standard error
+    stop = PrecisionStop('a', min_num=2, target_sem=0.5)
+    assert not stop.update({'a': 1.})
+    assert stop.update({'a': 1.})
+    # Missing keys are ignored
+    assert not PrecisionStop('a', target_sem=1).update({'b': 1})
+    with pytest.raises(ValueError):
+        PrecisionStop('a', goal=0)
+
+
+def test_averaging_schedule():
+    schedule = AveragingSchedule(min_average=5, max_average=100)
+    # Probe with the fewest shots, no noise known
+    assert schedule.num() == 5
+    assert schedule.num(300, 10) == 100
+    schedule.update(2., 5)
+    schedule.update(np.nan, 5)
+    assert schedule.noise == 2.
+    # Far away and safely inside take few shots, the edge takes many
+    assert schedule.num(300, 10) == 5
+    assert schedule.num(0, 10) == 5
+    assert schedule.num(11, 10) == 16
+    assert schedule.num(10, 10) == 100
+    schedule.reset()
+    assert np.isnan(schedule.noise)
+
+
+def test_ring_buffer():
+    buf = RingBuffer(3)
+    for i in range(5):
+        buf.append({'a': float(i)}, timestamp=i)
+    # Only the most recent shots are kept
+    assert buf.full
+    assert buf.total == 5
+    assert buf.timestamps.tolist() == [2, 3, 4]
+    assert buf.stats()['a'].mean == 3.0
+    # Overwritten columns do not keep stale values
+    buf.append({'b': 1.0}, timestamp=5)
+    assert buf.stats()['a'].count == 2
+    buf.clear()
+    assert len(buf) == 0
+
+
+def test_running_regression():
+    rng = np.random.RandomState(0)
+    x = 1000. + np.linspace(-1, 1, 30)
+    y = 5*x + 2 + rng.normal(scale=0.1, size=30)
+    reg = RunningRegression()
+    for xi, yi in zip(x, y):
+        reg.update(xi, yi)
+    # Matches a full least-squares fit
+    (slope, intercept), cov = np.polyfit(x, y, 1, cov='unscaled')
+    resid = np.sum((y - slope*x - intercept)**2) / (len(x) - 2)
+    assert np.isclose(reg.slope, slope)
+    assert np.isclose(reg.intercept, intercept)
+    assert np.isclose(reg.slope_err, np.sqrt(resid*cov[0, 0]))
+    assert np.isclose(reg.intercept_err, np.sqrt(resid*cov[1, 1]))
+    # Sliding window only fits the latest points
+    reg = RunningRegression(window=10)
+    for xi, yi in zip(x, y):
+        reg.update(xi, yi)
+    assert reg.count == 10
+    assert np.isclose(reg.slope, np.polyfit(x[-10:], y[-10:], 1)[0])
+    # Forgetting factor is a weighted fit
+    reg = RunningRegression(forgetting=0.9)
+    for xi, yi in zip(x, y):
+        reg.update(xi, yi)
+    weights = np.sqrt(0.9**np.arange(29, -1, -1))
+    assert np.isclose(reg.slope, np.polyfit(x, y, 1, w=weights)[0])
+    # A single x position is not enough
+    reg = RunningRegression()
+    reg.update(1, 2)
+    reg.update(1, 3)
+    assert not reg.solvable
+    assert np.isnan(reg.slope)
+    with pytest.raises(ValueError):
+        RunningRegression(window=5, forgetting=0.5)
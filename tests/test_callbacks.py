@@ -1,5 +1,6 @@
 import logging
 
+import pytest
 import numpy as np
 import pandas as pd
 from ophyd.sim import SynSignal, SynAxis
@@ -7,7 +8,9 @@ from bluesky import RunEngine
 from bluesky.plans import outer_product_scan, scan
 
 from pswalker.callbacks import (rank_models, apply_filters, LinearFit,
-                                MultiPitchFit)
+                                MultiPitchFit, FilterSet, BeamPresence,
+                                IncrementalLinearFit, LinearResponseFit,
+                                ModelRanker)
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +41,65 @@ def test_linear_fit():
     assert np.allclose(cb.backsolve(52)['x'], 10, atol=1e-5)
 
 
+def test_incremental_linear_fit():
+    RE = RunEngine()
+    motor = SynAxis(name='motor')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5*motor.read()['motor']['value'] + 2)
+
+    cb = IncrementalLinearFit('centroid', 'motor')
+    RE(scan([det], motor, -1, 1, 50), cb)
+
+    # Closed-form result matches lmfit
+    full = cb.lmfit_result()
+    for k, v in {'slope': 5, 'intercept': 2}.items():
+        assert np.allclose(cb.result.values[k], v, atol=1e-6)
+        assert np.allclose(full.values[k], v, atol=1e-6)
+    assert np.allclose(cb.eval(x=10), 52, atol=1e-5)
+    assert np.allclose(cb.eval(motor=0), 2, atol=1e-5)
+    assert np.allclose(cb.backsolve(52)['x'], 10, atol=1e-5)
+    assert not cb.stale
+
+    # Fit once the run stops
+    cb = IncrementalLinearFit('centroid', 'motor', update_every=None)
+    RE(scan([det], motor, -1, 1, 5), cb)
+    assert not cb.stale
+    assert np.allclose(cb.result.values['slope'], 5, atol=1e-6)
+
+
+def test_linear_fit_flush():
+    RE = RunEngine()
+    motor = SynAxis(name='motor')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5*motor.read()['motor']['value'] + 2)
+
+    # Events are held until flushed
+    cb = LinearFit('centroid', 'motor', average=None)
+    RE(scan([det], motor, -1, 1, 5), cb)
+    assert len(cb.ydata) == 0
+    cb.flush()
+    assert len(cb.ydata) == 1
+    assert np.isclose(cb.ydata[0], 2)
+    # Nothing cached, nothing added
+    cb.flush()
+    assert len(cb.ydata) == 1
+
+
+def test_linear_fit_other_events():
+    RE = RunEngine()
+    motor = SynAxis(name='motor')
+    other = SynAxis(name='other')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5*motor.read()['motor']['value'] + 2)
+
+    # Events without the fields of the model are ignored
+    cb = LinearFit('centroid', 'motor', average=None)
+    RE(scan([], other, -1, 1, 5), cb)
+    RE(scan([det], motor, -1, 1, 5), cb)
+    cb.flush()
+    assert len(cb.ydata) == 1
+
+
 def test_multi_fit():
     RE = RunEngine()
 
@@ -68,6 +130,42 @@ def test_multi_fit():
     assert np.allclose(cb.backsolve(55, a0=5)['a1'], 10, atol=1e-5)
 
 
+def test_linear_response_fit():
+    RE = RunEngine()
+
+    m1 = SynAxis(name='m1')
+    m2 = SynAxis(name='m2')
+    m3 = SynAxis(name='m3')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5
+                         + 4*m1.read()['m1']['value']
+                         + 3*m2.read()['m2']['value']
+                         - 2*m3.read()['m3']['value'])
+
+    cb = LinearResponseFit('centroid', ['m1', 'm2', 'm3'])
+    # lmfit sees the inputs and gains of the generated function
+    assert cb.model.independent_vars == ['a0', 'a1', 'a2']
+    assert set(cb.model.param_names) == {'x0', 'x1', 'x2', 'x3'}
+    RE(outer_product_scan([det], m1, -1, 1, 4, m2, -1, 1, 4, False,
+                          m3, -1, 1, 4, False), cb)
+
+    expected = {'x0': 5, 'x1': 4, 'x2': 3, 'x3': -2}
+    for k, v in expected.items():
+        assert np.allclose(cb.result.values[k], v, atol=1e-6)
+    assert not cb.stale
+
+    # Batches of configurations
+    assert np.allclose(cb.eval_batch([[0, 0, 0], [1, 1, 1]]), [5, 10])
+    assert np.allclose(cb.eval(m1=[0, 1], m2=1, a2=1), [6, 10])
+    # Fix any subset of the inputs
+    assert np.allclose(cb.backsolve(10, a0=1, a1=1)['a2'], 1)
+    sol = cb.backsolve(10, m1=1, start={'m2': 1, 'm3': 1})
+    assert set(sol) == {'a1', 'a2'}
+    assert np.allclose(cb.eval(a0=1, **sol), 10)
+    with pytest.raises(ValueError):
+        cb.backsolve(10, a0=1, a1=1, a2=1)
+
+
 def test_apply_filters_handles_all_data_types():
     mock_doc = {"str": "string",  "int": 0, "float": 3.14159, "bool": True,
                 "ndarray": np.arange(10), "list": list(range(10)),
@@ -123,6 +221,69 @@ def test_apply_filters_correctness():
                          drop_missing=False)
 
 
+def test_filter_set_rejections():
+    fs = FilterSet({'a': lambda x: x > 0, 'b': lambda x: x < 10})
+    assert fs({'a': 1, 'b': 2})
+    # Short-circuits on the first rejection
+    assert not fs({'a': -1, 'b': 20})
+    assert not fs({'a': 1, 'b': 20})
+    assert not fs({'a': np.nan, 'b': 2})
+    assert not fs({'b': 2})
+    assert fs.rejections == {'a': 3, 'b': 1}
+    fs.reset()
+    assert fs.rejections == {'a': 0, 'b': 0}
+    fs.update({'c': lambda x: x != 0})
+    assert not fs({'a': 1, 'b': 2, 'c': 0})
+    assert fs.rejections == {'a': 0, 'b': 0, 'c': 1}
+    # Missing data is allowed through if requested
+    assert FilterSet({'c': lambda x: False}, drop_missing=False)({'a': 1})
+
+
+def test_filter_set_batch():
+    fs = FilterSet({'a': lambda x: x > 0,
+                    'b': lambda x: 4 < x < 6,
+                    's': lambda x: x != 'bad'})
+    columns = {'a': np.array([1., -1., np.nan, 2., np.inf, 3.]),
+               'b': np.array([5., 5., 5., 7., 5., 5.]),
+               's': ['ok', 'ok', 'ok', 'ok', 'ok', 'bad']}
+    mask = fs.batch(columns)
+    assert mask.tolist() == [True, False, False, False, False, False]
+    # Matches evaluating a single shot at a time
+    shots = [dict((k, v[i]) for k, v in columns.items()) for i in range(6)]
+    assert mask.tolist() == [apply_filters(shot, fs.filters)
+                             for shot in shots]
+    assert fs.rejections == {'a': 3, 'b': 1, 's': 1}
+    # Missing keys
+    assert not FilterSet({'c': lambda x: True}).batch(columns).any()
+    assert FilterSet({'c': lambda x: True},
+                     drop_missing=False).batch(columns).all()
+
+
+
+def test_beam_presence():
+    beam = BeamPresence(centroid='c', intensity='i', threshold=5.,
+                        max_missing=3, min_shots=None)
+    assert beam.update({'c': 200, 'i': 10}, True) is None
+    # Consecutive shots without beam
+    assert beam.update({'c': 0, 'i': 10}, False) is None
+    assert beam.update({'c': 200, 'i': 1}, False) is None
+    assert beam.update({'c': np.nan, 'i': 10}, False)
+    # A single good shot resets the count
+    beam.reset()
+    for shot in ({'c': 0}, {'c': 0}, {'c': 100}, {'c': 0}):
+        assert beam.update(shot, True) is None
+    # Arrays show beam if any element does
+    assert beam.has_beam({'c': np.array([0., 120.]), 'i': np.array([1., 6.])})
+    assert not beam.has_beam({'c': np.zeros(2), 'i': np.array([1., 6.])})
+    assert not beam.has_beam({'c': np.ones(2), 'i': np.ones(2)})
+    # Projected pass rate exceeds the remaining budget
+    beam = BeamPresence(centroid='c', min_shots=4)
+    for passed in (True, False, False):
+        assert beam.update({'c': 100}, passed, remaining=9, budget=50) is None
+    assert beam.update({'c': 100}, False, remaining=9, budget=20)
+    with pytest.raises(ValueError):
+        BeamPresence(intensity='i')
+
 def test_rank_models():
     RE = RunEngine()
 
@@ -153,3 +314,55 @@ def test_rank_models():
     assert ranking[0] == fit1
     assert ranking[1] == fit3
     assert ranking[2] == fit2
+
+
+def test_model_ranker():
+    RE = RunEngine()
+    motor = SynAxis(name='motor')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5*motor.read()['motor']['value'] + 2)
+    fits = [LinearFit('centroid', 'motor', name='Linear'),
+            IncrementalLinearFit('centroid', 'motor', name='Incremental'),
+            MultiPitchFit('centroid', ('motor', 'other'))]
+    RE(scan([det], motor, -1, 1, 10), fits[:2])
+
+    ranker = ModelRanker(fits)
+    ranking = ranker.rank(target=23, motor=4)
+    # Model without a fit is excluded
+    assert set(r.model for r in ranking) == set(fits[:2])
+    assert np.allclose([r.estimate for r in ranking], 22)
+    assert np.allclose([r.residual for r in ranking], -1)
+    assert ranker.misses == 2
+    # Same fit and inputs reuse the cached prediction
+    ranker.rank(target=22, motor=4)
+    assert ranker.hits == 2
+    # New input or an updated fit is evaluated again
+    ranker.rank(target=22, motor=5)
+    assert ranker.misses == 4
+    RE(scan([det], motor, -1, 1, 10), fits[0])
+    ranker.rank(target=22, motor=5)
+    assert ranker.hits == 3
+    assert ranker.misses == 5
+
+
+def test_model_ranker_uncertainty():
+    RE = RunEngine()
+    motor = SynAxis(name='motor')
+    noise = iter(np.random.RandomState(0).normal(scale=0.5, size=100))
+    det = SynSignal(name='centroid',
+                    func=lambda: (5*motor.read()['motor']['value'] + 2
+                                  + next(noise)))
+    fits = [LinearFit('centroid', 'motor', name='Linear'),
+            IncrementalLinearFit('centroid', 'motor', name='Incremental')]
+    # Points far from the origin correlate the slope and intercept
+    RE(scan([det], motor, 1, 3, 20), fits)
+
+    x = np.asarray(fits[0].independent_vars_data['x'], dtype=float)
+    y = np.asarray(fits[0].ydata, dtype=float)
+    (slope, intercept), cov = np.polyfit(x, y, 1, cov=True)
+    for target in (-1, 2, 4):
+        vec = np.array([target, 1.])
+        expected = np.sqrt(vec.dot(cov).dot(vec))
+        for fit, (est, unc) in ModelRanker(fits).predict(motor=target).items():
+            assert np.isclose(est, slope*target + intercept, rtol=1e-6)
+            assert np.isclose(unc, expected, rtol=1e-4)
@@ -0,0 +1,70 @@
+############
+# Standard #
+############
+import logging
+
+###############
+# Third Party #
+###############
+import pytest
+import numpy as np
+
+##########
+# Module #
+##########
+from pswalker.eventbuilder import EventBuilder
+
+logger = logging.getLogger(__name__)
+
+
+def reading(**kwargs):
+    return dict((key, {'value': val, 'timestamp': ts})
+                for key, (val, ts) in kwargs.items())
+
+
+def test_event_builder_timestamps():
+    builder = EventBuilder('yag', keys=['yag2'], tolerance=0.01)
+    # Aligned shot, unchecked keys pass through
+    shot = builder.build(reading(yag=(1., 10.), yag2=(2., 10.005),
+                                 motor=(3., 0.)))
+    assert shot == {'yag': 1., 'yag2': 2., 'motor': 3.}
+    # Straggler is dropped
+    assert builder.build(reading(yag=(1., 11.), yag2=(2., 10.005))) is None
+    # Missing reference is dropped
+    assert builder.build(reading(yag2=(2., 12.))) is None
+    stats = builder.stats
+    assert stats['shots'] == 3
+    assert stats['aligned'] == 1
+    assert stats['dropped'] == 2
+    assert np.isclose(stats['max_skew'], 0.005)
+    builder.reset()
+    assert builder.stats['shots'] == 0
+
+
+def test_event_builder_interpolate():
+    builder = EventBuilder('yag', tolerance=0.01, interpolate=['mot'])
+    # No previous reading to interpolate from
+    assert builder.build(reading(yag=(1., 0.), mot=(0., 1.))) is None
+    # Motor updated after the pulse, interpolate back to the reference
+    shot = builder.build(reading(yag=(1., 1.5), mot=(10., 2.)))
+    assert np.isclose(shot['mot'], 5.)
+    assert builder.stats['interpolated'] == 1
+
+
+def test_event_builder_counters():
+    with pytest.raises(ValueError):
+        EventBuilder('yag', counters={'yag2': 'yag2_counter'})
+    builder = EventBuilder('yag', counters={'yag': 'yag_counter',
+                                            'yag2': 'yag2_counter'})
+    assert builder.build(reading(yag=(1., 0.), yag_counter=(1, 0.),
+                                 yag2=(2., 5.), yag2_counter=(7, 5.)))
+    # Both cameras advanced by one frame
+    assert builder.build(reading(yag=(1., 0.), yag_counter=(2, 0.),
+                                 yag2=(2., 5.), yag2_counter=(8, 5.)))
+    # Second camera missed a frame
+    assert builder.build(reading(yag=(1., 0.), yag_counter=(3, 0.),
+                                 yag2=(2., 5.), yag2_counter=(8, 5.))) is None
+    # Counter not read from the second camera
+    with pytest.raises(ValueError, match='yag2_counter of yag2'):
+        builder.build(reading(yag=(1., 0.), yag_counter=(4, 0.),
+                              yag2=(2., 5.)))
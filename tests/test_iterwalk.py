@@ -1,24 +1,61 @@
 ############
 # Standard #
 ############
+import json
 import logging
 ###############
 # Third Party #
 ###############
 import pytest
 import numpy as np
+from bluesky.plan_stubs import mv
 from bluesky.preprocessors import run_wrapper
 from ophyd.status import Status
 ##########
 # Module #
 ##########
 from pswalker.iterwalk import iterwalk
+from pswalker.store import ModelStore, WalkCheckpoint
+from pswalker.strategies import CouplingScheduler
+from pswalker.timing import DeadlinePlanner, PhaseTimer
 
 TOL = 5
 logger = logging.getLogger(__name__)
 
 tmo = 10
 
+CENTROID = 'detector_stats2_centroid_x'
+
+
+def pixels(yags, offsets=(100, -100)):
+    """
+    Goal pixels at an offset from the center of each imager
+    """
+    return [yag.size[0]/2 + offset for yag, offset in zip(yags, offsets)]
+
+
+def centroid(yag):
+    return yag.read()[yag.name + '_' + CENTROID]['value']
+
+
+@pytest.fixture(scope='function')
+def walk(lcls_two_bounce_system):
+    """
+    Build an iterwalk of both mirrors of the two bounce system, any option
+    can be overridden by keyword
+    """
+    s, m1, m2, y1, y2 = lcls_two_bounce_system
+
+    def plan(goal=None, **kwargs):
+        options = dict(starts=None, first_steps=1e-4, gradients=None,
+                       detector_fields=CENTROID, motor_fields='sim_alpha',
+                       tolerances=TOL, system=[m1, m2, y1, y2], averages=1,
+                       max_walks=5)
+        options.update(kwargs)
+        return run_wrapper(iterwalk([y1, y2], [m1, m2],
+                                    goal or pixels([y1, y2]), **options))
+    return plan
+
 
 @pytest.mark.timeout(tmo)
 @pytest.mark.parametrize("goal1", [-300, 0, 300])
@@ -29,7 +66,7 @@ tmo = 10
 @pytest.mark.parametrize("overshoot", [0])
 @pytest.mark.parametrize("max_walks", [5])
 @pytest.mark.parametrize("tol_scaling", [None,2])
-def test_iterwalk(RE, lcls_two_bounce_system,
+def test_iterwalk(RE, lcls_two_bounce_system, walk,
                   goal1, goal2, first_steps, gradients,
                   tolerances, overshoot, max_walks,tol_scaling):
     logger.debug("test_iterwalk with goal1=%s, goal2=%s, first_steps=%s, " +
@@ -37,29 +74,13 @@ def test_iterwalk(RE, lcls_two_bounce_system,
                  goal1, goal2, first_steps, gradients, tolerances, overshoot,
                  max_walks)
     s, m1, m2, y1, y2 = lcls_two_bounce_system
+    goal = pixels([y1, y2], (goal1, goal2))
 
-    goal1 += y1.size[0]/2
-    goal2 += y2.size[0]/2
-
-    goal = [goal1, goal2]
-
-    plan = run_wrapper(iterwalk([y1, y2], [m1, m2], goal, starts=None,
-                                first_steps=first_steps, gradients=gradients,
-                                detector_fields='detector_stats2_centroid_x',
-                                motor_fields='sim_alpha',
-                                tolerances=tolerances, system=[m1, m2, y1, y2],
-                                averages=1, overshoot=overshoot,
-                                max_walks=max_walks, timeout=None,
-                                tol_scaling=tol_scaling))
-    RE(plan)
-    assert np.isclose(
-        y1.read()[y1.name + '_detector_stats2_centroid_x']['value'],
-        goal[0],
-        atol=tolerances)
-    assert np.isclose(
-        y2.read()[y2.name + '_detector_stats2_centroid_x']['value'],
-        goal[1],
-        atol=tolerances)
+    RE(walk(goal, first_steps=first_steps, gradients=gradients,
+            tolerances=tolerances, overshoot=overshoot, max_walks=max_walks,
+            timeout=None, tol_scaling=tol_scaling))
+    assert np.isclose(centroid(y1), goal[0], atol=tolerances)
+    assert np.isclose(centroid(y2), goal[1], atol=tolerances)
 
     # Make sure we actually read all the groups as we went
     m1_reads = 0
@@ -84,15 +105,11 @@ def test_iterwalk(RE, lcls_two_bounce_system,
                    [m1_reads, m2_reads, y1_reads, y2_reads]))
 
 
-
 @pytest.mark.timeout(tmo)
-def test_iterwalk_raises_RuntimeError_on_motion_timeout(RE, lcls_two_bounce_system):
+def test_iterwalk_raises_RuntimeError_on_motion_timeout(RE, lcls_two_bounce_system, walk):
     logger.debug("test_iterwalk_raises_RuntimeError_on_motion_timeout")
     s, m1, m2, y1, y2 = lcls_two_bounce_system
-
-    # Center pixels of yag
-    center_pix = [y1.size[0]/2] * 2
-    goal = [p + 300 for p in center_pix]
+    goal = pixels([y1, y2], (300, 300))
 
     # Define a bad set command
     def bad_set(yag, cmd=None, **kwargs):
@@ -103,38 +120,23 @@ def test_iterwalk_raises_RuntimeError_on_motion_timeout(RE, lcls_two_bounce_syst
     # Patch yag set command
     y1.set = lambda cmd, **kwargs: bad_set(y1, cmd, **kwargs)
 
-    plan = run_wrapper(iterwalk([y1, y2], [m1, m2], goal, starts=None,
-                                first_steps=1, gradients=None,
-                                detector_fields='detector_stats2_centroid_x',
-                                motor_fields='sim_alpha',
-                                tolerances=TOL, system=None, averages=1,
-                                overshoot=0, max_walks=5, timeout=None))
     # Check a RunTimError is raised
     with pytest.raises(RuntimeError):
-        RE(plan)
+        RE(walk(goal, first_steps=1, system=None, overshoot=0, timeout=None))
 
-    # Reload system
-    s, m1, m2, y1, y2 = lcls_two_bounce_system        
     # Patch yag set command
     y2.set = lambda cmd, **kwargs: bad_set(y2, cmd, **kwargs)
 
-    plan = run_wrapper(iterwalk([y1, y2], [m1, m2], goal, starts=None,
-                                first_steps=1e-6, gradients=None,
-                                detector_fields='detector_stats2_centroid_x',
-                                motor_fields='sim_alpha',
-                                tolerances=TOL, system=None, averages=1,
-                                overshoot=0, max_walks=5, timeout=None))
     # Check a RunTimError is raised
     with pytest.raises(RuntimeError):
-        RE(plan)
-        
-def test_iterwalk_raises_RuntimeError_on_failed_walk_to_pixel(RE, lcls_two_bounce_system):
+        RE(walk(goal, first_steps=1e-6, system=None, overshoot=0,
+                timeout=None))
+
+
+def test_iterwalk_raises_RuntimeError_on_failed_walk_to_pixel(RE, lcls_two_bounce_system, walk):
     logger.debug("test_iterwalk_raises_RuntimeError_on_failed_walk_to_pixel")
     s, m1, m2, y1, y2 = lcls_two_bounce_system
-
-    # Center pixels of yag
-    center_pix = [y1.size[0]/2] * 2
-    goal = [p + 300 for p in center_pix]
+    goal = pixels([y1, y2], (300, 300))
 
     # Define a bad set command
     def bad_set(mirror, cmd=None, **kwargs):
@@ -153,7 +155,7 @@ def test_iterwalk_raises_RuntimeError_on_failed_walk_to_pixel(RE, lcls_two_bounc
         mirror.sim_z = kwargs.get('z', mirror.sim_z)
         mirror.sim_pitch = kwargs.get('pitch', mirror.sim_pitch)
         for motor in mirror.motors:
-            motor_params = motor.read()            
+            motor_params = motor.read()
             for key in kwargs.keys():
                 if key in motor_params:
                     # Add error term to sets
@@ -162,13 +164,149 @@ def test_iterwalk_raises_RuntimeError_on_failed_walk_to_pixel(RE, lcls_two_bounc
     # Patch yag set command
     m1.set = lambda cmd, **kwargs: bad_set(m1, cmd, **kwargs)
 
-    plan = run_wrapper(iterwalk([y1, y2], [m1, m2], goal, starts=None,
-                                first_steps=1e-6, gradients=None,
-                                detector_fields='sim_x',
-                                motor_fields='sim_alpha',
-                                tolerances=TOL, system=None, averages=1,
-                                overshoot=0, max_walks=5, timeout=None))
     # Check a RunTimError is raised
     with pytest.raises(RuntimeError):
-        RE(plan)        
-        
+        RE(walk(goal, first_steps=1e-6, detector_fields='sim_x',
+                system=None, overshoot=0, timeout=None))
+
+
+@pytest.mark.timeout(tmo)
+def test_iterwalk_model_store(RE, lcls_two_bounce_system, walk, tmpdir):
+    s, m1, m2, y1, y2 = lcls_two_bounce_system
+    store = ModelStore(str(tmpdir.join('models.json')))
+    fields = (m1.name + '_sim_alpha', y1.name + '_' + CENTROID)
+    RE(walk(model_store=store, energy=8.))
+    # Fits were remembered for each mirror that walked
+    record = store.lookup(m1.name, y1.name, *fields, energy=8.)
+    assert record is not None
+    assert ModelStore(store.path).lookup(m1.name, y1.name, *fields,
+                                         energy=8.) == record
+    # A stale intercept does not mislead the next walk, only the slope is
+    # taken from the store
+    store.record(m1.name, y1.name, *fields, record.slope,
+                 record.intercept + 1e4, energy=8.)
+    RE(mv(m1, m1.position + 1e-4))
+    RE(walk(model_store=store, energy=8.))
+    assert np.isclose(centroid(y1), pixels([y1, y2])[0], atol=TOL)
+
+
+@pytest.mark.timeout(tmo)
+@pytest.mark.parametrize("goal1", [-300, 300])
+@pytest.mark.parametrize("goal2", [-300, 300])
+@pytest.mark.parametrize("scheduled", [False, True])
+def test_iterwalk_converges(RE, lcls_two_bounce_system, walk,
+                            goal1, goal2, scheduled):
+    s, m1, m2, y1, y2 = lcls_two_bounce_system
+    goal = pixels([y1, y2], (goal1, goal2))
+    scheduler = CouplingScheduler([TOL, TOL]) if scheduled else None
+    RE(walk(goal, joint=not scheduled, scheduler=scheduler))
+    assert np.isclose(centroid(y1), goal[0], atol=TOL)
+    assert np.isclose(centroid(y2), goal[1], atol=TOL)
+    if scheduled:
+        # Converged only after verifying every detector since the last move
+        assert scheduler.converged
+    else:
+        # Both mirrors were moved together in a single group
+        groups = [msg.kwargs.get('group') for msg in RE.msg_hook.msgs
+                  if msg.command == 'set' and msg.obj in (m1, m2)]
+        assert any(groups.count(group) == 2 for group in groups if group)
+
+
+def test_iterwalk_joint_store(RE, lcls_two_bounce_system, walk, tmpdir):
+    s, m1, m2, y1, y2 = lcls_two_bounce_system
+    store = ModelStore(str(tmpdir.join('models.json')))
+    state = WalkCheckpoint(str(tmpdir.join('walk.json')))
+    timer = PhaseTimer()
+    RE(walk(joint=True, model_store=store, walk_checkpoint=state,
+            timer=timer))
+    # The learned sensitivities are recorded, except the structural zero
+    assert ModelStore(store.path).lookup(m1.name, y2.name,
+                                         m1.name + '_sim_alpha',
+                                         y2.name + '_' + CENTROID)
+    assert ModelStore(store.path).lookup(m2.name, y1.name,
+                                         m2.name + '_sim_alpha',
+                                         y1.name + '_' + CENTROID) is None
+    # A converged walk leaves nothing to resume
+    assert state.load(WalkCheckpoint.identity([y1, y2], [m1, m2],
+                                              pixels([y1, y2]),
+                                              joint=True)) is None
+    assert timer.count('imager') and timer.count('measure')
+    # No mirror is probed on its own, every move is a joint step
+    groups = [msg.kwargs.get('group') for msg in RE.msg_hook.msgs
+              if msg.command == 'set' and msg.obj in (m1, m2)]
+    assert all(groups.count(group) == 2 for group in groups)
+
+
+def test_iterwalk_resume(RE, lcls_two_bounce_system, walk, tmpdir):
+    s, m1, m2, y1, y2 = lcls_two_bounce_system
+    state = WalkCheckpoint(str(tmpdir.join('walk.json')))
+    identity = WalkCheckpoint.identity([y1, y2], [m1, m2], pixels([y1, y2]))
+    # Time out as soon as the walk starts
+    with pytest.raises(Exception):
+        RE(walk(walk_checkpoint=state, timeout=0))
+    saved = state.load(identity)
+    assert saved
+    # A mirror moved since the checkpoint is returned to where it was saved
+    RE(mv(m1, saved['positions'][0] + 1e-4))
+    RE.msg_hook.msgs.clear()
+    RE(walk(walk_checkpoint=state, resume=True))
+    moves = [msg.args[0] for msg in RE.msg_hook.msgs
+             if msg.command == 'set' and msg.obj is m1]
+    assert np.isclose(moves[0], saved['positions'][0])
+    assert np.isclose(centroid(y2), pixels([y1, y2])[1], atol=TOL)
+    # A converged walk leaves nothing to resume
+    assert state.load(identity) is None
+
+
+def test_iterwalk_deadline(RE, walk):
+    planner = DeadlinePlanner(0.)
+    # An expired deadline finishes without raising
+    RE(walk(deadline=planner))
+    assert planner.expired
+
+
+def test_iterwalk_overlap(RE, lcls_two_bounce_system, walk):
+    s, m1, m2, y1, y2 = lcls_two_bounce_system
+    RE(walk(starts=[m1.position, m2.position], overlap=True))
+    assert np.isclose(centroid(y2), pixels([y1, y2])[1], atol=TOL)
+    # Each mirror moved to its start with the insertion of its imager
+    groups = dict()
+    for msg in RE.msg_hook.msgs:
+        if msg.command == 'set' and msg.kwargs.get('group'):
+            groups.setdefault(msg.kwargs['group'], set()).add(msg.obj)
+    assert any({y1, m1} <= objs for objs in groups.values())
+    assert any({y2, m2} <= objs for objs in groups.values())
+
+
+@pytest.mark.parametrize("emit", ['shots', 'summary'])
+def test_iterwalk_selective_read(RE, lcls_two_bounce_system, walk, emit):
+    s, m1, m2, y1, y2 = lcls_two_bounce_system
+    docs = list()
+    RE(walk(emit=emit, selective_read=True),
+       lambda name, doc: docs.append((name, doc)))
+    assert np.isclose(centroid(y2), pixels([y1, y2])[1], atol=TOL)
+    # Each detector reads its own signals into a separate stream
+    streams = set(doc['name'] for name, doc in docs if name == 'descriptor')
+    assert len(streams) == 2
+    assert 'primary' not in streams
+
+
+def test_iterwalk_timer(RE, walk):
+    timer = PhaseTimer()
+    RE(walk(timer=timer))
+    for phase in ('imager', 'measure', 'walk', 'motion', 'fit'):
+        assert timer.count(phase) > 0
+    # Moves and fits happen within the walks
+    assert timer.total('motion') <= timer.total('walk')
+    # The acquisitions of each walk are timed along with the verifications
+    assert timer.count('measure') > timer.count('imager')
+
+
+def test_iterwalk_profile(RE, walk, tmpdir):
+    path = str(tmpdir.join('profile.json'))
+    RE(walk(profile=path))
+    # The profile is saved once the walk finishes
+    with open(path, 'r') as f:
+        summary = json.load(f)
+    assert summary['elapsed'] > 0
+    assert tmpdir.join('profile.folded').check()
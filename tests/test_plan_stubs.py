@@ -4,13 +4,16 @@ import pytest
 from queue import Queue
 import functools
 import logging
+import time
 
 from bluesky.preprocessors import run_wrapper
+from bluesky.plan_stubs import mv, abs_set, wait, sleep, trigger_and_read
 
 from pswalker.plan_stubs import (prep_img_motors, as_list,
                                  match_condition,
                                  slit_scan_area_comp, slit_scan_fiducialize,
-                                 fiducialize, homs_fiducialize)
+                                 fiducialize, homs_fiducialize,
+                                 merge_plans)
 from pswalker.utils.exceptions import BeamNotFoundError
 from .utils import plan_stash, collector
 from ophyd.sim import SynSignal, SynAxis, NullStatus
@@ -41,6 +44,89 @@ def test_prep_img_motors(RE, fake_yags):
                                 "not moved in with tail_in=True."
 
 
+def test_prep_img_motors_extra_moves(RE, fake_yags):
+    yags = fake_yags[0]
+    motor = SynAxis(name='motor')
+    msgs = []
+    RE.msg_hook = msgs.append
+    RE(prep_img_motors(0, yags, extra_moves=[(motor, 5)]))
+    assert yags[0].blocking
+    assert motor.position == 5
+    # The motor was waited on with the imager
+    sets = dict((msg.obj, msg.kwargs.get('group')) for msg in msgs
+                if msg.command == 'set')
+    assert sets[motor] == sets[yags[0]]
+
+
+def test_merge_plans(RE):
+    motors = [SynAxis(name='m1', delay=0.2), SynAxis(name='m2', delay=0.2)]
+    msgs = []
+    RE.msg_hook = msgs.append
+
+    def branch(motor):
+        for pos in (1, 2, 3):
+            yield from mv(motor, pos)
+            yield from trigger_and_read([motor])
+        return motor.name
+
+    results = list()
+
+    def plan():
+        results.extend((yield from merge_plans(*[branch(mot)
+                                                 for mot in motors])))
+
+    start = time.time()
+    RE(run_wrapper(plan()))
+    # Moves overlap, taking the time of a single branch
+    assert time.time() - start < 5 * 0.2
+    assert results == ['m1', 'm2']
+    assert all(mot.position == 3 for mot in motors)
+    # Each branch waits on its own groups and saves its own stream
+    for mot, label in zip(motors, ('branch0', 'branch1')):
+        groups = [msg.kwargs['group'] for msg in msgs
+                  if msg.command == 'set' and msg.obj is mot]
+        assert all(group.startswith(label + ':') for group in groups)
+    streams = [msg.kwargs['name'] for msg in msgs if msg.command == 'create']
+    assert set(streams) == {'primary_branch0', 'primary_branch1'}
+
+
+def test_merge_plans_ungrouped(RE):
+    motors = [SynAxis(name='m1', delay=0.2), SynAxis(name='m2', delay=0.2)]
+    msgs = []
+    RE.msg_hook = msgs.append
+
+    def branch(motor):
+        yield from abs_set(motor, 1)
+        yield from wait()
+        assert motor.position == 1
+
+    RE(merge_plans(*[branch(mot) for mot in motors]))
+    assert all(mot.position == 1 for mot in motors)
+    # Statuses without a group are left ungrouped
+    assert all(msg.kwargs.get('group') is None for msg in msgs
+               if msg.command in ('set', 'wait'))
+
+
+def test_merge_plans_sleep(RE):
+    def branch(num):
+        for i in range(num):
+            yield from sleep(0.1)
+        return num
+
+    results = list()
+
+    def plan():
+        results.extend((yield from merge_plans(branch(5), branch(3),
+                                               labels=['a', 'b'])))
+
+    start = time.time()
+    RE(plan())
+    assert time.time() - start < 0.8
+    assert results == [5, 3]
+    with pytest.raises(ValueError):
+        RE(merge_plans(branch(1), labels=['a', 'b']))
+
+
 def test_as_list():
     assert as_list(None) == []
     assert as_list(5) == [5]
@@ -1,7 +1,9 @@
 ############
 # Standard #
 ############
+import time
 import logging
+import threading
 
 ###############
 # Third Party #
@@ -9,16 +11,22 @@ import logging
 import lmfit
 import pytest
 import numpy as np
+from ophyd import Signal
 from ophyd.sim import SynSignal, SynAxis, motor, det
 from bluesky.preprocessors import run_wrapper
 
 ##########
 # Module #
 ##########
-from pswalker.plans import measure, measure_average, measure_centroid
+from pswalker.plans import (measure, measure_average, measure_centroid,
+                            measure_stats, measure_monitor, read_timing)
 from pswalker.plans import walk_to_pixel, fitwalk
-from pswalker.callbacks import LiveBuild, LinearFit
-from pswalker.utils.exceptions import FilterCountError
+from pswalker.strategies import SecantStep, BracketStep, TrustRegionStep
+from pswalker.callbacks import LiveBuild, LinearFit, BeamPresence
+from pswalker.buffers import PrecisionStop, AveragingSchedule, SHOT_STREAM
+from pswalker.timing import PhaseTimer
+from pswalker.eventbuilder import EventBuilder
+from pswalker.utils.exceptions import FilterCountError, BeamLostError
 from .utils import collector
 
 logger = logging.getLogger(__name__)
@@ -87,6 +95,24 @@ def test_measure_average(RE, one_bounce_system):
         RE(run_wrapper(measure_average([det, mot], delay=[0.1], num=3)))
 
 
+def test_measure_stats(RE, one_bounce_system):
+    logger.debug("test_measure_stats")
+    _, mot, det = one_bounce_system
+    key = det.name + '_detector_stats2_centroid_x'
+    stats = list()
+
+    def stash():
+        stats.append((yield from measure_stats([det, mot], num=5)))
+
+    RE(run_wrapper(stash()))
+    assert stats[0][key].mean == 250.
+    assert stats[0][key].median == 250.
+    assert stats[0][key].min == stats[0][key].max == 250.
+    assert stats[0][key].std == 0.
+    assert stats[0][key].count == 5
+    assert stats[0][mot.name + '_sim_alpha'].mean == 0.
+
+
 def test_measure_average_system(RE, lcls_two_bounce_system):
     logger.debug("test_measure_average_system")
     _, m1, m2, y1, y2 = lcls_two_bounce_system
@@ -238,8 +264,236 @@ def test_measure(RE):
     plan = run_wrapper(measure([counter],
                        filters={'intensity': lambda x: False},
                        num=500))
-    with pytest.raises(FilterCountError):
+    with pytest.raises(FilterCountError) as exc:
         RE(plan)
+    assert "'intensity': 51" in str(exc.value)
+
+
+def test_measure_early_stop(RE):
+    # Constant detector far from the goal settles after min_num shots
+    plan = run_wrapper(measure([det], num=100,
+                               stop=PrecisionStop('det', min_num=5, goal=50,
+                                                  tolerance=5)))
+    shots = list()
+    RE(plan, {'event': collector('det', shots)})
+    assert len(shots) == 5
+
+
+def test_measure_pipeline(RE):
+    shots = list()
+    plan = run_wrapper(measure([det], num=5, pipeline=True))
+    RE(plan, {'event': collector('det', shots)})
+    assert shots == [1.0, 1.0, 1.0, 1.0, 1.0]
+    # The next shot was triggered ahead of each read, but never more than
+    # one trigger per device was in flight
+    cmds = [msg.command for msg in RE.msg_hook.msgs
+            if msg.command in ('trigger', 'read')]
+    assert cmds[:4] == ['trigger', 'trigger', 'read', 'trigger']
+    assert cmds.count('trigger') == 5
+    with pytest.raises(ValueError):
+        RE(run_wrapper(measure([det], num=5, pipeline=2)))
+
+
+def test_measure_timer(RE):
+    index = -1
+
+    def count():
+        nonlocal index
+        index += 1
+        return index
+
+    counter = SynSignal(name='intensity', func=count)
+    timer = PhaseTimer()
+    # Each rejected shot is timed
+    RE(run_wrapper(measure([counter], filters={'intensity': lambda x: x > 2},
+                           num=5, timer=timer)))
+    assert timer.count('reject') == 2
+
+
+def test_measure_monitor(RE):
+    centroid = Signal(name='centroid', value=0.)
+    readback = Signal(name='readback', value=3.)
+
+    def update():
+        for i in range(50):
+            time.sleep(0.01)
+            centroid.put(float(i % 5))
+
+    stats = list()
+
+    def stash():
+        threading.Thread(target=update).start()
+        stats.append((yield from measure_monitor(
+                            [centroid, readback], num=8,
+                            filters={'centroid': lambda x: x > 0})))
+
+    shots = list()
+    RE(run_wrapper(stash()), {'event': collector('centroid', shots)})
+    # No documents are emitted for the individual shots
+    assert shots == []
+    assert stats[0]['centroid'].count == 8
+    assert stats[0]['centroid'].min > 0
+    assert stats[0]['readback'].mean == 3.
+    # Stalled signals raise
+    with pytest.raises(FilterCountError):
+        RE(run_wrapper(measure_monitor([centroid], num=5, timeout=0.1)))
+
+
+def test_measure_unique(RE):
+    # Every trigger produces a new frame
+    index = -1
+
+    def count():
+        nonlocal index
+        index += 1
+        return index
+
+    counter = SynSignal(name='counter', func=count)
+    shots = list()
+    RE(run_wrapper(measure([counter], num=3, unique='counter')),
+       {'event': collector('counter', shots)})
+    assert shots == [0, 1, 2]
+
+    # A camera that never updates reports the same frame over and over
+    frozen = Signal(name='frozen', value=4)
+    shots = list()
+    with pytest.raises(FilterCountError):
+        RE(run_wrapper(measure([frozen], num=3, unique='frozen',
+                               max_dropped=5)),
+           {'event': collector('frozen', shots)})
+    # Only the first frame was emitted
+    assert shots == [4]
+
+    # A camera slower than the reads repeats each frame a few times, which
+    # only fails if the repeats are consecutive
+    slow = Signal(name='slow', value=0)
+    reads = 0
+
+    def expose():
+        nonlocal reads
+        reads += 1
+        if reads % 3 == 0:
+            slow.put(reads // 3)
+        return reads
+
+    clock = SynSignal(name='clock', func=expose)
+    shots = list()
+    start = time.time()
+    RE(run_wrapper(measure([clock, slow], num=4, unique='slow',
+                           max_dropped=2, delay=0.01)),
+       {'event': collector('slow', shots)})
+    assert shots == [0, 1, 2, 3]
+    # Repeated frames wait for the next frame before reading again
+    assert time.time() - start >= 0.08
+
+
+def test_read_timing():
+    # Simulated detectors without a camera rate skip the beam rate PV
+    start = time.time()
+    assert read_timing([det], delay='auto') == (None, None)
+    assert time.time() - start < 0.5
+    # Repeated frames wait for the delay, or not at all without a rate
+    assert read_timing([det], delay=0.1, unique='det') == (0.1, 0.1)
+    assert read_timing([det], unique='det') == (None, 0.)
+
+
+def test_measure_emit(RE):
+    # Summary saves a single averaged event
+    docs = list()
+    RE(run_wrapper(measure([det, motor], num=5, emit='summary')),
+       lambda name, doc: docs.append((name, doc)))
+    events = [doc for name, doc in docs if name == 'event']
+    assert len(events) == 1
+    value = det.read()['det']['value']
+    assert events[0]['data']['det'] == value
+    # Pages hold every shot in their own stream
+    docs = list()
+    RE(run_wrapper(measure([det, motor], num=5, emit='page')),
+       lambda name, doc: docs.append((name, doc)))
+    streams = dict((doc['uid'], doc['name']) for name, doc in docs
+                   if name == 'descriptor')
+    events = dict((streams[doc['descriptor']], doc) for name, doc in docs
+                  if name == 'event')
+    assert set(events) == {'primary', SHOT_STREAM + '_5'}
+    assert list(events[SHOT_STREAM + '_5']['data']['det']) == [value] * 5
+    # Models ignore the page and fit the summary
+    fit = LinearFit('det', 'motor')
+    RE(run_wrapper(measure([det, motor], num=5, emit='page')),
+       {'all': fit})
+    assert len(fit.ydata) == 1
+    # Pages of a previous run are forgotten
+    RE(run_wrapper(measure([det, motor], num=5, emit='page')),
+       {'all': fit})
+    assert len(fit._shot_pages) == 1
+    with pytest.raises(ValueError):
+        RE(run_wrapper(measure([det], emit='pages')))
+
+
+def test_measure_emit_repeated(RE):
+    # Pages of a different number of shots in one run match their descriptor
+    def twice():
+        yield from measure([det, motor], num=3, emit='page')
+        yield from measure([det, motor], num=5, emit='page')
+        yield from measure([det, motor], num=3, emit='page')
+
+    docs = list()
+    RE(run_wrapper(twice()), lambda name, doc: docs.append((name, doc)))
+    descriptors = dict((doc['uid'], doc) for name, doc in docs
+                       if name == 'descriptor')
+    events = [doc for name, doc in docs if name == 'event']
+    assert len(events) == 6
+    for event in events:
+        desc = descriptors[event['descriptor']]
+        for key, value in event['data'].items():
+            assert list(np.shape(value)) == desc['data_keys'][key]['shape']
+    # Summaries share the primary stream, each page length has its own
+    assert (sorted(desc['name'] for desc in descriptors.values())
+            == ['primary', SHOT_STREAM + '_3', SHOT_STREAM + '_5'])
+
+
+def test_measure_align(RE):
+    # Only keys of the reference device are aligned, the motor readback
+    # passes through however old it is
+    builder = EventBuilder('det')
+
+    def twice():
+        yield from measure([det, motor], num=5, align=builder)
+        assert builder.stats['shots'] == 5
+        yield from measure([det, motor], num=3, align=builder)
+
+    shots = list()
+    RE(run_wrapper(twice()), {'event': collector('motor', shots)})
+    assert len(shots) == 8
+    # The builder was reset at the start of the second measurement
+    assert builder.stats['shots'] == 3
+    assert builder.stats['dropped'] == 0
+
+
+def test_measure_beam_lost(RE):
+    # Beam falls off the detector
+    centroid = Signal(name='centroid', value=0)
+    beam = BeamPresence(centroid='centroid', max_missing=3)
+    shots = list()
+    with pytest.raises(BeamLostError):
+        RE(run_wrapper(measure([centroid], num=5, max_dropped=50,
+                               filters={'centroid': lambda x: x > 0},
+                               beam=beam)),
+           {'event': collector('centroid', shots)})
+    # Gave up long before the dropped shot budget
+    assert len(shots) == 3
+
+
+def test_measure_fields(RE):
+    docs = list()
+    RE(run_wrapper(measure([det, motor], num=2, fields=['motor'],
+                           filters={'det': lambda x: x > 0})),
+       lambda name, doc: docs.append((name, doc)))
+    events = [doc for name, doc in docs if name == 'event']
+    assert len(events) == 2
+    # Only the requested field and the filter key are read
+    assert set(events[0]['data']) == {'motor', 'det'}
+    with pytest.raises(ValueError):
+        RE(run_wrapper(measure([det, motor], fields=['not_a_field'])))
 
 
 def test_fitwalk(RE):
@@ -255,3 +509,67 @@ def test_fitwalk(RE):
     RE(run_wrapper(walk))
 
     assert np.isclose(det.read()['centroid']['value'], 89.4, 0.5)
+
+
+def test_fitwalk_schedule(RE):
+    motor = SynAxis(name='motor')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5*motor.read()['motor']['value'] + 2
+                                 + np.random.normal(0, 0.1))
+    linear = LinearFit('centroid', 'motor', average=1)
+    walk = fitwalk([det], motor, [linear], 89.4, average=50, tolerance=0.5,
+                   schedule=AveragingSchedule(min_average=3))
+    RE(run_wrapper(walk))
+    assert np.isclose(det.read()['centroid']['value'], 89.4, atol=1)
+    # Each step is a single point in the fit
+    assert linear.average is None
+    assert len(linear.ydata) < 10
+
+    # Steps are measured for the distance they are predicted to land at
+    distances = list()
+
+    class RecordingSchedule(AveragingSchedule):
+        def num(self, distance=None, tolerance=None):
+            distances.append(distance)
+            return super().num(distance, tolerance)
+
+    motor.set(0)
+    linear = LinearFit('centroid', 'motor', average=1)
+    walk = fitwalk([det], motor, [linear], 89.4, average=50, tolerance=0.5,
+                   schedule=RecordingSchedule(min_average=3))
+    RE(run_wrapper(walk))
+    # First measurement, naive step, then the step of the model
+    assert distances[0] is None
+    assert abs(distances[1]) > 50
+    assert abs(distances[2]) < 1
+
+
+@pytest.mark.parametrize('emit', ['summary', 'page'])
+def test_fitwalk_emit(RE, emit):
+    motor = SynAxis(name='motor')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5*motor.read()['motor']['value'] + 2)
+    linear = LinearFit('centroid', 'motor', average=1)
+    docs = list()
+    walk = fitwalk([det], motor, [linear], 89.4, average=5, tolerance=0.5,
+                   emit=emit)
+    RE(run_wrapper(walk), lambda name, doc: docs.append((name, doc)))
+    assert np.isclose(det.read()['centroid']['value'], 89.4, 0.5)
+    # Every measurement of the run shares a single stream
+    streams = [doc['name'] for name, doc in docs if name == 'descriptor']
+    assert streams.count('primary') == 1
+    events = [doc for name, doc in docs if name == 'event']
+    assert len(events) > 2
+
+
+@pytest.mark.parametrize('strategy', [SecantStep(), BracketStep(),
+                                      TrustRegionStep()])
+def test_fitwalk_strategy(RE, strategy):
+    motor = SynAxis(name='motor')
+    det = SynSignal(name='centroid',
+                    func=lambda: 5*motor.read()['motor']['value'] + 2)
+    linear = LinearFit('centroid', 'motor', average=1)
+    walk = fitwalk([det], motor, [linear], 89.4, average=1, tolerance=0.5,
+                   strategy=strategy)
+    RE(run_wrapper(walk))
+    assert np.isclose(det.read()['centroid']['value'], 89.4, 0.5)
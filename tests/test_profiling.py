@@ -0,0 +1,99 @@
+############
+# Standard #
+############
+import time
+import json
+import logging
+
+###############
+# Third Party #
+###############
+import numpy as np
+from ophyd.sim import SynAxis
+from bluesky.plan_stubs import mv, trigger_and_read
+from bluesky.preprocessors import run_wrapper
+
+##########
+# Module #
+##########
+from pswalker.profiling import MsgProfiler, StackSampler, plan_stack
+
+logger = logging.getLogger(__name__)
+
+
+def inner(motor):
+    yield from mv(motor, 1)
+    yield from trigger_and_read([motor])
+
+
+def outer(motor):
+    yield from inner(motor)
+    yield from trigger_and_read([motor])
+
+
+def test_plan_stack():
+    motor = SynAxis(name='motor')
+    plan = outer(motor)
+    next(plan)
+    assert plan_stack(plan, modules=(__name__,)) == ['outer', 'inner']
+    # Plans of other modules are skipped
+    assert plan_stack(plan) == []
+    assert 'mv' in plan_stack(plan, modules=None)
+
+
+def test_msg_profiler(RE, tmpdir):
+    motor = SynAxis(name='motor', delay=0.1)
+    profiler = MsgProfiler(modules=(__name__,))
+    RE.msg_hook = profiler
+    RE(profiler.wrapper(run_wrapper(outer(motor))))
+    # Set is paired with its wait
+    assert np.all(profiler.latency('set', 'motor') >= 0.1)
+    assert len(profiler.latency('read', 'motor')) == 2
+    assert len(profiler.latency('wait')) == len(profiler.durations['wait'])
+    counts, edges = profiler.histogram('set')
+    assert counts.sum() == 1
+    # The move is attributed to the plan that made it
+    assert profiler.stacks['outer;inner'] >= 0.1
+    assert profiler.stacks['outer;inner'] > profiler.stacks['outer']
+    # Reports
+    assert 'motor' in profiler.table().get_string()
+    report = profiler.report()
+    assert report['devices']['motor']['set']['count'] == 1
+    path = str(tmpdir.join('profile.json'))
+    profiler.save(path)
+    with open(path, 'r') as f:
+        assert json.load(f)['commands']['read']['count'] == 2
+    with open(str(tmpdir.join('profile.folded')), 'r') as f:
+        assert 'outer;inner ' in f.read()
+
+
+def busy(duration):
+    start = time.time()
+    while time.time() - start < duration:
+        pass
+
+
+def busy_plan(motor):
+    for i in range(3):
+        busy(0.05)
+        yield from trigger_and_read([motor])
+
+
+def test_stack_sampler(RE, tmpdir):
+    motor = SynAxis(name='motor')
+    path = str(tmpdir.join('stack.json'))
+    sampler = StackSampler(path=path, interval=0.002, modules=(__name__,))
+    RE(run_wrapper(sampler.wrapper(busy_plan(motor))))
+    assert not sampler.running
+    assert sampler.samples > 0
+    # The busy loop is sampled within the plan that called it
+    summary = sampler.summary()
+    functions = summary['functions']
+    assert functions[__name__ + '.busy']['self'] > 0.05
+    assert (functions[__name__ + '.busy_plan']['total']
+            >= functions[__name__ + '.busy']['total'])
+    # Saved once the plan finished
+    with open(path, 'r') as f:
+        assert json.load(f)['samples'] == sampler.samples
+    with open(str(tmpdir.join('stack.folded')), 'r') as f:
+        assert __name__ + '.busy ' in f.read()
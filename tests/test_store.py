@@ -0,0 +1,84 @@
+############
+# Standard #
+############
+import logging
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+from pswalker.store import ModelStore, ModelRecord, WalkCheckpoint
+from pswalker.callbacks import LinearResult
+
+logger = logging.getLogger(__name__)
+
+
+def test_model_store_persists(tmpdir):
+    path = str(tmpdir.join('models.json'))
+    store = ModelStore(path)
+    assert store.lookup('m1', 'y1', 'm1_pitch', 'y1_centroid') is None
+    store.record('m1', 'y1', 'm1_pitch', 'y1_centroid', slope=-2.,
+                 intercept=300., slope_err=0.1)
+    # Reloaded from disk
+    record = ModelStore(path).lookup('m1', 'y1', 'm1_pitch', 'y1_centroid')
+    assert isinstance(record, ModelRecord)
+    assert record.slope == -2.
+    assert record.intercept_err is None
+    # Degenerate fits are not stored
+    store.record('m2', 'y2', 'm2_pitch', 'y2_centroid', slope=0.,
+                 intercept=300.)
+    assert store.lookup('m2', 'y2', 'm2_pitch', 'y2_centroid') is None
+
+
+def test_model_store_energy(tmpdir):
+    store = ModelStore(str(tmpdir.join('models.json')),
+                       energy_tolerance=0.1)
+    result = LinearResult(None, {'slope': 1., 'intercept': 0.},
+                          {'slope': np.nan, 'intercept': 0.5}, ndata=5)
+    store.record_fit('m1', 'y1', 'm1_pitch', 'y1_centroid', result,
+                     energy=8.)
+    store.record('m1', 'y1', 'm1_pitch', 'y1_centroid', slope=2.,
+                 intercept=0., energy=10.)
+    # Closest energy within the tolerance
+    assert store.lookup('m1', 'y1', 'm1_pitch', 'y1_centroid',
+                        energy=8.3).slope == 1.
+    assert store.lookup('m1', 'y1', 'm1_pitch', 'y1_centroid',
+                        energy=9.5).slope == 2.
+    assert store.lookup('m1', 'y1', 'm1_pitch', 'y1_centroid',
+                        energy=5.) is None
+    # Replacing the record at the same energy
+    store.record('m1', 'y1', 'm1_pitch', 'y1_centroid', slope=3.,
+                 intercept=0., energy=8.1)
+    record = store.lookup('m1', 'y1', 'm1_pitch', 'y1_centroid', energy=8.)
+    assert record.slope == 3.
+    assert len(store.models[store.key('m1', 'y1', 'm1_pitch',
+                                      'y1_centroid')]) == 2
+    # Without an energy the most recent record is used
+    assert store.lookup('m1', 'y1', 'm1_pitch', 'y1_centroid').slope == 3.
+
+
+class Named:
+    def __init__(self, name):
+        self.name = name
+
+
+def test_walk_checkpoint(tmpdir):
+    path = str(tmpdir.join('walk.json'))
+    checkpoint = WalkCheckpoint(path)
+    identity = WalkCheckpoint.identity([Named('y1'), Named('y2')],
+                                       [Named('m1'), Named('m2')], [10, 20])
+    assert checkpoint.load(identity) is None
+    state = {'index': 1, 'gradients': [2.5, None], 'finished': [True, False]}
+    checkpoint.save(identity, state)
+    assert WalkCheckpoint(path).load(identity) == state
+    # A walk to other goals does not resume
+    other = WalkCheckpoint.identity([Named('y1'), Named('y2')],
+                                    [Named('m1'), Named('m2')], [10, 30])
+    assert checkpoint.load(other) is None
+    checkpoint.clear()
+    assert checkpoint.load(identity) is None
+    checkpoint.clear()
@@ -0,0 +1,162 @@
+############
+# Standard #
+############
+import logging
+
+###############
+# Third Party #
+###############
+import numpy as np
+import pytest
+
+##########
+# Module #
+##########
+from pswalker.strategies import (ModelStep, SecantStep, BracketStep,
+                                 TrustRegionStep, BroydenJacobian,
+                                 CouplingScheduler)
+from pswalker.callbacks import LinearResult
+
+logger = logging.getLogger(__name__)
+
+
+class FakeModel:
+    """Linear model with a fixed result"""
+    def __init__(self, slope, intercept, slope_err=None):
+        self.result = LinearResult(None, {'slope' : slope,
+                                          'intercept' : intercept},
+                                   {'slope' : slope_err}, 10)
+
+    def backsolve(self, target, **kwargs):
+        return {'x' : (target - self.result.values['intercept'])
+                      / self.result.values['slope']}
+
+
+def walk(strategy, func, start, target, tolerance=1e-3, max_steps=50):
+    """Walk a function to a target, returning the number of steps"""
+    strategy.reset()
+    pos = start
+    for step in range(max_steps):
+        value = func(pos)
+        strategy.update(pos, value)
+        if abs(value - target) < tolerance:
+            return step
+        proposal = strategy.propose(target)
+        pos = proposal if proposal is not None else pos + 0.1
+    raise RuntimeError("Strategy did not converge")
+
+
+def test_model_step():
+    strategy = ModelStep()
+    assert strategy.propose(10.) is None
+    assert strategy.propose(10., model=FakeModel(2., 0.)) == 5.
+
+
+def test_secant_step():
+    strategy = SecantStep()
+    strategy.update(0., 1.)
+    # One point is not enough without a model
+    assert strategy.propose(5.) is None
+    assert strategy.propose(5., model=FakeModel(2., 1.)) == 2.
+    strategy.update(1., 3.)
+    assert strategy.propose(5.) == 2.
+    # Damped and limited steps
+    assert SecantStep(damping=0.5).propose(5.) is None
+    strategy.damping, strategy.max_step = 0.5, 0.25
+    assert strategy.propose(5.) == 1.25
+
+
+@pytest.mark.parametrize('strategy', [SecantStep(), BracketStep(),
+                                      TrustRegionStep()])
+def test_strategy_converges(strategy):
+    steps = walk(strategy, lambda x: np.tanh(x) + 0.3*x, 0., 1.)
+    assert steps < 15
+
+
+def test_bracket_step_stays_in_bracket():
+    strategy = BracketStep()
+    func = lambda x: x**3
+    strategy.update(-1., func(-1.))
+    strategy.update(2., func(2.))
+    pos = strategy.propose(1.)
+    assert -1. < pos < 2.
+    strategy.update(pos, func(pos))
+    assert strategy.bracket is not None
+    pos = strategy.propose(1.)
+    assert -1. < pos < 2.
+
+
+def test_trust_region_step():
+    strategy = TrustRegionStep(radius=1.)
+    strategy.update(0., 0.)
+    # Certain slope moves straight to target within the radius
+    assert strategy.propose(0.5, model=FakeModel(1., 0.)) == 0.5
+    # An uncertain slope shortens the step
+    strategy.reset()
+    strategy.update(0., 0.)
+    assert strategy.propose(10., model=FakeModel(1., 0., slope_err=0.5)) == 0.5
+    # Accurate predictions grow the region, poor ones shrink it
+    strategy.update(0.5, 0.5)
+    assert strategy.radius == 2.
+    strategy.propose(10., model=FakeModel(1., 0.))
+    strategy.update(2.5, 0.6)
+    assert strategy.radius == 1.
+
+
+def test_broyden_jacobian():
+    true = np.array([[2., 0.], [3., 1.]])
+    estimate = BroydenJacobian([[2., np.nan], [np.nan, 1.]])
+    assert estimate.missing == [(0, 1), (1, 0)]
+    with pytest.raises(RuntimeError):
+        estimate.step([1., 1.])
+    estimate.jacobian[0, 1] = estimate.jacobian[1, 0] = 0.
+    # Learn the coupling from the steps taken
+    x = np.zeros(2)
+    error = np.array([4., 2.])
+    for i in range(20):
+        step = estimate.step(error)
+        estimate.update(step, true.dot(step))
+        x += step
+        error = np.array([4., 2.]) - true.dot(x)
+        if np.allclose(error, 0):
+            break
+    assert np.allclose(true.dot(x), [4., 2.])
+    assert i < 5
+    # Unknown entries are seeded from a single move of every motor
+    estimate = BroydenJacobian([[2., 0.], [np.nan, np.nan]])
+    estimate.seed([1., 0.], true.dot([1., 0.]))
+    assert np.allclose(estimate.jacobian, [[2., 0.], [3., 0.]])
+    estimate = BroydenJacobian([[np.nan, 0.], [3., np.nan]])
+    estimate.seed([1., 1.], true.dot([1., 1.]))
+    assert np.allclose(estimate.jacobian, true)
+
+
+def test_coupling_scheduler():
+    scheduler = CouplingScheduler([1., 1.], coupling=[[1., 0.], [3., 1.]])
+    # Unknown detectors are visited in order
+    assert scheduler.next_index() == 0
+    scheduler.measured(0, 0.2)
+    assert scheduler.next_index() == 1
+    scheduler.measured(1, 10.)
+    assert scheduler.next_index() == 1
+    # The second mirror does not shift the first detector, which is only
+    # verified once the walk is otherwise done
+    scheduler.moved(1, -9.9)
+    scheduler.measured(1, 0.1)
+    assert not scheduler.converged
+    assert scheduler.next_index(current=1) == 0
+    scheduler.measured(0, 0.2)
+    assert scheduler.converged
+    assert scheduler.next_index() is None
+    # Verification is postponed in favor of a detector that needs a walk
+    scheduler.moved(1, 5.)
+    assert scheduler.next_index() == 1
+    assert scheduler.postponed == 1
+    assert scheduler.reordered == 0
+    # Couplings are learned from single motor moves
+    scheduler = CouplingScheduler([1., 1.])
+    scheduler.measured(1, 0.1)
+    scheduler.moved(0, 2.)
+    assert np.isnan(scheduler.predicted(1))
+    scheduler.measured(1, 6.1)
+    assert np.isclose(scheduler.coupling[1, 0], 3.)
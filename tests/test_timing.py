@@ -0,0 +1,78 @@
+############
+# Standard #
+############
+import time
+import json
+import logging
+
+###############
+# Third Party #
+###############
+import numpy as np
+
+##########
+# Module #
+##########
+from pswalker.timing import PhaseTimer, DeadlinePlanner
+
+logger = logging.getLogger(__name__)
+
+
+def test_phase_timer():
+    timer = PhaseTimer()
+    assert np.isnan(timer.mean('imager'))
+    assert timer.total('imager') == 0.
+    for i in range(2):
+        with timer.phase('imager'):
+            time.sleep(0.01)
+    timer.record('walk', 2.)
+    assert timer.count('imager') == 2
+    assert 0.01 <= timer.mean('imager') < 1.
+    assert timer.total('walk') == 2.
+    timer.reset()
+    assert timer.count('walk') == 0
+
+
+def test_phase_timer_report(tmpdir):
+    timer = PhaseTimer()
+    timer.record('walk', 2.)
+    timer.record('walk', 4.)
+    timer.record('fit', 0.5)
+    report = timer.report()
+    assert report['phases']['walk']['count'] == 2
+    assert report['phases']['walk']['total'] == 6.
+    assert report['phases']['walk']['max'] == 4.
+    assert [event['phase'] for event in report['events']] == ['walk', 'walk',
+                                                              'fit']
+    assert 'events' not in timer.report(events=False)
+    # Saved as JSON, undefined spreads become null
+    path = str(tmpdir.join('timing.json'))
+    timer.save(path)
+    with open(path, 'r') as f:
+        saved = json.load(f)
+    assert saved['phases']['fit']['std'] is None
+    assert saved['phases']['walk']['mean'] == 3.
+
+
+def test_deadline_planner():
+    timer = PhaseTimer()
+    planner = DeadlinePlanner(100., timer=timer, min_factor=0.2)
+    # Nothing measured yet, nothing to trade
+    assert planner.update(visits=4, walks=2) == 1.
+    assert planner.average(20) == 20
+    timer.record(DeadlinePlanner.imager, 10.)
+    timer.record(DeadlinePlanner.measure, 15.)
+    timer.record(DeadlinePlanner.walk, 50.)
+    # Fits in the budget
+    assert planner.update(visits=2, walks=0) == 1.
+    assert planner.eta > time.time()
+    # Projected 200s with 100s left
+    assert np.isclose(planner.update(visits=4, walks=2), 0.5, atol=0.01)
+    assert planner.average(20) == 10
+    assert planner.average(1) == 1
+    assert np.isclose(planner.tol_scaling(4), 2., atol=0.05)
+    assert planner.tol_scaling(None) is None
+    # Never drops below the minimum effort
+    assert planner.update(visits=40, walks=20) == 0.2
+    assert not planner.expired
+    assert DeadlinePlanner(0.).expired
@@ -13,6 +13,7 @@ from bluesky.preprocessors import run_wrapper
 ##########
 from pswalker.watcher import report_tpl, RunSummary, Watcher
 from pswalker.skywalker import skywalker
+from pswalker.timing import PhaseTimer
 
 def test_watcher_report_smoke(RE, lcls_two_bounce_system):
     w = Watcher()
@@ -36,3 +37,18 @@ def test_watcher_report_smoke(RE, lcls_two_bounce_system):
         pass
     #Report
     w.report()
+
+
+def test_watcher_timing():
+    timer = PhaseTimer()
+    w = Watcher(report_hook=None, timer=timer)
+    w.start({'time' : 0, 'uid' : 'start'})
+    timer.record('walk', 3.)
+    w.event({'data' : {'interruption' : 'suspend'}, 'time' : 10,
+             'descriptor' : 'desc'})
+    w.event({'data' : {'interruption' : 'resume'}, 'time' : 12.5,
+             'descriptor' : 'desc'})
+    assert timer.total('suspended') == 2.5
+    w.summary['timing'] = timer.report(events=False)
+    table = w.timing_table().get_string()
+    assert 'suspended' in table and 'walk' in table